@@ -1,16 +1,20 @@
 from flask import Flask, request
 from flask_cors import CORS, cross_origin
-import sqlite3
 import os
 import json
 import pandas as pd
 import numpy as np
+import appendjournal
+import arcgis
 import csvprocessing as cp
+import csvreader
+import dbpool
+import dbschema
+import dfcache
 import geometry_tools as gt
-from shapely.geometry import MultiPoint, mapping, Point
-import urllib
-import urllib.request
-import collections
+import geoserial
+from shapely import wkb
+from shapely.geometry import LineString
 import multiprocessing as mp
 
 
@@ -29,6 +33,16 @@ CORS(app, resources={r"/*":{'origins':'http://localhost:8080', "allow_headers":"
 ####################
 
 sqliteTableList = ["PointsTable", "BuffersTable", "LinesTable", "PeaksTable"]
+# layer table of each layer name suffix, layer names follow the format of csvName + "-type".
+layerTables = {"buffer": "BuffersTable", "path": "LinesTable", "peaks": "PeaksTable"}
+# default number of layers per page of the /layers route.
+layerPageSize = 10
+# most points returned by one /query call.
+queryPointLimit = 50000
+# columns of the points returned by /query.
+queryPointColumns = ["Source_name", "Flight_date", "Senselong", "Senselat", "CH4", "Peak"]
+# dataframe columns written into the PointsTable, in table column order (sqlite column names are case insensitive).
+pointsColumns = ["Microsec", "Flight_Date", "SenseLong", "SenseLat", "CH4", "Peak", "Source_Name", "Utmlong", "Utmlat"]
 bufferResolution = 6
 
 ####################################
@@ -90,9 +104,12 @@ def connectAndUpload(DBpath, tableList):
     error and send that to the front end.
     4, if it has not been recorded either, then create a new database with four table names (peaks, 
     buffers, points, and path) and insert this database path into the MetaDataBase.json.
+    The tables and their indexes are created by the migrations in dbschema.py.
 
-    2 b, If there is such database, query data inside the path, peaks (if there is any), and buffer
-    table only. Organize them in a json format that will be sent to the front end.
+    2 b, If there is such database, upgrade its schema if it was created by an older version, then
+    query the catalog of the path, peaks (if there is any), and buffer table only: the name, bounding box and size
+    of every layer, no geometry. Organize them in a json format that will be sent to the front end, which then
+    loads the geometry of the layers it shows through the /layers route, see fetchLayers().
     ------------------------
     Input parameter: 
         DBpath: string
@@ -105,60 +122,190 @@ def connectAndUpload(DBpath, tableList):
             Json format for back and front end communication: 
             {
                 tableName1: {
-                    dataName1: geojson1,
-                    dataName2: geojson2 .... 
+                    dataName1: {
+                        "bbox": [min long, min lat, max long, max lat],
+                        "parts": number of polygons or lines in the layer geometry,
+                        "size": size of the stored geometry in bytes,
+                        "points": number of points, for path layers only
+                        },
+                    dataName2: {...} .... 
                     },
                 tableName2: {
-                    dataName3: geojson3....
+                    dataName3: {...}....
                 }
             }
     '''
     initialData = {}
-    connection = sqlite3.connect(DBpath)
-    cursor = connection.cursor()
+    # check before connecting, since connecting creates the database file.
     if os.path.exists(DBpath):
-        # load every geojson
+        connection = dbpool.get_connection(DBpath)
+        # upgrade databases created by older versions in place, see dbschema.py
+        dbschema.migrate(connection)
+        cursor = connection.cursor()
+        # catalog of every layer, read from the bounds columns without decoding any geometry.
         for i in tableList[1:]:
-            data = cursor.execute(f"SELECT * FROM {i}").fetchall()
+            data = cursor.execute(f"SELECT Source_name, Min_long, Min_lat, Max_long, Max_lat, Parts, length(Geometry) FROM {i} WHERE Geometry IS NOT NULL ORDER BY rowid").fetchall()
             if not len(data) == 0:
                 initialData[i] = {}
                 for j in data:
-                    initialData[i][j[1]] = j[0]
-                # {tableName: {name1: geometry1, name2: geometry2}}
+                    initialData[i][j[0]] = {"bbox": list(j[1:5]), "parts": j[5], "size": j[6]}
+                    if i == "LinesTable":
+                        initialData[i][j[0]]["points"] = cursor.execute("SELECT count(*) FROM PointsTable WHERE Source_name == ?", [j[0]]).fetchone()[0]
+                # {tableName: {name1: catalog1, name2: catalog2}}
     else:
         if not checkMetaDataBase(DBpath):
-            # create database if not exist
-            for i,j in enumerate(tableList):
-                if i == 0:
-                    create_table = '''\
-                        CREATE TABLE IF NOT EXISTS {tableName} (
-                        "Microsec" INTEGER,
-                        "Flight_date" TEXT,
-                        "Senselong" REAL NOT NULL,
-                        "Senselat" REAL NOT NULL,
-                        "CH4" INTEGER,
-                        "Peak" INTEGER,
-                        "Source_name" TEXT NOT NULL,
-                        "Utmlong" REAL NOT NULL,
-                        "Utmlat" REAL NOT NULL
-                        )\
-                        '''.format(tableName = j)
-                    cursor.execute(create_table)
-                else:
-                    create_table = '''\
-                    CREATE TABLE IF NOT EXISTS {tableName} (
-                        "Geometry" TEXT,
-                        "Source_name" TEXT,
-                        "EsriGeometry" TEXT
-                    )\
-                    '''.format(tableName = j)
-                    cursor.execute(create_table)
-            connection.commit()
+            # create database if not exist, with the tables and indexes of the current schema version.
+            connection = dbpool.get_connection(DBpath)
+            dbschema.migrate(connection)
             insertIntoMetaDataBase(DBpath)
         else:
             initialData["error"] = "DB missing"
     return initialData
 
+def fetchLayers(DBpath, layerNames, page, pageSize, zoom=None):
+    '''
+    ------------------------
+    This function is to load the geometry of some layers, one page at a time, so the front end can render the layers it
+    shows without loading the whole database. The geojson is written from the stored geometry, see toGeoJson().
+    ------------------------
+    Input parameter: 
+        DBpath: string
+                Incoming sqlite database path.
+        layerNames: list or None
+                layer names (csvName + "-type") to load, in the order they should be paged. None loads every layer
+                in the order of the catalog, see connectAndUpload().
+        page: int
+                page number, starting at 0.
+        pageSize: int
+                number of layers per page.
+        zoom: number or None
+                map zoom level, buffers and paths are simplified for it (see loadLayerGeometry). None for the full geometry.
+    ------------------------
+    Return:
+        layers: dict
+            Json format for back and front end communication, the same as the /buffer response plus the paging fields:
+            {
+                tableName1: {
+                    dataName1: geojson1,
+                    dataName2: geojson2 .... 
+                    },
+                tableName2: {
+                    dataName3: geojson3....
+                },
+                "page": page,
+                "nextPage": next page number, or None on the last page,
+                "total": total number of layers
+            }
+    '''
+    cursor = dbpool.get_connection(DBpath).cursor()
+    if layerNames is None:
+        selected = [(i, j[0]) for i in sqliteTableList[1:]
+                    for j in cursor.execute(f"SELECT Source_name FROM {i} WHERE Geometry IS NOT NULL ORDER BY rowid")]
+    else:
+        # names of unknown layer types are skipped.
+        selected = [(layerTables[i.rsplit("-", 1)[-1]], i) for i in layerNames if i.rsplit("-", 1)[-1] in layerTables]
+    start = page * pageSize
+    layers = {i: {} for i in sqliteTableList[1:]}
+    for i in sqliteTableList[1:]:
+        names = [j[1] for j in selected[start:start + pageSize] if j[0] == i]
+        if len(names) > 0:
+            query = f"SELECT Source_name, Geometry, Utm_zone FROM {i} WHERE Geometry IS NOT NULL AND Source_name IN ({', '.join('?' * len(names))})"
+            for j in cursor.execute(query, names).fetchall():
+                layers[i][j[0]] = toGeoJson(loadLayerGeometry(cursor, j[0], j[1], zoom), j[2])
+    layers["page"] = page
+    layers["nextPage"] = page + 1 if start + pageSize < len(selected) else None
+    layers["total"] = len(selected)
+    return layers
+
+def toEpoch(value):
+    '''
+    ------------------------
+    This function is to convert a time sent by the front end into seconds since 1970, the unit of the Epoch column.
+    ------------------------
+    Input parameter: 
+        value: number, string or None
+                seconds since 1970, or a date string such as "2022-06-20 15:30:00". Times without a time zone are UTC,
+                like the stored Flight_date.
+    ------------------------
+    Return:
+        seconds: float or None
+    '''
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+def queryDB(DBpath, bbox, minCH4=None, start=None, end=None, limit=queryPointLimit, zoom=None):
+    '''
+    ------------------------
+    This function is to find the points and layers inside a viewport bounding box, through the R*Tree spatial indexes
+    (see dbschema.py) instead of scanning the tables.
+    1, points: the PointsTree gives the candidate rows, which are then checked against the exact bounding box and the
+    optional CH4 threshold and time range.
+    2, layers (buffers, paths, peaks): every layer whose bounding box intersects the viewport. When a CH4 threshold or a
+    time range is given, only the layers whose csv has at least one point that passes them.
+    ------------------------
+    Input parameter: 
+        DBpath: string
+                Incoming sqlite database path.
+        bbox: list
+                [min long, min lat, max long, max lat] of the viewport, in WGS 1984.
+        minCH4: number or None
+                keep points with a CH4 at least this high.
+        start, end: number or None
+                time range in seconds since 1970 (see toEpoch), both ends included.
+        limit: int
+                most points returned, the response says whether more points matched.
+        zoom: number or None
+                map zoom level, buffers and paths are simplified for it (see loadLayerGeometry). None for the full geometry.
+    ------------------------
+    Return:
+        result: dict
+            {
+                "PointsTable": {column name: list of values of the matching points, for every queryPointColumns},
+                "truncated": true if more than limit points matched,
+                tableName1: {
+                    dataName1: geojson1 ....
+                    },
+                ....
+            }
+    '''
+    minLong, minLat, maxLong, maxLat = [float(i) for i in bbox]
+    cursor = dbpool.get_connection(DBpath).cursor()
+    # optional filters on the points, shared by the point query and the layer filter.
+    filters, filterValues = "", []
+    if minCH4 is not None:
+        filters += " AND p.CH4 >= ?"
+        filterValues.append(float(minCH4))
+    if start is not None:
+        filters += " AND p.Epoch >= ?"
+        filterValues.append(start)
+    if end is not None:
+        filters += " AND p.Epoch <= ?"
+        filterValues.append(end)
+    # tree boxes are rounded outward to 32 bit floats, the points are checked against the exact bounding box again.
+    point_code = '''SELECT {columns} FROM PointsTree t JOIN PointsTable p ON p.rowid = t.id
+        WHERE t.Min_long <= ? AND t.Max_long >= ? AND t.Min_lat <= ? AND t.Max_lat >= ?
+        AND p.Senselong BETWEEN ? AND ? AND p.Senselat BETWEEN ? AND ?{filters} LIMIT ?'''.format(
+        columns = ", ".join("p." + i for i in queryPointColumns), filters = filters)
+    rows = cursor.execute(point_code, [maxLong, minLong, maxLat, minLat, minLong, maxLong, minLat, maxLat] + filterValues + [limit + 1]).fetchall()
+    result = {"PointsTable": {i: [j[k] for j in rows[:limit]] for k, i in enumerate(queryPointColumns)},
+              "truncated": len(rows) > limit}
+    for suffix, table in layerTables.items():
+        layer_code = '''SELECT l.Source_name, l.Geometry, l.Utm_zone FROM {tree} t JOIN {table} l ON l.rowid = t.id
+            WHERE t.Min_long <= ? AND t.Max_long >= ? AND t.Min_lat <= ? AND t.Max_lat >= ?'''.format(
+            tree = dbschema.SPATIAL_INDEXES[table], table = table)
+        if filters:
+            # points of a layer are named after its path, csvName + "-path".
+            layer_code += ''' AND EXISTS (SELECT 1 FROM PointsTable p
+                WHERE p.Source_name == substr(l.Source_name, 1, length(l.Source_name) - {n}) || '-path'{filters})'''.format(
+                n = len(suffix) + 1, filters = filters)
+        result[table] = {}
+        for j in cursor.execute(layer_code, [maxLong, minLong, maxLat, minLat] + filterValues).fetchall():
+            result[table][j[0]] = toGeoJson(loadLayerGeometry(cursor, j[0], j[1], zoom), j[2])
+    return result
+
 def deleteFromDB(DBpath, tableName, dataName):
     '''
     ------------------------
@@ -177,19 +324,22 @@ def deleteFromDB(DBpath, tableName, dataName):
                 indicate whether it has been deleted successfully or not.
     '''
     try:
-        connection = sqlite3.connect(DBpath)
+        connection = dbpool.get_connection(DBpath)
         cursor = connection.cursor()
-        delete_code = '''DELETE FROM {tableName} WHERE Source_name=="{dataName}"'''.format(tableName = tableName, dataName = dataName)
-        cursor.execute(delete_code)
+        delete_code = '''DELETE FROM {tableName} WHERE Source_name == ?'''.format(tableName = tableName)
+        cursor.execute(delete_code, [dataName])
         connection.commit()
         return True
     except:
         return False
 
-def insertGeoJsonIntoDB(DBcursor, tableName, dataName, geometry, esriGeo):
+def insertGeometryIntoDB(DBcursor, tableName, dataName, geom, sr):
     '''
     ------------------------
-    This function is to insert geojson and esrigeometry into the database (not used for inserting points)
+    This function is to insert a layer geometry into the database (not used for inserting points). The geometry is stored
+    once, as WKB in utm together with its utm zone. The geojson for the front end and the esri json for the Arcgis rest api
+    are both written from it when the layer is read, see toGeoJson() and toEsriJson(). Buffers and paths also get
+    simplified copies for the lower zoom levels of the map, see lod_levels() in geometry_tools.py.
     ------------------------
     Input parameter: 
         DBcursor: a sqlite database cursor object
@@ -200,112 +350,186 @@ def insertGeoJsonIntoDB(DBcursor, tableName, dataName, geometry, esriGeo):
                 which table to insert data
         dataName: string
                 name of the inserted data, this is usually the Source_Name of the layers.
-        geometry: geojson string
-                text version of geojson that can be loaded into a json object and sent to the front end.
-        esriGeo: esriJson string
-                text version of esriGeometry, created by the toEsriGeometry function, used to be loaded
-                passed into appended features when using the Arcgis rest api.
+        geom: shapely geometry
+                geometry of the layer in utm projection.
+        sr: int
+            utm zone number of geom, see function find_utm_zone
     ------------------------
     Return:
         None
     '''
-    insert_code = '''INSERT INTO {tableName} VALUES (?, ?, ?)'''.format(tableName = tableName)
-    DBcursor.execute(insert_code, [geometry, dataName, esriGeo])
+    insert_code = '''INSERT INTO {tableName} (Source_name, Geometry, Utm_zone, {boundsColumns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''.format(
+        tableName = tableName, boundsColumns = ", ".join(dbschema.LAYER_BOUNDS_COLUMNS))
+    # bounding box and number of parts for the layer catalog, see connectAndUpload()
+    bounds = dbschema.layer_bounds(geom, sr)
+    DBcursor.execute(insert_code, [dataName, wkb.dumps(geom), sr] + list(bounds))
+    # simplified copies for lower zoom levels, see loadLayerGeometry()
+    if tableName in dbschema.LOD_TABLES:
+        dbschema.insert_levels(DBcursor, dataName, geom, (bounds[1] + bounds[3]) / 2)
+
+def loadLayerGeometry(DBcursor, dataName, geometry, zoom):
+    '''
+    ------------------------
+    This function is to pick the geometry of a layer to send for a map zoom level: the coarsest simplified copy in the
+    LevelsTable that still looks the same as the full geometry at that zoom, or the full geometry when the zoom is
+    higher than every copy, or when the layer has no copies (peaks).
+    ------------------------
+    Input parameter: 
+        DBcursor: a sqlite database cursor object
+        dataName: string
+                Source_name of the layer.
+        geometry: bytes
+                full WKB geometry of the layer.
+        zoom: number or None
+                map zoom level, None for the full geometry.
+    ------------------------
+    Return:
+        geom: shapely geometry in utm
+    '''
+    if zoom is not None:
+        level = DBcursor.execute("SELECT Geometry FROM LevelsTable WHERE Source_name == ? AND Zoom >= ? ORDER BY Zoom LIMIT 1",
+                                 [dataName, float(zoom)]).fetchone()
+        if level is not None:
+            geometry = level[0]
+    return wkb.loads(geometry)
+
+def sqlValues(column):
+    '''
+    ------------------------
+    This function is to convert a dataframe column into a list of python values that sqlite can bind, in one
+    vectorized step per column: numpy numbers become python numbers, NaN and NaT become NULL, and datetimes become
+    the same "YYYY-MM-DD HH:MM:SS" text that to_sql() used to write.
+    ------------------------
+    Input parameter: 
+        column: pandas series
+    ------------------------
+    Return:
+        values: list
+    '''
+    values = column.to_numpy()
+    if values.dtype.kind == "M":
+        missing = np.isnat(values)
+        # whole seconds are written without the fraction, like datetime.isoformat(" ").
+        present = values[~missing]
+        unit = "s" if (present == present.astype("datetime64[s]")).all() else "us"
+        values = np.char.replace(np.datetime_as_string(values, unit=unit), "T", " ").astype(object)
+        values[missing] = None
+        return values.tolist()
+    if values.dtype.kind == "f":
+        missing = np.isnan(values)
+        if missing.any():
+            values = values.astype(object)
+            values[missing] = None
+    return values.tolist()
+
+def insertPointsIntoDB(DBcursor, df):
+    '''
+    ------------------------
+    This function is to bulk insert the points of a cleaned dataframe into the PointsTable. The columns are converted once
+    (see sqlValues) and streamed as row tuples into a single prepared insert statement with executemany, instead of going
+    through DataFrame.to_sql(). Like insertGeometryIntoDB, nothing is committed here, the caller commits once for the whole
+    request, so all the rows of a request are written in one transaction. The Flight_Date is also stored as seconds since
+    1970 in the Epoch column for time range queries, and the PointsTree spatial index is filled by a trigger, see dbschema.py.
+    ------------------------
+    Input parameter: 
+        DBcursor: a sqlite database cursor object
+        df: dataframe
+            cleaned and projected dataframe with all the pointsColumns.
+    ------------------------
+    Return:
+        None
+    '''
+    insert_code = '''INSERT INTO PointsTable ({columns}, "Epoch") VALUES ({marks}, ?)'''.format(
+        columns = ", ".join(f'"{i}"' for i in pointsColumns), marks = ", ".join("?" * len(pointsColumns)))
+    epoch = pd.Series(dbschema.epoch_seconds(df["Flight_Date"]))
+    DBcursor.executemany(insert_code, zip(*[sqlValues(df[i]) for i in pointsColumns] + [sqlValues(epoch)]))
 
 ##############################################
 # functions to handle geojson and conversion #
 ##############################################
 
-# convert geojson into esri geometry for polygons only.
-def toEsriGeometry(geoJson):
+def toGeoJson(geom, sr):
+    '''
+    ------------------------
+    This function is to write the geojson string of a utm geometry for front end leaflet (UTM to WGS). The string is written
+    with single quotes instead of double quotes, the format the front end has always received, see geoserial.py.
+    ------------------------
+    Input parameter: 
+        geom: shapely geometry
+                geometry in utm projection, usually loaded from the database.
+        sr: int
+            utm zone number of geom, see function find_utm_zone
+    ------------------------
+    Return:
+        geo_j: geojson string
+    '''
+    return geoserial.geojson(gt.reproject(geom, 4326, sr), quote="'")
+
+def toEsriJson(geom):
     '''
     ------------------------
-    This function is to use looping to convert regular polygon type of geojson into an esriGeometry json string.
-    Example:
-    convert {"type": "Polygon", "coordinates": [[[xxxx, xxxx], [xxxxx, xxxxx]]}
-    to {"rings": [[xxxxx, xxxx], [xxxxx, xxxx]]}
-    Likely to be the source of bug, since when the polygon is complicated and large, their inner nested list structed is hard to
-    be cleared looped and converted to an esriGeometry.
+    This function is to write the esriGeometry json string of a utm polygon, used in appended features when using the
+    Arcgis rest api.
     ------------------------
     Input parameter: 
-        geoJson: geojson object
-                input geojson for conversion
+        geom: shapely Polygon or MultiPolygon
+                polygon in utm projection, usually loaded from the database.
     ------------------------
     Return:
-        esriGeometry: esriGemometry json string
-                output esriGeometry string to be saved into database
+        esriJson: esriGeometry json string
     '''
-    esriGeometry = {'rings': []}
-    if geoJson["type"] == 'Polygon':
-        for i in geoJson["coordinates"]:
-                esriGeometry['rings'].append(i)
-    else:
-        for i in geoJson["coordinates"]:
-            for j in i:
-                esriGeometry['rings'].append(j)
-    return json.dumps(esriGeometry)
+    return geoserial.esri_polygon(geom)
 
-# functions to create buffer and path json.
-def createBuff(points, buffDis, sr):
+# functions to create buffer and path geometry.
+def createBuff(utm, buffDis):
     '''
     ------------------------
-    This function is create the buffer around the given points and perform coordinate conversion for front end leaflet
-    (WGS to UTM), while also crating the esriGeoemtry along the way.
+    This function is create the buffer around the given points. The buffer stays in utm, the projection it is stored in.
     ------------------------
     Input parameter: 
-        points: shapely multipoint list
-                multipoints based on which the buffer will be created.
+        utm: numpy array
+                (n, 2) array of the ordered utm coordinates of the points, based on which the buffer will be created.
         buffDis: float or int
                 buffer distance, usually 15m.
-        sr: int
-            utm zone number, see function find_utm_zone
     ------------------------
     Return:
-        geo_j: geojson string
-                string that represents the geojson structure, used to be saved into database, thus replacing double quote with
-                single quote, since sqlite only accepts string with single quote.
-        esriJson: esriGemometry string
-                string that represents the esriGeometry, used to be saved into database, also with double quote replaced.
-    '''
-    buff = points.buffer(buffDis, resolution=bufferResolution)
-    # create esriJson
-    rawJson = mapping(buff)
-    esriJson = toEsriGeometry(rawJson).replace('"', "'")
-    # create geoJson
-    buff = gt.reproject(buff, 4326, sr)
-    geo_j = gt.shapely_to_geojson(buff).replace('"', "'")
-    return geo_j, esriJson
+        buff: shapely Polygon or MultiPolygon
+                buffer polygon in utm projection.
+    '''
+    # line based approximation of the union of a circle around every point, see coverage_buffer() in geometry_tool.py.
+    buff = gt.coverage_buffer(utm, buffDis, quad_segs=bufferResolution)
+    return buff
 
 def createPath(df):
     '''
     ------------------------
-    This function is to create a geojson string that represents a simplified line from a dataframe that contains the points cooridnates.
+    This function is to create a simplified line from a dataframe that contains the points cooridnates.
     The exact method of converting a group of points to a line is called rdp(), see rdp() from geometry_tool.py.
+    The simplification runs on the wgs coordinates, the line is built from the utm coordinates of the kept points.
     ------------------------
     Input parameter: 
         df: dataframe
-            dataframe that contains points coordiantes, which are SenseLong and SenseLat
+            dataframe that contains points coordiantes, which are SenseLong and SenseLat, and Utmlong and Utmlat
     ------------------------
     Return:
-        str(lineDict): geojson string
-                        geojson string that represents a line
+        line: shapely LineString
+                simplified line in utm projection
     '''
     points = df[["SenseLong", "SenseLat"]].to_numpy()
-    lineDict = {'type': 'LineString'}
-    lineDict['coordinates'] = gt.rdp(points, 0.0001)
-    return str(lineDict)
+    utm = df[["Utmlong", "Utmlat"]].to_numpy()
+    line = LineString(utm[gt.rdp_indices(points, 0.0001)])
+    return line
 
 # sniffer drone peaks creating function
-def createSnifferPeaks(points, sr, df, conn):
+def createSnifferPeaks(df, conn):
     '''
     ------------------------
     This function has several tasks:
     1, it will firstly identify peaks from the input dataframe, which contains coordinate and ch4 information. It will add a new column to the
     dataframe, with 1 indicating peaks, 0 indicating none-peaks.
-    2, it will then extract x and y coordinate from the input points list (in utm), make them into new columns, and add to the dataframe.
+    2, the x and y coordinate of the points (in utm) are already columns of the dataframe, see project_df() in geometry_tools.py.
     This step is critical, since when appending the points and peaks later, the field map is in utm projection.
-    3, Then it will turn the dataframe with selected columns into a sqlite table. By setting if-exist attributes, to_sql() can "append"
-    the data into database.
+    3, Then it will insert the selected columns of the dataframe into the PointsTable, see insertPointsIntoDB().
     4, Then it filters the input point list, if there is no peaks, then return none. This looping step may seem unnecessary. However, 
     this is because: 
         a) leaflet only receives wgs projection, while shapely buffer works under UTM projection. 
@@ -315,42 +539,31 @@ def createSnifferPeaks(points, sr, df, conn):
            shared among two tasks. 
         d) thus, we obtain all the points under UTM projection first (do the reproject() once), no matter whether we are doing peak task 
            or buffer task. Then we filter out the peaks within the points data from the field.
-    5, if there are peaks, we create the peak multipoints, create only the outer buffer so far (for front end view only), reproject json back to wgs,
-    and create the json string for inserting into database.
+    5, if there are peaks, we create the peak multipoints and create only the outer buffer so far (for front end view only), in utm
+    for inserting into database.
     ------------------------
     Input parameter: 
-        points: shapely multipoints
-                all the points for this csv data.
-        sr: int
-            utm zone number, see function find_utm_zone 
         df: dataframe
             cleaned dataframe with all the points information.
         conn: sqlite3 database connection
-            this is mainly to excute the to_sql() function.
+            this is mainly to insert the points, see insertPointsIntoDB().
     ------------------------ 
     Return:
-        geo_j: geojson string
-            geojson string that represents the outer buffer polygon for the peaks
+        buff: shapely Polygon or MultiPolygon
+            outer buffer polygon for the peaks in utm projection, None if there is no peak
     '''
     cp.find_ch4_peaks(df)
-    # 1, add utmlong and utmlat colums.
-    df["Utmlong"] = [i.x for i in points]
-    df["Utmlat"] = [i.y for i in points]
+    # 1, utmlong and utmlat colums are added by geometry_tools.project_df.
     # 2, add the new df into sqlite point table
-    df[["Microsec", "Flight_Date", "SenseLong", "SenseLat", "CH4", "Peak", "Source_Name", "Utmlong", "Utmlat"]].to_sql(name="PointsTable", con=conn, if_exists='append', index=False)
+    insertPointsIntoDB(conn.cursor(), df)
     # 3, filter peaks
     peaks = df[df['Peak'] == 1]
     if len(peaks) == 0:
         return None
-    peakList = []
-    for i in peaks.index:
-        peakList.append((points[i].x, points[i].y))
-    peakPoints = MultiPoint(peakList)
+    peakPoints = gt.multipoint_from_xy(peaks["Utmlong"].to_numpy(), peaks["Utmlat"].to_numpy())
     # 4, create outer buffer for front end view only.
     buff = peakPoints.buffer(13.57884, resolution=bufferResolution)
-    buff = gt.reproject(buff, 4326, sr)
-    geo_j = gt.shapely_to_geojson(buff).replace('"', "'")
-    return geo_j
+    return buff
 
 #############################
 # Arcgis rest api functions #
@@ -360,6 +573,8 @@ def get_token(userName, passWord):
     '''
     ------------------------
     This function is to get the token from the arcgis rest api. The token is used for following arcgis rest api functions.
+    Tokens are cached per user (see TokenManager in arcgis.py), so later requests of the same user skip the generateToken
+    call, and a token is generated again shortly before it expires, also inside the appending processes.
     ------------------------
     Input parameter: 
         userName: string
@@ -368,28 +583,23 @@ def get_token(userName, passWord):
                 password string passed from the front end.
     ------------------------
     Return:
-        token: string
+        token: TokenManager, accepted by the rest api functions of arcgis.py in place of a token string. None if the
+               login fails.
     '''
-    referer = "http://www.arcgis.com/"
-    query_dict = {'username': userName, 'password': passWord,
-                    'referer': referer, 'expiration': 900}
-    query_string = urllib.parse.urlencode(query_dict).encode('utf-8')
-    url = "https://www.arcgis.com/sharing/rest/generateToken"
-    token = json.loads(urllib.request.urlopen(url + "?f=json", query_string).read())
-
-    if "token" not in token:
-        print(token['error'])
+    token = arcgis.token_manager(userName, passWord)
+    try:
+        token.token()
+    except (RuntimeError, OSError) as error:
+        print(error)
         return None
-    else:
-        return token["token"]
+    return token
 
-def add_point_features(token, features, targetUrl):
+def add_point_features(token, features, targetUrl, returnJson, journal=None):
     '''
     ------------------------
-    This function is to call the add_feature arcgis rest api to append point features. Since the arcgis rest api
-    shows adding response for each feature added, the response for this rest api is usually gigantic. Thus, this
-    function so far is designed in a way that we assume we will always add points data successfully, since the
-    esri geometry for points data are usually extremely simple. 
+    This function is to append point features through the add_feature arcgis rest api. The points are sent in chunks
+    that stay under the record and size limits of the service, several chunks at a time, see add_features() in arcgis.py.
+    The layer name is added to pointsAppended if all of its points are appended, otherwise to pointsFail.
     ------------------------
     Input parameter: 
         token: rest api token
@@ -399,23 +609,24 @@ def add_point_features(token, features, targetUrl):
             "attribute" and "geometry", see https://developers.arcgis.com/rest/services-reference/enterprise/add-features.htm
     targetUrl: url string
             url for target web layer. Usually, this will be stored in the project file for the inspection.
+    returnJson: multiprocess dictionary
+            this is a multiprocess json dictionary that will record the appending result and will be sent to the front end
+            for rendering.
+    journal: AppendJournal
+            append journal of the project database, see appendjournal.py. None to append without a journal.
     ------------------------
     Return:
         None
     '''
-    appending_dict = {"f": "json",
-                    "token": token,
-                    "features": features
-                    }
-    urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
+    appendFeatures(token, features, targetUrl, returnJson, "-path", "pointsAppended", "pointsFail", "points", journal)
 
-def add_buffer_features(token, features, targetUrl, returnJson):
+def add_buffer_features(token, features, targetUrl, returnJson, journal=None):
     '''
     ------------------------
     Similar to the add point feature function, this function is to call the add_feature rest api to append buffer polygon features. 
-    However, this function will modify the returnJson base on the appending result. If the appended json is invalid, layer name
-    will be appended to the invalidJson list. If being appended successfully, the layer name will be appended to the success list, 
-    otherwise to the fail list. 
+    However, this function will modify the returnJson base on the appending result. If a request is rejected as a whole, e.g.
+    the appended json is invalid, "buffer" will be appended to the invalidJson list. If being appended successfully, the layer
+    name will be appended to the success list, otherwise to the fail list. 
     ------------------------
     Input parameter: 
         token: rest api token
@@ -427,40 +638,21 @@ def add_buffer_features(token, features, targetUrl, returnJson):
         returnJson: multiprocess dictionary
                 this is a multiprocess json dictionary that will record the appending result and will be sent to the front end
                 for rendering. Multiprocess is used to save time.
+        journal: AppendJournal
+                append journal of the project database, see appendjournal.py. None to append without a journal.
     ------------------------
     Return:
         None
     '''
-    appending_dict = {"f": "json",
-                    "token": token,
-                    "features": features
-                    }
-    jsonResponse = urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
-    jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-    if "error" in jsonOutput.keys():
-        # the entire feature collection json is not formated correctly, not matter whether it is peaks or buffer
-        returnJson["invalidJson"] += ["buffer"]
-    else:
-        for i,j in enumerate(jsonOutput['addResults']):
-            layerName = features[i]["attributes"]["Source_Name"] + "-buffer"
-            if j['success']:
-                returnJson["bufferSuccess"] += [layerName]
-            else:
-                returnJson["bufferFail"] += [layerName]
+    appendFeatures(token, features, targetUrl, returnJson, "-buffer", "bufferSuccess", "bufferFail", "buffer", journal)
 
-def add_peak_features(token, features, targetUrl, returnJson, peaksDict):
+def add_peak_features(token, features, targetUrl, returnJson, journal=None):
     '''
     ------------------------
     1, Similar to the add point feature function, this function is to append peak features to the target url through rest api. However, this
-    function will also record the layer name if the input json is in invalid json format.
-    2, If the json is valid, the layer name will be added into the success list, if being appneded successfully. Otherwise, the layer name
-    will be added to the fail list.
-    3, There is more to the fail and success judging process. Since for peaks, each row in the field map is the center of a peak, and there
-    are always even number of rows and every two rows contain duplicated attributes (but with different buffer distance), there will always
-    be even number of appending response from the rest api. If all of peaks for a single layer are showing success response, then we add 
-    the layer name to the success list. If any one of those peaks from a single layer is showing failing reponse, we skip all of the rest of
-    the appending response for that layer, and insert the layer name into the fail list. This is achieved through an external dictionary that
-    record how many peaks are there in a single layer, as well as performing index jump on the response.
+    function will also record "peaks" in the invalidJson list if a request is rejected as a whole.
+    2, Each peak of a layer is two features (buffered twice). If all of the features of a layer are appended successfully, the layer name
+    is added into the success list. If any one of them fails, the layer name is added to the fail list.
     ------------------------
     Input parameter: 
         token: rest api token
@@ -472,73 +664,151 @@ def add_peak_features(token, features, targetUrl, returnJson, peaksDict):
         returnJson: multiprocess dictionary
                 this is a multiprocess json dictionary that will record the appending result and will be sent to the front end
                 for rendering. Multiprocess is used to save time.
-        peaksDict: dictionary
-                a dictionary to record how many peaks are there inside a layer, usually containing even number of elements.
+        journal: AppendJournal
+                append journal of the project database, see appendjournal.py. None to append without a journal.
     ------------------------
     Return:
         None
     '''
-    appending_dict = {"f": "json",
-                    "token": token,
-                    "features": features
-                    }
-    jsonResponse = urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
-    jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-    if "error" in jsonOutput.keys():
-        # the entire feature collection json is not formated correctly, not matter whether it is peaks or buffer
-        returnJson["invalidJson"] += ["peaks"]
-    else:
-        appendIndex = 0
-        skippedIndexNumber = 0
-        while appendIndex < len(jsonOutput['addResults']):
-            result = jsonOutput['addResults'][appendIndex]
-            # recombine the layer name
-            layerName = features[appendIndex]["attributes"]["Source_Name"] + "-peaks"
-            # get the total number of peaks of current appended layers and compare it with the current appendIndex
-            totalPeaksNumber = peaksDict[features[appendIndex]["attributes"]["Source_Name"]]
-            if result["success"]:
-                # if append success and if the current index - previously skipped index + 1 = total peaks number, then add peaks layer name to the returnJson
-                if appendIndex - skippedIndexNumber + 1 == totalPeaksNumber:
-                    returnJson["peaksSuccess"] += [layerName]
-                    skippedIndexNumber += totalPeaksNumber
-                appendIndex += 1
-            else:
-                # if append fail, skip to the index of next layer, make skipping step = old skipped index number + current total peaks number.
-                returnJson["peaksFail"] += [layerName]
-                appendIndex = skippedIndexNumber + totalPeaksNumber
-                skippedIndexNumber += totalPeaksNumber
+    appendFeatures(token, features, targetUrl, returnJson, "-peaks", "peaksSuccess", "peaksFail", "peaks", journal)
 
-def query_feature(token, sql, targetUrl):
+def appendFeatures(token, features, targetUrl, returnJson, suffix, successKey, failKey, featureType, journal=None):
     '''
     ------------------------
-    This function is to query whether there has been data in the field map. This is to avoid appending features repeatedly. 
-    Usually, the source name is used for the query.
+    Shared part of the add feature functions. The features are appended with add_features() in arcgis.py and the results are
+    grouped by Source_Name, a layer succeeds only if all of its features are appended.
+    ------------------------
+    Input parameter: 
+        token: rest api token
+        features: list
+                features to append.
+        targetUrl: string 
+                url for the target web layer.
+        returnJson: multiprocess dictionary
+                the appending result.
+        suffix: string
+                suffix of the layer names, e.g. "-buffer".
+        successKey, failKey: string
+                returnJson lists of the appended and failed layer names.
+        featureType: string
+                name recorded in the invalidJson list when a request is rejected as a whole.
+        journal: AppendJournal
+                append journal, the chunks left unfinished in it for targetUrl are sent first and counted in the result.
+    ------------------------
+    Return:
+        None
+    '''
+    names, results, errors = arcgis.add_features(token, targetUrl, features, journal=journal)
+    succeeded, failed = arcgis.source_summary(names, results)
+    if errors:
+        print(featureType, "append errors:", errors)
+        returnJson["invalidJson"] += [featureType]
+    returnJson[successKey] += [i + suffix for i in succeeded]
+    returnJson[failKey] += [i + suffix for i in failed]
+
+def uploadedLayers(token, layerUrls):
+    '''
+    ------------------------
+    This function is to check which layers have already been appended to the field map, to avoid appending features
+    repeatedly. The source name (csv name) of the layers is used for the check. Instead of one query per layer, the
+    layers are grouped by target url and checked with one batched query per url, see existing_source_names() in arcgis.py.
+    If the check fails for a target url (error response, connection error), its layers are returned as unchecked and the
+    other urls are still checked.
     ------------------------
     Input parameter: 
         token: rest api token
                 this token is used for this and following api calls.
-        sql: string
-            a similar sql where clause that is used for the query.
-        targetUrl: string
-                    url for the target web layer
+        layerUrls: dict
+                layer name (csvName + '-type') to the url of the target web layer it is appended to.
     ------------------------
     Return:
-        true or false: bool
-                        indicate whether queried data exist or not.
+        uploaded: set
+                names of the layers whose source name is already in their target web layer.
+        unchecked: set
+                names of the layers whose target web layer could not be checked.
     '''
-    # sql = "Source_Name = 'N1_15_2.8_20220620_153056.csv'"
-    query_dict = {"f": "json", "token": token, "where": sql}
-    jsonResponse = urllib.request.urlopen(targetUrl + r"/query", urllib.parse.urlencode(query_dict).encode('utf-8'))
-    jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-    if len(jsonOutput["features"]) > 0:
-        return True
-    else:
-        return False
+    layersByUrl = {}
+    for layer, url in layerUrls.items():
+        layersByUrl.setdefault(url, []).append(layer)
+    uploaded, unchecked = set(), set()
+    for url, layers in layersByUrl.items():
+        try:
+            existing = arcgis.existing_source_names(token, url, [i.split("-")[0] for i in layers])
+        except (RuntimeError, ValueError, OSError) as error:
+            print("could not check the layers already in", url, error)
+            unchecked.update(layers)
+            continue
+        uploaded.update(i for i in layers if i.split("-")[0] in existing)
+    return uploaded, unchecked
+
+def layersToSkip(token, journal, layerUrls):
+    '''
+    ------------------------
+    This function is to find the layers that should not be collected for appending. Those are the layers already in the
+    field map (see uploadedLayers()), the layers whose target web layer could not be checked, since appending them could
+    duplicate their features, and the layers with chunks left unfinished in the append journal by an interrupted append.
+    The unfinished chunks are sent first by the next add_features() call on their target url, so those layers are
+    resumed instead of being collected and appended again.
+    ------------------------
+    Input parameter: 
+        token: rest api token
+        journal: AppendJournal
+                append journal of the project database.
+        layerUrls: dict
+                layer name (csvName + '-type') to the url of the target web layer it is appended to.
+    ------------------------
+    Return:
+        skipped: set
+                names of the layers not to collect.
+        resuming: bool
+                whether there are unfinished chunks for any of the target urls.
+        unchecked: set
+                names of the skipped layers whose target web layer could not be checked, see reportUnchecked().
+    '''
+    unfinished = {url: journal.unfinished_names(url) for url in set(layerUrls.values())}
+    resumed = {i for i, url in layerUrls.items() if i.split("-")[0] in unfinished[url]}
+    uploaded, unchecked = uploadedLayers(token, {i: url for i, url in layerUrls.items() if i not in resumed})
+    return uploaded | unchecked | resumed, any(unfinished.values()), unchecked
+
+def reportUnchecked(returnJson, unchecked):
+    '''
+    ------------------------
+    This function is to record the layers that were not appended because their target web layer could not be checked
+    (see uploadedLayers()) in the fail lists of the returnJson, so the user can append them again later.
+    ------------------------
+    Input parameter: 
+        returnJson: multiprocess dictionary
+                the appending result.
+        unchecked: set
+                layer names (csvName + '-type').
+    ------------------------
+    Return:
+        None
+    '''
+    for i in sorted(unchecked):
+        failKey = "bufferFail" if i[-1] == "r" else "peaksFail" if i[-1] == "s" else "pointsFail"
+        returnJson[failKey] += [i]
 
 ##################################
 # communicate with the front end #
 ##################################
 
+@app.teardown_appcontext
+def releaseConnections(exception):
+    '''
+    ------------------------
+    This function runs after every request. Database connections stay open in the pool for the next request,
+    but whatever the request did not commit is rolled back, and connections of finished threads are closed.
+    see end_request() in dbpool.py.
+    ------------------------
+    Input parameter: 
+        exception: the exception that ended the request, or None
+    ------------------------
+    Return:
+        None
+    '''
+    dbpool.end_request()
+
 @app.route('/', methods=["GET", "POST"])
 def index():
     '''
@@ -564,7 +834,8 @@ def accessDB():
     2, Then it will extract the database path/name sent from the front end. The json for communication has the format of
     {"DBpath": "some/path/or/name"}. Note that usually the front end just sends a database name, and that name will be 
     converted to an absolute path and saved to the MetaDataBase.json.
-    3, at last connectAndUpload() is called to query database and fetch data.
+    3, at last connectAndUpload() is called to query the catalog of the layers in the database. The geometry itself
+    is loaded afterwards through the /layers route.
     ------------------------
     Input parameter: 
         json sent from the front end, obtained by using the request.json["keyname"]
@@ -575,13 +846,14 @@ def accessDB():
                         Json format for back and front end communication: 
                         {
                             tableName1: {
-                                dataName1: geojson1,
-                                dataName2: geojson2 .... 
+                                dataName1: {"bbox": [...], "parts": n, "size": n},
+                                dataName2: {...} .... 
                                 },
                             tableName2: {
-                                dataName3: geojson3....
+                                dataName3: {...}....
                             }
                         }
+                        see connectAndUpload() for the catalog fields.
     '''
     if request.method == "POST":
         # create the collection of all database paths.
@@ -596,6 +868,63 @@ def accessDB():
         return connectAndUpload(localPath, sqliteTableList)
     return ("Connect to database")
 
+@app.route('/layers', methods=["GET", "POST"])
+@cross_origin()
+def layers():
+    '''
+    ------------------------
+    This function is responding to the front end when it loads the geometry of layers listed in the catalog sent by
+    /accessDB, one page at a time. The front end keeps asking for "nextPage" until it is None.
+    ------------------------
+    Input parameter: 
+        json sent from the front end:
+        {
+            "layers": ["csvName1-buffer", "csvName1-path", ....] (optional, every layer of the database if missing),
+            "page": 0 (optional),
+            "pageSize": 10 (optional),
+            "zoom": 12 (optional, map zoom level, full geometry if missing)
+        }
+    ------------------------
+    Return:
+        response json: json dictionary
+                        geojson of the layers of the page, see fetchLayers()
+    '''
+    if request.method == "POST":
+        form = request.json or {}
+        page = max(int(form.get("page", 0)), 0)
+        pageSize = max(int(form.get("pageSize", layerPageSize)), 1)
+        return fetchLayers(localPath, form.get("layers"), page, pageSize, form.get("zoom"))
+    return ("Load layers from database")
+
+@app.route('/query', methods=["GET", "POST"])
+@cross_origin()
+def query():
+    '''
+    ------------------------
+    This function is responding to the front end when the map viewport changes. It returns the points and layers
+    inside the viewport, see queryDB().
+    ------------------------
+    Input parameter: 
+        json sent from the front end:
+        {
+            "bbox": [min long, min lat, max long, max lat],
+            "minCH4": 100 (optional),
+            "start": "2022-06-20 08:00:00" or seconds since 1970 (optional),
+            "end": "2022-06-20 18:00:00" or seconds since 1970 (optional),
+            "limit": 50000 (optional, most points returned),
+            "zoom": 12 (optional, map zoom level, full geometry if missing)
+        }
+    ------------------------
+    Return:
+        response json: json dictionary
+                        points and layer geojson in the viewport, see queryDB()
+    '''
+    if request.method == "POST":
+        form = request.json or {}
+        limit = max(int(form.get("limit", queryPointLimit)), 0)
+        return queryDB(localPath, form["bbox"], form.get("minCH4"), toEpoch(form.get("start")), toEpoch(form.get("end")), limit, form.get("zoom"))
+    return ("Query the database")
+
 @app.route('/delete/<table>/<dataName>', methods=["DELETE"])
 @cross_origin()
 def delete(table, dataName):
@@ -679,8 +1008,8 @@ def buffer():
         bufferIndex = 0
         # prepare json for front end
         returnedJson = {"BuffersTable": {}, "LinesTable": {}, "PeaksTable": {}}
-        # connect to database
-        connection = sqlite3.connect(localPath)
+        # connect to database, pooled per thread, see dbpool.py
+        connection = dbpool.get_connection(localPath)
         cursor = connection.cursor()
         # obtain csv data and related info.
         for i in request.files:
@@ -690,60 +1019,47 @@ def buffer():
             data = request.files.get(i)
             if insepctionType == "S":
                 # 2, SnifferDrone: Ben's algorithm to create geojson.
-                csvDf = pd.read_csv(data)
-                cleanedDf = cp.clean_flight_log(csvName+"-path", csvDf)
+                cleanedDf = dfcache.load_sniffer(data, csvName+"-path")
 
-                # 3, add a column of points
-                gt.add_points_to_df(cleanedDf)
-                points = gt.series_to_multipoint(cleanedDf["points"])
-                # 4, pre project the points to prepare for buffer.
-                sr = gt.find_utm_zone(points[0].y, points[0].x)
-                points = gt.reproject(points, sr)
+                # 3, 4, points pre projected to utm to prepare for buffer, cached with the cleaned csv.
+                utm = cleanedDf[["Utmlong", "Utmlat"]].to_numpy()
+                sr = cleanedDf.attrs["utm_zone"]
 
                 # 5, add into database based on types and load onto json. name: csvName-buffer, csvName-peaks.....
-                buffJson = createBuff(points, bufferDistance, sr)
-                insertGeoJsonIntoDB(cursor, "BuffersTable", csvName+"-buffer", buffJson[0], buffJson[1])
-                returnedJson["BuffersTable"][csvName+"-buffer"] = buffJson[0]
+                buff = createBuff(utm, bufferDistance)
+                insertGeometryIntoDB(cursor, "BuffersTable", csvName+"-buffer", buff, sr)
+                returnedJson["BuffersTable"][csvName+"-buffer"] = toGeoJson(buff, sr)
 
                 # while creating peaks, also insert points into point table.
-                peakJson = createSnifferPeaks(points, sr, cleanedDf, connection)
-                if peakJson:
-                    insertGeoJsonIntoDB(cursor, "PeaksTable", csvName+"-peaks", peakJson, "")
-                returnedJson["PeaksTable"][csvName+"-peaks"] = peakJson
+                peakBuff = createSnifferPeaks(cleanedDf, connection)
+                if peakBuff is not None:
+                    insertGeometryIntoDB(cursor, "PeaksTable", csvName+"-peaks", peakBuff, sr)
+                returnedJson["PeaksTable"][csvName+"-peaks"] = toGeoJson(peakBuff, sr) if peakBuff is not None else None
 
-                pathJson = createPath(cleanedDf)
-                insertGeoJsonIntoDB(cursor, "LinesTable", csvName+"-path", pathJson, "")
-                returnedJson["LinesTable"][csvName+"-path"] = pathJson
+                path = createPath(cleanedDf)
+                insertGeometryIntoDB(cursor, "LinesTable", csvName+"-path", path, sr)
+                returnedJson["LinesTable"][csvName+"-path"] = toGeoJson(path, sr)
 
             else:
                 # 2, Inficon: Ben's algorithm to create geojson.
-                while data.readline().decode() != '\r\n':
-                    pass
-                csvDf = pd.read_csv(data)
-                cleanedDf = cp.cleanInficon(csvName+"-path", csvDf)
-
-                # 3, add a column of points
-                gt.add_points_to_df(cleanedDf)
-                points = gt.series_to_multipoint(cleanedDf["points"])
-                # 4, pre project the points to prepare for buffer.
-                sr = gt.find_utm_zone(points[0].y, points[0].x)
-                points = gt.reproject(points, sr)
-
-                # 5, add utm points into points table.
-                cleanedDf["Utmlong"] = [i.x for i in points]
-                cleanedDf["Utmlat"] = [i.y for i in points]
+                csvreader.skip_inficon_header(data)
+                cleanedDf = dfcache.load_inficon(data, csvName+"-path")
+
+                # 3, 4, 5, points pre projected to utm to prepare for buffer, cached with the cleaned csv.
+                utm = cleanedDf[["Utmlong", "Utmlat"]].to_numpy()
+                sr = cleanedDf.attrs["utm_zone"]
 
                 # 6, make the new df into sql
-                cleanedDf[["Microsec", "Flight_Date", "SenseLong", "SenseLat", "CH4", "Peak", "Source_Name", "Utmlong", "Utmlat"]].to_sql(name="PointsTable", con=connection, if_exists='append', index=False)
+                insertPointsIntoDB(cursor, cleanedDf)
 
                 # 7, add into database based on types and load onto json. name: csvName-buffer, csvName-peaks.....
-                buffJson = createBuff(points, bufferDistance, sr)
-                insertGeoJsonIntoDB(cursor, "BuffersTable", csvName+"-buffer", buffJson[0], buffJson[1])
-                returnedJson["BuffersTable"][csvName+"-buffer"] = buffJson[0]
+                buff = createBuff(utm, bufferDistance)
+                insertGeometryIntoDB(cursor, "BuffersTable", csvName+"-buffer", buff, sr)
+                returnedJson["BuffersTable"][csvName+"-buffer"] = toGeoJson(buff, sr)
 
-                pathJson = createPath(cleanedDf)
-                insertGeoJsonIntoDB(cursor, "LinesTable", csvName+"-path", pathJson, "")
-                returnedJson["LinesTable"][csvName+"-path"] = pathJson
+                path = createPath(cleanedDf)
+                insertGeometryIntoDB(cursor, "LinesTable", csvName+"-path", path, sr)
+                returnedJson["LinesTable"][csvName+"-path"] = toGeoJson(path, sr)
 
             bufferIndex += 1
 
@@ -760,12 +1076,13 @@ def append():
     This function is mainly calling a bunch of add_feature rest api calls base on the inspection type and layer names.
     1, the function will first record some basic information about appending, like userName and password, insepction
     type, etc.
-    2, Then it will prepare a multiprocess return json, which contains 6 lists: appended point layer names, buffer 
-    success list, buffer fail list, peak success list, peak fail list, invalid json list.
+    2, Then it will prepare a multiprocess return json, which contains 7 lists: appended point layer names, point
+    fail list, buffer success list, buffer fail list, peak success list, peak fail list, invalid json list.
     3, Then it will perform similar but a little bit different operation based on the inspection type.
         3.a, Loop through every layer name, if it is the sniffer drone task, obtain three target urls from the form 
         sent from the front end. Based on the last character of the layer name, it will first check if there has been
-        data with such source name in the field map. If there is no such data, go to query the database. If query 
+        data with such source name in the field map (all layers at once, see uploadedLayers()). If there is no such data,
+        go to query the database. If query 
         result is not empty, create points, buffer, and peaks esri features, append those features into feature 
         collection list (since rest api accept a feature list). For peaks features, the double buffer is actually 
         implemented here, since we have already recorded the utm coordinate for the peaks. We just buffer twice, create
@@ -773,7 +1090,11 @@ def append():
         3.b, if it is the inficon task, we repeat the similar process but with only buffer and points. 
         3.c, with either inspection type, the bool appendedAtLeastOnce is to quickly tell whether there has been data 
         being appended even once.
-    4, At last, we set up multiprocess api calls to save time. 
+    4, At last, we set up multiprocess api calls to save time. Each of them sends its features in chunks under the
+    record and size limits of the service, see add_features() in arcgis.py.
+    5, The chunks are recorded in the append journal of the project database (see appendjournal.py). Chunks left
+    unfinished by an interrupted append are sent first by the next append to the same target url, and their layers
+    are not collected again.
     ------------------------
     Input parameter: 
         a form sent from the front end. 
@@ -801,12 +1122,12 @@ def append():
         returnJson: a copy of multiprocess json dictionary. if not bing copied, it will not be serilized.
                     {
                         "task": "SnifferDrone" or "Inficon",
-                        six lists that indicate the appending status.
+                        seven lists that indicate the appending status.
                     }
     '''
     if request.method == "POST":
         # start the database.
-        connection = sqlite3.connect(localPath)
+        connection = dbpool.get_connection(localPath)
         cursor = connection.cursor()
         # authentication
         userName = request.form["userName"]
@@ -819,6 +1140,7 @@ def append():
         manager = mp.Manager()
         returnJson = manager.dict()
         returnJson["pointsAppended"] = []
+        returnJson["pointsFail"] = []
         returnJson["bufferSuccess"] = []
         returnJson["bufferFail"] = []
         returnJson["peaksSuccess"] = []
@@ -826,30 +1148,31 @@ def append():
         returnJson["invalidJson"] = []
         # prepare point and buffer feature list for appending, two inspections have both those two feature types.
         pointFeatures, bufferFeatures = [], []
-        # a bool to check if there is at least one layer that is appendable
+        # a bool to check if there is at least one layer that is appendable, or unfinished chunks to resume
         appendedAtLeastOnce = False
+        # chunks of every append are recorded in the project database, so an interrupted append is resumed.
+        journal = appendjournal.AppendJournal(localPath)
         # append operation based on inspection type
         if inspectionType == "S":
             returnJson["task"] = "SnifferDrone"
             # extra peak features collector
             peaksFeatures = []
-            # Dictionary to record the number of peaks for each peak layer. This is a work around for
-            # retrieving the peaks appending response. Each row in AGOL layer is an appending
-            # feature. Each peak layer created from one csv contains even number of rows (buffered twice)
-            peaksDict = {}
             # get urls
             bufferUrl = request.form["bufferUrl"]
             peaksUrl = request.form["peaksUrl"]
             pointsUrl = request.form["pointsUrl"]
+            # layers already in the field map or left unfinished by an interrupted append.
+            uploaded, appendedAtLeastOnce, unchecked = layersToSkip(token, journal, {i: bufferUrl if i[-1] == "r" else peaksUrl if i[-1] == "s" else pointsUrl for i in sourceLayers})
+            reportUnchecked(returnJson, unchecked)
 
             for i in sourceLayers:
-                sql = "Source_Name = '" + i.split("-")[0] + "'"
                 if i[-1] == "r":
-                    if not query_feature(token, sql, bufferUrl):
-                        queryOpertaion = cursor.execute("SELECT Source_name, EsriGeometry FROM BuffersTable WHERE Source_name == '" + i + "'").fetchall()
+                    if i not in uploaded:
+                        queryOpertaion = cursor.execute("SELECT Source_name, Geometry FROM BuffersTable WHERE Source_name == '" + i + "' AND Geometry IS NOT NULL").fetchall()
                         if len(queryOpertaion) > 0:
                             query = queryOpertaion[0]
-                            esriGeometry = json.loads(query[1].replace("'", '"'))
+                            # esri json written from the stored utm geometry.
+                            esriGeometry = toEsriJson(wkb.loads(query[1]))
                             uploadStruct = {
                                 "attributes" : {"Source_Name": query[0].split("-")[0]},
                                 "geometry" : esriGeometry
@@ -858,16 +1181,16 @@ def append():
                             appendedAtLeastOnce = True
 
                 elif i[-1] == "s":
-                    if not query_feature(token, sql, peaksUrl):
+                    if i not in uploaded:
                         sourceName = i.replace("peaks", "path")
                         orig_id = 1
                         query= cursor.execute("SELECT Flight_date, Senselat, Senselong, CH4, Source_name, Utmlong, Utmlat FROM PointsTable WHERE Source_name == '" + sourceName + "' AND Peak == 1").fetchall()
                         if len(query) > 0:
-                            # record the total number of features appendable to the paak layer.
-                            peaksDict[i.split("-")[0]] = len(query)*2
-                            for j in query:
-                                # obtain center coordinate
-                                peakCenter = Point(j[5], j[6])
+                            # outer and inner circles of every peak at once, translated from precomputed circles.
+                            peakCenters = np.array([(j[5], j[6]) for j in query])
+                            outerRings = gt.peak_rings(peakCenters, 13.57884, quad_segs=bufferResolution)
+                            innerRings = gt.peak_rings(peakCenters, 5.876544, quad_segs=bufferResolution)
+                            for k, j in enumerate(query):
                                 # create outer buffer esri geometry json.
                                 outerCircle = {"attributes" : {
                                     "Flight_Date": j[0],
@@ -878,9 +1201,7 @@ def append():
                                     "BUFF_DIST": 13.57884,
                                     "ORIG_FID": orig_id
                                 }}
-                                outerBuffer = mapping(peakCenter.buffer(13.57884, resolution=bufferResolution))
-                                esriOuterBuffer = json.loads(toEsriGeometry(outerBuffer))
-                                outerCircle["geometry"] = esriOuterBuffer
+                                outerCircle["geometry"] = geoserial.esri_rings(outerRings[k:k + 1])
                                 peaksFeatures.append(outerCircle)
                                 # create inner buffer esri geometry json.
                                 innerCircle = {"attributes" : {
@@ -892,15 +1213,13 @@ def append():
                                     "BUFF_DIST": 5.876544,
                                     "ORIG_FID": orig_id
                                 }}
-                                innerBuffer = mapping(peakCenter.buffer(5.876544, resolution=bufferResolution))
-                                esriInnerBuffer = json.loads(toEsriGeometry(innerBuffer))
-                                innerCircle["geometry"] = esriInnerBuffer
+                                innerCircle["geometry"] = geoserial.esri_rings(innerRings[k:k + 1])
                                 peaksFeatures.append(innerCircle)
                                 orig_id += 1
                             appendedAtLeastOnce = True
 
                 else:
-                    if not query_feature(token, sql, pointsUrl):
+                    if i not in uploaded:
                         query = cursor.execute("SELECT Flight_date, Senselat, Senselong, CH4, Source_name, Utmlong, Utmlat FROM PointsTable WHERE Source_name == '" + i + "'").fetchall()
                         if len(query) > 0:
                             for j in query:
@@ -917,17 +1236,16 @@ def append():
                                                     "y" : j[6]
                                                 }}
                                 pointFeatures.append(esriPoint)
-                            returnJson["pointsAppended"] += [i]
                             appendedAtLeastOnce = True
 
             if appendedAtLeastOnce:
                 # Multiprocess add. parameters: token, features, targetUrl, urlCheckDict, returnJson, includeReponse
                 # add_feature(token, bufferFeatures, bufferUrl)
-                bufferAppend = mp.Process(target=add_buffer_features, args=[token, bufferFeatures, bufferUrl, returnJson])
+                bufferAppend = mp.Process(target=add_buffer_features, args=[token, bufferFeatures, bufferUrl, returnJson, journal])
                 # add_feature(token, pointFeatures, pointsUrl)
-                pointsAppend = mp.Process(target=add_point_features, args=[token, pointFeatures, pointsUrl])
+                pointsAppend = mp.Process(target=add_point_features, args=[token, pointFeatures, pointsUrl, returnJson, journal])
                 # add_feature(token, peaksFeatures, peaksUrl)
-                peaksAppend = mp.Process(target=add_peak_features, args=[token, peaksFeatures, peaksUrl, returnJson, peaksDict])
+                peaksAppend = mp.Process(target=add_peak_features, args=[token, peaksFeatures, peaksUrl, returnJson, journal])
                 bufferAppend.start()
                 pointsAppend.start()
                 peaksAppend.start()
@@ -939,15 +1257,18 @@ def append():
             returnJson["task"] = "Inficon"
             inficonPointsUrl = request.form["inficonPoints"]
             inficonBufferUrl = request.form["inficonBuffer"]
+            # layers already in the field map or left unfinished by an interrupted append.
+            uploaded, appendedAtLeastOnce, unchecked = layersToSkip(token, journal, {i: inficonBufferUrl if i[-1] == "r" else inficonPointsUrl for i in sourceLayers})
+            reportUnchecked(returnJson, unchecked)
 
             for i in sourceLayers:
-                sql = "Source_Name = '" + i.split("-")[0] + "'"
                 if i[-1] == "r":
-                    if not query_feature(token, sql, inficonBufferUrl):
-                        queryOperation = cursor.execute("SELECT Source_name, EsriGeometry FROM BuffersTable WHERE Source_name == '" + i + "'").fetchall()
+                    if i not in uploaded:
+                        queryOperation = cursor.execute("SELECT Source_name, Geometry FROM BuffersTable WHERE Source_name == '" + i + "' AND Geometry IS NOT NULL").fetchall()
                         if len(queryOperation) > 0:
                             query = queryOperation[0]
-                            esriGeometry = json.loads(query[1].replace("'", '"'))
+                            # esri json written from the stored utm geometry.
+                            esriGeometry = toEsriJson(wkb.loads(query[1]))
                             uploadStruct = {
                                 "attributes" : {"Source_Name": query[0].split("-")[0]},
                                 "geometry" : esriGeometry
@@ -956,7 +1277,7 @@ def append():
                             appendedAtLeastOnce = True
 
                 else:
-                    if not query_feature(token, sql, inficonPointsUrl):
+                    if i not in uploaded:
                         query = cursor.execute("SELECT Flight_date, Senselat, Senselong, CH4, Source_name, Utmlong, Utmlat FROM PointsTable WHERE Source_name == '" + i + "'").fetchall()
                         if len(query) > 0:
                             for j in query:
@@ -974,12 +1295,11 @@ def append():
                                                     "y" : j[6]
                                                 }}
                                 pointFeatures.append(esriPoint)
-                            returnJson["pointsAppended"] += [i]
                             appendedAtLeastOnce = True
 
             if appendedAtLeastOnce:
-                bufferInficonAppend = mp.Process(target=add_buffer_features, args=[token, bufferFeatures, inficonBufferUrl, returnJson])
-                pointInficonAppend = mp.Process(target=add_point_features, args=[token, pointFeatures, inficonPointsUrl])
+                bufferInficonAppend = mp.Process(target=add_buffer_features, args=[token, bufferFeatures, inficonBufferUrl, returnJson, journal])
+                pointInficonAppend = mp.Process(target=add_point_features, args=[token, pointFeatures, inficonPointsUrl, returnJson, journal])
                 bufferInficonAppend.start()
                 pointInficonAppend.start()
                 bufferInficonAppend.join()
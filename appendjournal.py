@@ -0,0 +1,145 @@
+"""
+Journal of the addFeatures chunks sent to ArcGIS, kept in the AppendJournal table of a
+project database (see dbschema.py), or of a standalone journal file holding only that table.
+
+Every chunk made by arcgis.add_features is recorded as pending before anything is sent,
+marked sent right before each request, and acknowledged with the result of every feature
+once the service answers. An upload that is interrupted (network failure after all retries,
+a killed process) leaves its chunks pending, and the next add_features call with the same
+journal and target layer sends them first, instead of the whole batch being redone.
+
+addFeatures is not idempotent. A chunk whose request was sent without an answer coming
+back may have been added by the service, it is marked uncertain and never sent again,
+so its features cannot be duplicated. The same goes for chunks left sent by a killed
+process, see interrupted. Their features are reported as failed, the features json is
+kept in the journal.
+"""
+import itertools
+import json
+import time
+import dbpool
+import dbschema
+
+PENDING = "pending"
+SENT = "sent"
+ACKNOWLEDGED = "acknowledged"
+UNCERTAIN = "uncertain"
+
+
+def _runs(names):
+    # consecutive features mostly share their Source_Name.
+    return json.dumps([[name, len(list(group))] for name, group in itertools.groupby(names)])
+
+
+def _names(runs):
+    return [name for name, count in json.loads(runs) for _ in range(count)]
+
+
+class AppendJournal:
+    """
+    Append journal in a project database or a standalone journal file. Each thread uses its own
+    pooled connection, so one journal is shared by the upload threads.
+    """
+
+    def __init__(self, path, project=True):
+        """
+        :param path: sqlite database path, created if needed
+        :param project: True for a project database, migrated to the current schema. False for a
+            standalone journal file, only the journal table is created in it.
+        """
+        self.path = path
+        connection = dbpool.get_connection(path)
+        if project:
+            dbschema.migrate(connection)
+        else:
+            with connection:
+                dbschema.create_journal_table(connection.cursor())
+
+    def _execute(self, sql, params=()):
+        connection = dbpool.get_connection(self.path)
+        with connection:
+            return connection.execute(sql, params)
+
+    def add(self, targetUrl, chunks):
+        """
+        Record new chunks as pending.
+        :param targetUrl: url of the target layer
+        :param chunks: list of (Source_Name of every feature, features json)
+        :return: list of the chunk ids
+        """
+        connection = dbpool.get_connection(self.path)
+        now = time.time()
+        with connection:
+            return [connection.execute(f'INSERT INTO {dbschema.JOURNAL_TABLE} ("Target_url", "State", "Names", "Features", "Updated") '
+                                       'VALUES (?, ?, ?, ?, ?)', [targetUrl, PENDING, _runs(names), text, now]).lastrowid
+                    for names, text in chunks]
+
+    def unfinished(self, targetUrl):
+        """
+        :param targetUrl: url of the target layer
+        :return: list of (chunk id, Source_Name of every feature, features json) of the pending and sent
+            chunks, in the order they were recorded
+        """
+        rows = dbpool.get_connection(self.path).execute(
+            f'SELECT "Chunk", "Names", "Features" FROM {dbschema.JOURNAL_TABLE} '
+            'WHERE "Target_url" == ? AND "State" IN (?, ?) ORDER BY "Chunk"', [targetUrl, PENDING, SENT]).fetchall()
+        return [(chunkId, _names(runs), text) for chunkId, runs, text in rows]
+
+    def interrupted(self, targetUrl):
+        """
+        Mark the chunks left sent by an interrupted upload as uncertain, they are not sent again.
+        :param targetUrl: url of the target layer
+        :return: list of (chunk id, Source_Name of every feature) of those chunks, in the order they were recorded
+        """
+        connection = dbpool.get_connection(self.path)
+        with connection:
+            rows = connection.execute(f'SELECT "Chunk", "Names" FROM {dbschema.JOURNAL_TABLE} '
+                                      'WHERE "Target_url" == ? AND "State" == ? ORDER BY "Chunk"', [targetUrl, SENT]).fetchall()
+            connection.executemany(f'UPDATE {dbschema.JOURNAL_TABLE} SET "State" = ?, "Updated" = ? WHERE "Chunk" == ?',
+                                   [(UNCERTAIN, time.time(), chunkId) for chunkId, _ in rows])
+        return [(chunkId, _names(runs)) for chunkId, runs in rows]
+
+    def unfinished_names(self, targetUrl):
+        """
+        :param targetUrl: url of the target layer
+        :return: set of the source names with features in pending or sent chunks, they are sent by the
+            next add_features call and should not be collected again
+        """
+        return {name for _, names, _ in self.unfinished(targetUrl) for name in names}
+
+    def sent(self, chunkId):
+        """
+        Mark a chunk as sent, right before a request with it.
+        :param chunkId: chunk id
+        """
+        self._execute(f'UPDATE {dbschema.JOURNAL_TABLE} SET "State" = ?, "Attempts" = "Attempts" + 1, "Updated" = ? WHERE "Chunk" == ?',
+                      [SENT, time.time(), chunkId])
+
+    def acknowledge(self, chunkId, results, error=None):
+        """
+        Record the answer of the service to a chunk. The chunk json is dropped, it is not sent again.
+        :param chunkId: chunk id
+        :param results: success of every feature of the chunk
+        :param error: error of the response if the chunk was rejected as a whole
+        """
+        self._execute(f'UPDATE {dbschema.JOURNAL_TABLE} SET "State" = ?, "Features" = NULL, "Results" = ?, "Error" = ?, "Updated" = ? '
+                      'WHERE "Chunk" == ?', [ACKNOWLEDGED, json.dumps(results), None if error is None else str(error), time.time(), chunkId])
+
+    def uncertain(self, chunkId, error):
+        """
+        Record a chunk whose request was sent but not answered, the service may have added its features.
+        It is not sent again.
+        :param chunkId: chunk id
+        :param error: error of the request
+        """
+        self._execute(f'UPDATE {dbschema.JOURNAL_TABLE} SET "State" = ?, "Error" = ?, "Updated" = ? WHERE "Chunk" == ?',
+                      [UNCERTAIN, str(error), time.time(), chunkId])
+
+    def record_error(self, chunkId, error):
+        """
+        Keep the last error of a chunk that is left unfinished.
+        :param chunkId: chunk id
+        :param error: error of the last attempt
+        """
+        self._execute(f'UPDATE {dbschema.JOURNAL_TABLE} SET "Error" = ?, "Updated" = ? WHERE "Chunk" == ?',
+                      [str(error), time.time(), chunkId])
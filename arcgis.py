@@ -0,0 +1,366 @@
+"""
+ArcGIS rest api calls shared by app.py and uploader.py.
+"""
+import collections
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import geoserial
+import httppool
+
+# portal of the generateToken rest api.
+PORTAL_URL = "https://www.arcgis.com"
+REFERER = "http://www.arcgis.com/"
+# validity of generated tokens, in minutes as the generateToken rest api takes it.
+TOKEN_EXPIRATION = 900
+# a cached token is generated again when it expires within this many seconds.
+TOKEN_REFRESH_MARGIN = 300
+# rest api error codes of an invalid or expired token, and of a missing token.
+TOKEN_ERROR_CODES = (498, 499)
+# most source names in one existence query, far below the maxRecordCount of hosted layers (1000 or more).
+MAX_NAMES_PER_QUERY = 100
+# longest where clause of one existence query, some services reject longer clauses.
+MAX_WHERE_LENGTH = 2000
+# most features in one addFeatures request, lowered to the maxRecordCount of the layer when that is smaller.
+MAX_FEATURES_PER_REQUEST = 1000
+# longest features parameter of one addFeatures request in characters, before url encoding.
+# Hosted services reject or time out on much larger edit requests.
+MAX_FEATURES_CHARS = 2 * 1024 * 1024
+# addFeatures requests in flight at once for one add_features call.
+UPLOAD_WORKERS = 4
+# attempts after the first for a chunk that fails with a transient error, waiting a random time up to
+# RETRY_BACKOFF * 2 ** attempt seconds, at most RETRY_BACKOFF_MAX, before each.
+RETRIES = 4
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 30.0
+# rest api error codes of an overloaded or unavailable service, the error response means nothing was added.
+TRANSIENT_CODES = (429, 500, 502, 503, 504)
+# http status codes of a request the service did not process. Other 5xx statuses (e.g. a gateway timeout)
+# may come after the service processed it, like a lost response (httppool.ResponseLost).
+RETRY_STATUS = (429, 503)
+# error of the chunks left sent by an interrupted upload, see appendjournal.AppendJournal.interrupted
+INTERRUPTED_ERROR = "sent before the upload was interrupted, it may have been added and is not sent again"
+
+
+def post_json(url, params, timeout=None):
+    """
+    POST urlencoded parameters to a rest endpoint, on a pooled keep-alive connection (see httppool.py).
+    :param url: endpoint url
+    :param params: dict of parameters, f=json is added
+    :param timeout: seconds, None for httppool.TIMEOUT
+    :return: decoded json response
+    """
+    return json.loads(httppool.post_form(url, dict(params, f="json"), timeout), object_pairs_hook=collections.OrderedDict)
+
+
+def generate_token(userName, passWord, portal=PORTAL_URL, expiration=TOKEN_EXPIRATION):
+    """
+    :param userName: portal user name
+    :param passWord: portal password
+    :param portal: portal url
+    :param expiration: minutes the token stays valid
+    :return: (token, expiry as seconds since 1970)
+    """
+    output = post_json(portal + "/sharing/rest/generateToken",
+                       {"username": userName, "password": passWord, "referer": REFERER, "expiration": expiration})
+    if "token" not in output:
+        raise RuntimeError(f"generateToken failed: {output.get('error')}")
+    # expires is in milliseconds, the portal may shorten the requested expiration.
+    expires = output.get("expires")
+    return output["token"], expires / 1000 if expires else time.time() + expiration * 60
+
+
+class TokenManager:
+    """
+    Token of one user on one portal. It is generated on first use and again once it is within
+    TOKEN_REFRESH_MARGIN of its expiry, or after it is rejected (see invalidate).
+
+    One instance is shared by threads, one of them generates a token while the others wait for it.
+    Copies in other processes (forked or pickled, e.g. the /append upload processes) refresh on their own.
+    """
+
+    def __init__(self, userName, passWord, portal=PORTAL_URL, expiration=TOKEN_EXPIRATION):
+        self.userName = userName
+        self.passWord = passWord
+        self.portal = portal
+        self.expiration = expiration
+        self._token = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def token(self):
+        """
+        :return: a token valid for at least TOKEN_REFRESH_MARGIN seconds
+        """
+        with self._lock:
+            if self._token is None or time.time() > self._expires - TOKEN_REFRESH_MARGIN:
+                self._token, self._expires = generate_token(self.userName, self.passWord, self.portal, self.expiration)
+            return self._token
+
+    def invalidate(self, token):
+        """
+        Drop a token the service rejected, the next token() generates a new one.
+        :param token: the rejected token, nothing happens if another thread has already replaced it
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_managersLock = threading.Lock()
+# {(user name, portal): TokenManager}
+_managers = {}
+
+
+def token_manager(userName, passWord, portal=PORTAL_URL):
+    """
+    The shared TokenManager of a user on a portal, so its token is reused by later calls.
+    :param userName: portal user name
+    :param passWord: portal password, a different password than the cached one starts a new manager
+    :param portal: portal url
+    :return: TokenManager
+    """
+    key = (userName, portal)
+    with _managersLock:
+        manager = _managers.get(key)
+        if manager is None or manager.passWord != passWord:
+            manager = _managers[key] = TokenManager(userName, passWord, portal)
+        return manager
+
+
+def _reset_locks():
+    # a lock held by another thread at fork time would never be released in the child.
+    global _managersLock
+    _managersLock = threading.Lock()
+    for manager in _managers.values():
+        manager._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+def post_with_token(url, params, token):
+    """
+    post_json with a token parameter. A token from a TokenManager that the service rejects
+    as invalid or expired is generated again and the request sent once more.
+    :param url: endpoint url
+    :param params: dict of parameters, token and f=json are added
+    :param token: token string or TokenManager
+    :return: decoded json response
+    """
+    if not isinstance(token, TokenManager):
+        return post_json(url, dict(params, token=token))
+    for attempt in range(2):
+        value = token.token()
+        output = post_json(url, dict(params, token=value))
+        error = output.get("error")
+        if not (isinstance(error, dict) and error.get("code") in TOKEN_ERROR_CODES):
+            break
+        token.invalidate(value)
+    return output
+
+
+def _sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _name_chunks(names):
+    # groups of names whose IN clause stays under both limits.
+    chunk, length = [], 0
+    for name in names:
+        quoted = _sql_string(name)
+        if chunk and (len(chunk) >= MAX_NAMES_PER_QUERY or length + len(quoted) + 1 > MAX_WHERE_LENGTH):
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(quoted)
+        length += len(quoted) + 1
+    if chunk:
+        yield chunk
+
+
+def existing_source_names(token, targetUrl, names, field="Source_Name"):
+    """
+    Find which source names already have features in a layer, with one query per chunk
+    of names that returns distinct names only, no geometry.
+    :param token: rest api token string or TokenManager
+    :param targetUrl: url of the target layer
+    :param names: iterable of source names
+    :param field: name field of the layer
+    :return: set of the names that are already uploaded
+    """
+    names = list(dict.fromkeys(names))
+    existing = set()
+    for chunk in _name_chunks(names):
+        where = f"{field} IN (" + ",".join(chunk) + ")"
+        output = post_with_token(targetUrl + "/query", {"where": where, "outFields": field,
+                                                        "returnGeometry": "false", "returnDistinctValues": "true"}, token)
+        if "error" in output:
+            raise RuntimeError(f"query on {targetUrl} failed: {output['error']}")
+        for feature in output["features"]:
+            # services may return the field name in a different case.
+            existing.update(str(i) for i in feature["attributes"].values())
+    return existing & set(names)
+
+
+def record_limit(token, targetUrl):
+    """
+    :param token: rest api token string or TokenManager
+    :param targetUrl: url of the target layer
+    :return: maxRecordCount of the layer, None if the layer does not report one
+    """
+    try:
+        info = post_with_token(targetUrl, {}, token)
+    except (urllib.error.URLError, RuntimeError, ValueError):
+        return None
+    limit = info.get("maxRecordCount")
+    return limit if isinstance(limit, int) and limit > 0 else None
+
+
+def _feature_chunks(features, maxFeatures, maxChars, field):
+    # (Source_Name of every feature, features json) of consecutive features, each chunk under both limits.
+    # A single feature over maxChars still goes alone in its own chunk.
+    names, chunk, length = [], [], 0
+    for feature in features:
+        text = geoserial.feature_json(feature)
+        if chunk and (len(chunk) >= maxFeatures or length + len(text) + 1 > maxChars):
+            yield names, "[" + ",".join(chunk) + "]"
+            names, chunk, length = [], [], 0
+        names.append(feature["attributes"][field])
+        chunk.append(text)
+        length += len(text) + 1
+    if chunk:
+        yield names, "[" + ",".join(chunk) + "]"
+
+
+def _backoff(attempt):
+    # full jitter, so workers that failed together do not retry together.
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+
+def _add_chunk(token, targetUrl, text, count, journal=None, chunkId=None):
+    # success of every feature of a chunk, and the error of the request if it failed as a whole.
+    # Errors from before the request was processed are retried, a chunk that still fails with one is left
+    # unfinished in the journal. addFeatures is not idempotent, a request that may have been processed
+    # (lost response, gateway error) is not sent again, the chunk is marked uncertain.
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(_backoff(attempt - 1))
+        if journal is not None:
+            journal.sent(chunkId)
+        uncertain = False
+        try:
+            output = post_with_token(targetUrl + "/addFeatures", {"features": text}, token)
+        except httppool.ResponseLost as failure:
+            transient, uncertain, error = False, True, str(failure)
+        except urllib.error.HTTPError as failure:
+            transient, error = failure.code in RETRY_STATUS, str(failure)
+            uncertain = failure.code >= 500 and not transient
+        except (urllib.error.URLError, OSError) as failure:
+            # the request could not be sent.
+            transient, error = True, str(failure)
+        except (RuntimeError, ValueError) as failure:
+            # no token, or a response that is not json.
+            transient, error = False, str(failure)
+        else:
+            error = output.get("error")
+            if error is None:
+                results = [bool(i.get("success")) for i in output.get("addResults", [])]
+                # a short response leaves the missing features failed.
+                results = (results + [False] * count)[:count]
+                if journal is not None:
+                    journal.acknowledge(chunkId, results)
+                return results, None
+            transient = isinstance(error, dict) and error.get("code") in TRANSIENT_CODES
+            if not transient:
+                # rejected by the service, sending it again would not help.
+                if journal is not None:
+                    journal.acknowledge(chunkId, [False] * count, error)
+                return [False] * count, error
+        if uncertain:
+            if journal is not None:
+                journal.uncertain(chunkId, error)
+            return [False] * count, error
+        if not transient:
+            break
+    if journal is not None:
+        journal.record_error(chunkId, error)
+    return [False] * count, error
+
+
+def add_features(token, targetUrl, features, maxFeatures=None, maxChars=MAX_FEATURES_CHARS, workers=UPLOAD_WORKERS,
+                 journal=None, field="Source_Name"):
+    """
+    Append features to a layer with the addFeatures rest api. The features are sent in consecutive
+    chunks bounded by count and json length, up to workers chunks at a time. Chunks failing before the
+    service processed them (connection errors, RETRY_STATUS, TRANSIENT_CODES) are retried with jittered
+    exponential backoff. Chunks the service may have added without answering are not sent again.
+    :param token: rest api token string or TokenManager
+    :param targetUrl: url of the target layer
+    :param features: list of features, see geoserial.feature_json
+    :param maxFeatures: most features per request, None for MAX_FEATURES_PER_REQUEST or the
+        maxRecordCount of the layer, whichever is smaller
+    :param maxChars: longest features json of one request
+    :param workers: requests sent at the same time
+    :param journal: appendjournal.AppendJournal to record the chunks in. Its unfinished chunks of
+        targetUrl, left by an interrupted upload, are sent first. Its chunks left sent are not sent again,
+        their features are reported failed with INTERRUPTED_ERROR.
+    :param field: name field of the features
+    :return: (names, results, errors), names holds the source name and results True or False for every
+        feature sent, the features of interrupted and resumed chunks first and then features in their order.
+        errors holds the error of every request that failed as a whole (error response or connection error)
+    """
+    names, results, errors = [], [], []
+    # [(Source_Name of every feature, features json, journal chunk id)]
+    chunks = []
+    if journal is not None:
+        for _, chunkNames in journal.interrupted(targetUrl):
+            names += chunkNames
+            results += [False] * len(chunkNames)
+            errors.append(INTERRUPTED_ERROR)
+        chunks += [(chunkNames, text, chunkId) for chunkId, chunkNames, text in journal.unfinished(targetUrl)]
+    if features:
+        if maxFeatures is None:
+            limit = record_limit(token, targetUrl)
+            maxFeatures = min(MAX_FEATURES_PER_REQUEST, limit) if limit else MAX_FEATURES_PER_REQUEST
+        new = list(_feature_chunks(features, maxFeatures, maxChars, field))
+        ids = journal.add(targetUrl, new) if journal is not None else [None] * len(new)
+        chunks += [(chunkNames, text, chunkId) for (chunkNames, text), chunkId in zip(new, ids)]
+    if not chunks:
+        return names, results, errors
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+        futures = [executor.submit(_add_chunk, token, targetUrl, text, len(chunkNames), journal, chunkId)
+                   for chunkNames, text, chunkId in chunks]
+        for (chunkNames, _, _), future in zip(chunks, futures):
+            chunkResults, error = future.result()
+            names += chunkNames
+            results += chunkResults
+            if error is not None:
+                errors.append(error)
+    return names, results, errors
+
+
+def source_summary(names, results):
+    """
+    Per source results of add_features, a source succeeds only if all of its features were added.
+    :param names: the names returned by add_features
+    :param results: the results returned by add_features
+    :return: (succeeded, failed) lists of source names, in the order they first appear in names
+    """
+    success = {}
+    for name, result in zip(names, results):
+        success[name] = success.get(name, True) and result
+    return [i for i, j in success.items() if j], [i for i, j in success.items() if not j]
@@ -0,0 +1,39 @@
+"""
+Timing of geometry_tools.coverage_buffer against the exact MultiPoint buffer it replaced.
+
+    python benchmarks/bench_coverage_buffer.py [csv, default inficoncsv.csv] [buffer distance, default 15]
+
+The csv needs the projected Utmlong and Utmlat columns. For every tolerance the area difference and
+whether each result lies within the other buffered by tolerance plus the 0.13 m chord error is printed.
+"""
+import os
+import sys
+import time
+import pandas as pd
+from shapely.geometry import MultiPoint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import geometry_tools as gt  # noqa: E402
+
+
+def main(path, dist):
+    xy = pd.read_csv(path, usecols=["Utmlong", "Utmlat"]).to_numpy()
+    start = time.perf_counter()
+    exact = MultiPoint(xy).buffer(dist, quad_segs=6)
+    exactTime = time.perf_counter() - start
+    print("%s: %d samples, %g m" % (os.path.basename(path), len(xy), dist))
+    print("  exact MultiPoint buffer   %8.2f s" % exactTime)
+    for tolerance in (0.25, 0.5, 1.0, 2.0):
+        start = time.perf_counter()
+        approx = gt.coverage_buffer(xy, dist, tolerance=tolerance)
+        seconds = time.perf_counter() - start
+        slack = tolerance + 0.13
+        within = exact.difference(approx.buffer(slack)).is_empty and approx.difference(exact.buffer(slack)).is_empty
+        print("  coverage_buffer, %4.2f m   %8.2f s  %5.0fx  area %+.3f%%  within tolerance: %s"
+              % (tolerance, seconds, exactTime / seconds, 100 * (approx.area - exact.area) / exact.area, within))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "inficoncsv.csv"),
+         float(sys.argv[2]) if len(sys.argv) > 2 else 15)
@@ -0,0 +1,57 @@
+"""
+Timing of pooled dbpool connections against a new sqlite3 connection per request, as before dbpool.
+
+    python benchmarks/bench_dbpool.py [requests, default 2000]
+
+Every request runs one small read, or one small write and commit, on a migrated project database.
+The unpooled path connects with the sqlite defaults (rollback journal, synchronous FULL).
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dbpool  # noqa: E402
+import dbschema  # noqa: E402
+
+READ = 'SELECT count(*) FROM "PointsTable" WHERE "Source_Name" == ?'
+WRITE = ('INSERT INTO "PointsTable" ("Source_Name", "CH4", "SenseLong", "SenseLat", "Utmlong", "Utmlat") '
+         'VALUES (?, ?, -83.55, 42.40, 289654.4, 4698078.0)')
+
+
+def unpooled(path, sql, params, write):
+    connection = sqlite3.connect(path)
+    connection.execute(sql, params).fetchall()
+    if write:
+        connection.commit()
+    connection.close()
+
+
+def pooled(path, sql, params, write):
+    connection = dbpool.get_connection(path)
+    connection.execute(sql, params).fetchall()
+    if write:
+        connection.commit()
+    dbpool.end_request()
+
+
+def main(requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, request in [("new connection per request", unpooled), ("dbpool", pooled)]:
+            path = os.path.join(tmp, request.__name__ + ".db")
+            connection = sqlite3.connect(path)
+            dbschema.migrate(connection)
+            connection.close()
+            for kind, sql, write in [("read", READ, False), ("write", WRITE, True)]:
+                start = time.perf_counter()
+                for k in range(requests):
+                    request(path, sql, ("flight%d.csv" % (k % 50),) + ((k,) if write else ()), write)
+                seconds = time.perf_counter() - start
+                print("  %-28s %-5s %8.1f us/request" % (label, kind, 1e6 * seconds / requests))
+            dbpool.close_all()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
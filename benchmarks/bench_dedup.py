@@ -0,0 +1,61 @@
+"""
+Timing of csvprocessing.dedup_max_ch4 against the groupby-transform dedup it replaced.
+
+    python benchmarks/bench_dedup.py [csv, default inficoncsv.csv] [repeats, default 3]
+
+The csv needs SenseLong, SenseLat and CH4 columns. The best of the repeats is printed.
+"""
+import os
+import sys
+import time
+import warnings
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import csvprocessing  # noqa: E402
+
+
+def legacy_dedup(flight_log):
+    # before: groupby transform with the builtin max, filter and drop_duplicates.
+    ch4_maxes = flight_log.groupby(["SenseLong", "SenseLat"]).CH4.transform(max)
+    flight_log = flight_log[flight_log.CH4 == ch4_maxes]
+    return flight_log.drop_duplicates(subset=["SenseLong", "SenseLat"], keep="first")
+
+
+def named_max_dedup(flight_log):
+    ch4_maxes = flight_log.groupby(["SenseLong", "SenseLat"]).CH4.transform("max")
+    flight_log = flight_log[flight_log.CH4 == ch4_maxes]
+    return flight_log.drop_duplicates(subset=["SenseLong", "SenseLat"], keep="first")
+
+
+def best(function, flight_log, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(flight_log)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(path, repeats):
+    flight_log = pd.read_csv(path, usecols=["SenseLong", "SenseLat", "CH4"])
+    print("%s: %d rows, %d distinct coordinates" % (os.path.basename(path), len(flight_log),
+                                                     len(flight_log.drop_duplicates(["SenseLong", "SenseLat"]))))
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        for label, function in [("groupby transform(max), as before", legacy_dedup),
+                                ('transform("max") + drop_duplicates', named_max_dedup),
+                                ("lexsort kernel", csvprocessing.dedup_max_ch4)]:
+            seconds, result = best(function, flight_log, repeats)
+            results.append(result)
+            print("  %-36s %8.1f ms" % (label, seconds * 1000))
+    for result in results[1:]:
+        pd.testing.assert_frame_equal(results[0], result)
+    print("outputs identical")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "inficoncsv.csv"),
+         int(sys.argv[2]) if len(sys.argv) > 2 else 3)
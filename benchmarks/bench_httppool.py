@@ -0,0 +1,88 @@
+"""
+Timing of httppool keep-alive requests against urllib.request.urlopen, one connection per request,
+on a local stand-in for an ArcGIS query endpoint.
+
+    python benchmarks/bench_httppool.py [requests, default 300] [certificate.pem key.pem, for https too]
+
+Against a remote service every saved connection is one or more round trips (more with TLS) per request.
+"""
+import json
+import os
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httppool  # noqa: E402
+
+ANSWER = json.dumps({"features": [{"attributes": {"Source_Name": "flight%d.csv" % k}} for k in range(2)]}).encode()
+PARAMS = {"f": "json", "where": "Source_Name IN ('flight1.csv','flight2.csv')", "outFields": "Source_Name",
+          "returnGeometry": "false", "returnDistinctValues": "true"}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(ANSWER)))
+        self.end_headers()
+        self.wfile.write(ANSWER)
+
+
+def start(context):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    if context is not None:
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "%s://127.0.0.1:%d/query" % ("http" if context is None else "https", server.server_address[1])
+
+
+def main(requests, certificate=None, key=None):
+    schemes = [(None, None)]
+    if certificate:
+        server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server.load_cert_chain(certificate, key)
+        client = ssl.create_default_context()
+        client.check_hostname = False
+        client.verify_mode = ssl.CERT_NONE
+        httppool.SSL_CONTEXT = client
+        schemes.append((server, client))
+    data = urllib.parse.urlencode(PARAMS).encode()
+
+    for server, client in schemes:
+        url = start(server)
+
+        def urlopen():
+            with urllib.request.urlopen(url, data, context=client) as response:
+                return response.read()
+
+        for label, send in [("urlopen", urlopen), ("httppool", lambda: httppool.post_form(url, PARAMS))]:
+            before = Handler.connections
+            send()
+            start_time = time.perf_counter()
+            for _ in range(requests):
+                assert send() == ANSWER
+            seconds = time.perf_counter() - start_time
+            print("  %-5s %-8s %6.2f ms/request  %4d connections, with the first request"
+                  % (url.split(":")[0], label, 1000 * seconds / requests, Handler.connections - before))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300, *sys.argv[2:4])
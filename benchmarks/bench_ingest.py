@@ -0,0 +1,50 @@
+"""
+Timing of ingest.ingest_csvs on a folder of synthetic SnifferDrone csvs, serial against a process pool.
+
+    python benchmarks/bench_ingest.py [number of csvs, default 24] [rows per csv, default 20000] [workers, default cpu count]
+
+Every run gets an empty cache directory, so each csv is read, cleaned and projected again.
+"""
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dfcache  # noqa: E402
+import ingest  # noqa: E402
+
+
+def write_sniffer(path, n, seed):
+    r = np.random.default_rng(seed)
+    lon = np.round(-83.5561 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    lat = np.round(42.4065 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    pd.DataFrame({"Timestamp(ms)": 1658161075000 + np.cumsum(r.integers(0, 400, n)), "SenseLong": lon, "SenseLat": lat,
+                  "CH4": np.abs(r.normal(50, 80, n)).round(1), "Alt": r.normal(15, 1, n)}).to_csv(path, index=False)
+
+
+def main(files, rows, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "csvs")
+        os.makedirs(folder)
+        names = [f"flight{k:03d}.csv" for k in range(files)]
+        for k, name in enumerate(names):
+            write_sniffer(os.path.join(folder, name), rows, k)
+        results = {}
+        for count in sorted({1, workers}):
+            dfcache.CACHE_DIR = os.path.join(tmp, f"cache{count}")
+            start = time.perf_counter()
+            results[count] = ingest.ingest_csvs(folder, names, "SnifferDrone", count)
+            print("%d csvs x %d rows, %d worker(s): %.2f s" % (files, rows, count, time.perf_counter() - start))
+        for frames in results.values():
+            for a, b in zip(results[1], frames):
+                pd.testing.assert_frame_equal(a, b)
+        print("outputs identical, %d cpu(s)" % (os.cpu_count() or 1))
+
+
+if __name__ == "__main__":
+    args = [int(i) for i in sys.argv[1:]]
+    main(args[0] if len(args) > 0 else 24, args[1] if len(args) > 1 else 20000,
+         args[2] if len(args) > 2 else (os.cpu_count() or 1))
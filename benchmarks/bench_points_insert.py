@@ -0,0 +1,52 @@
+"""
+Timing of app.insertPointsIntoDB against the DataFrame.to_sql insert it replaced.
+
+    python benchmarks/bench_points_insert.py [copies of inficoncsv.csv, default 7]
+
+The rows are inserted into a fresh migrated project database, best of 3, and the rows read
+back from both inserts are compared.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app  # noqa: E402
+import dbschema  # noqa: E402
+
+
+def to_sql(connection, df):
+    df[app.pointsColumns].to_sql(name="PointsTable", con=connection, if_exists="append", index=False)
+
+
+def executemany(connection, df):
+    app.insertPointsIntoDB(connection.cursor(), df)
+    connection.commit()
+
+
+def main(copies):
+    df = pd.read_csv(os.path.join(ROOT, "inficoncsv.csv"), parse_dates=["Flight_Date"])
+    df = pd.concat([df] * copies, ignore_index=True)
+    print("%d rows" % len(df))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for insert in (to_sql, executemany):
+            times = []
+            for k in range(3):
+                connection = sqlite3.connect(os.path.join(tmp, "%s%d.db" % (insert.__name__, k)))
+                dbschema.migrate(connection)
+                start = time.perf_counter()
+                insert(connection, df)
+                times.append(time.perf_counter() - start)
+            print("  %-12s %6.3f s" % (insert.__name__, min(times)))
+            rows.append(connection.execute('SELECT %s FROM "PointsTable"' % ", ".join(app.pointsColumns)).fetchall())
+            connection.close()
+    print("rows identical: %s" % (rows[0] == rows[1]))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
@@ -0,0 +1,65 @@
+"""
+Timing of geometry_tools.rdp_indices against the recursive rdp it replaced, on random walk tracks.
+
+    python benchmarks/bench_rdp.py [largest track for the recursive rdp, default 50000]
+
+The recursive rdp is quadratic on noisy tracks with a small epsilon, it is only run up to the given size.
+"""
+import os
+import sys
+import time
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import geometry_tools as gt  # noqa: E402
+
+
+def legacy_rdp(points, epsilon):
+    start = np.tile(np.expand_dims(points[0], axis=0), (points.shape[0], 1))
+    end = np.tile(np.expand_dims(points[-1], axis=0), (points.shape[0], 1))
+    dist_point_to_line = np.abs(np.cross(end - start, points - start, axis=-1)) / np.linalg.norm(end - start, axis=-1)
+    max_idx = np.argmax(dist_point_to_line)
+    max_value = dist_point_to_line[max_idx]
+    result = []
+    if max_value > epsilon:
+        partial_results_left = legacy_rdp(points[:max_idx + 1], epsilon)
+        result += [list(i) for i in partial_results_left if list(i) not in result]
+        partial_results_right = legacy_rdp(points[max_idx:], epsilon)
+        result += [list(i) for i in partial_results_right if list(i) not in result]
+    else:
+        result += [points[0], points[-1]]
+    return result
+
+
+def track(n, seed):
+    # random walk in degrees with unique points, like a cleaned flight log.
+    r = np.random.default_rng(seed)
+    xy = np.round(np.cumsum(r.normal(0, 1e-5, (n, 2)), axis=0) + [-83.5, 42.4], 7)
+    return xy[np.sort(np.unique(xy, axis=0, return_index=True)[1])]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(legacyMax):
+    warnings.simplefilter("ignore", DeprecationWarning)
+    sys.setrecursionlimit(1000000)
+    print("%-8s %8s %8s %12s %12s" % ("epsilon", "points", "kept", "recursive", "iterative"))
+    for epsilon, sizes in ((1e-4, (10000, 50000, 100000, 500000)), (1e-6, (10000, 50000, 100000))):
+        for n in sizes:
+            points = track(n, 7)
+            keep, new = timed(gt.rdp_indices, points, epsilon)
+            old = "-"
+            if len(points) <= legacyMax:
+                kept, seconds = timed(legacy_rdp, points, epsilon)
+                assert len(kept) == len(keep)
+                old = "%.3f s" % seconds
+            print("%-8g %8d %8d %12s %10.3f s" % (epsilon, len(points), len(keep), old, new))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
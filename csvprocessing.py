@@ -1,48 +1,153 @@
+import numpy as np
 import pandas as pd
 from scipy.signal import find_peaks
 
+NS_PER_DAY = 86400 * 1000000000
+# bump whenever the cleaned output changes, cached frames (see dfcache) are keyed on it.
+CLEANER_VERSION = 1
+# rows per chunk when streaming a csv through the cleaners
+CHUNK_SIZE = 50000
+# raw columns used by the cleaners
+SNIFFER_COLUMNS = ["Timestamp(ms)", "SenseLong", "SenseLat", "CH4"]
+INFICON_COLUMNS = ["Date", "Time", "Long", "Lat", "CH4"]
+
 
 def time_to_microsecond(t):
     return t.hour * 1e+6 + t.minute * 6e+7 + t.second * 1e+6 + t.microsecond
 
 
-def clean_flight_log(source_file_name, flight_log):
-    # source_file_name = in_file.split('\\')[-1]
-    # flight_log = pd.read_csv(in_file)
+def datetime_to_microsecond(times):
+    """
+    Vectorized time_to_microsecond over a datetime column, using integer
+    arithmetic on the underlying datetime64[ns] values.
+    :param times: pandas datetime64 series
+    :return: numpy float array, NaN where the time is missing
+    """
+    values = times.to_numpy(dtype="datetime64[ns]")
+    ns_of_day = values.view("i8") % NS_PER_DAY
+    hour, rest = np.divmod(ns_of_day, 3600 * 1000000000)
+    minute, rest = np.divmod(rest, 60 * 1000000000)
+    second, rest = np.divmod(rest, 1000000000)
+    microsec = hour * 1e+6 + minute * 6e+7 + second * 1e+6 + rest // 1000
+    microsec[np.isnat(values)] = np.nan
+    return microsec
+
+
+def _numeric_notnull(column):
+    # columns read with a numeric dtype (see csvreader) skip the to_numeric coercion.
+    if pd.api.types.is_numeric_dtype(column):
+        return column.notnull()
+    return pd.to_numeric(column, errors='coerce').notnull()
+
+
+def coerce_numeric(flight_log, columns):
+    """
+    Convert columns to numbers, values that are not numbers become NaN.
+    Columns that already have a numeric dtype are left as they are.
+    :param flight_log: pandas dataframe
+    :param columns: names of the columns to convert
+    :return: dataframe with numeric columns
+    """
+    text = [i for i in columns if not pd.api.types.is_numeric_dtype(flight_log[i])]
+    if text:
+        flight_log = flight_log.copy()
+        for i in text:
+            flight_log[i] = pd.to_numeric(flight_log[i], errors='coerce')
+    return flight_log
 
-    # 1, drop rows with coordinates being 0 and null
+
+def drop_invalid_coordinates(flight_log, long_col="SenseLong", lat_col="SenseLat"):
+    """
+    Drop rows with coordinates being 0 or not numeric.
+    :param flight_log: pandas dataframe
+    :param long_col: name of the longitude column
+    :param lat_col: name of the latitude column
+    :return: filtered dataframe
+    """
     # l = len(flight_log.index)
-    flight_log = flight_log[flight_log["SenseLong"] != 0.0]
-    flight_log = flight_log[flight_log["SenseLat"] != 0.0]
+    flight_log = flight_log[flight_log[long_col] != 0.0]
+    flight_log = flight_log[flight_log[lat_col] != 0.0]
     # l2 = len(flight_log.index)
     # diff = l - l2
     # if diff > 0:
     #     print(f"{diff} Lat/Lons at 0 removed")
-    flight_log = flight_log[pd.to_numeric(flight_log['SenseLong'], errors='coerce').notnull()]
-    flight_log = flight_log[pd.to_numeric(flight_log['SenseLat'], errors='coerce').notnull()]
+    flight_log = flight_log[_numeric_notnull(flight_log[long_col])]
+    flight_log = flight_log[_numeric_notnull(flight_log[lat_col])]
     # diff = l2 - len(flight_log.index)
     # if diff > 0:
     #     print(f"{diff} null Lat/Lons removed")
+    return flight_log
 
-    # 2, drop rows with the same senselong and senselat, but keep the one with the largest ch4. Then, drop rows with the same senselong, senselat, and ch4, but keeping the first.
-    # flight_log = flight_log.drop_duplicates(subset = ['SenseLong', 'SenseLat', 'CH4'], keep = 'first')
-    ch4_maxes = flight_log.groupby(["SenseLong", "SenseLat"]).CH4.transform(max)
-    flight_log = flight_log.loc[flight_log.CH4 == ch4_maxes]
-    flight_log = flight_log.drop_duplicates(subset = ['SenseLong', 'SenseLat'], keep = 'first')
 
+def _dedup_key(column):
+    # numeric coordinates are sorted as they are, anything else by its factorized code.
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype="float64", na_value=np.nan)
+    codes = pd.factorize(column)[0].astype("float64")
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def dedup_max_ch4(flight_log, long_col="SenseLong", lat_col="SenseLat"):
+    """
+    Drop rows with the same coordinates, but keep the one with the largest ch4.
+    If several rows share that largest ch4, keep the first. Done with a single
+    lexsort on (coordinates, -ch4, row position) instead of groupby-transform,
+    filter and drop_duplicates. Rows with a missing coordinate or ch4 are dropped.
+    :param flight_log: pandas dataframe
+    :param long_col: name of the longitude column
+    :param lat_col: name of the latitude column
+    :return: deduplicated dataframe, in the original row order
+    """
+    longs = _dedup_key(flight_log[long_col])
+    lats = _dedup_key(flight_log[lat_col])
+    ch4 = flight_log["CH4"].to_numpy(dtype="float64", na_value=np.nan)
+
+    rows = np.flatnonzero(~(np.isnan(longs) | np.isnan(lats) | np.isnan(ch4)))
+    rows = rows[np.lexsort((rows, -ch4[rows], lats[rows], longs[rows]))]
+    longs, lats = longs[rows], lats[rows]
+    # after sorting, the first row of every coordinate run is the one to keep.
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (longs[1:] != longs[:-1]) | (lats[1:] != lats[:-1])
+    return flight_log.iloc[np.sort(rows[first])]
+
+
+def dedup_max_ch4_chunks(chunks, columns, long_col="SenseLong", lat_col="SenseLat"):
+    """
+    Streaming version of drop_invalid_coordinates + dedup_max_ch4. Only the
+    current max-ch4 row of every coordinate pair seen so far is kept between
+    chunks, so peak memory is bounded by the cleaned output plus one chunk.
+    :param chunks: iterable of pandas dataframes, e.g. pd.read_csv(chunksize=...)
+    :param columns: columns to keep from every chunk
+    :param long_col: name of the longitude column
+    :param lat_col: name of the latitude column
+    :return: deduplicated dataframe with numeric coordinate and ch4 columns, the same for any chunk size
+    """
+    kept = None
+    for chunk in chunks:
+        # every chunk infers its own dtypes when read without a schema, a coordinate column can be text
+        # in one chunk and numbers in the next. Coerce them so the zero filter and dedup keys agree.
+        chunk = coerce_numeric(chunk[columns], [long_col, lat_col, "CH4"])
+        chunk = drop_invalid_coordinates(chunk, long_col, lat_col)
+        chunk = dedup_max_ch4(chunk, long_col, lat_col)
+        if kept is None:
+            kept = chunk
+        else:
+            # kept rows all come before this chunk in the file, so "keep first" still holds.
+            kept = dedup_max_ch4(pd.concat([kept, chunk]), long_col, lat_col)
+    if kept is None:
+        return pd.DataFrame(columns=columns)
+    return kept
+
+
+def _finish_flight_log(source_file_name, flight_log):
     flight_log["Source_Name"] = source_file_name
     flight_log["CH4"] = round(flight_log["CH4"]).astype(int)
 
     time_ns = flight_log["Timestamp(ms)"] * 1000000
     time_convert = pd.to_datetime(time_ns, yearfirst=True, unit="ns")
-    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S")
-    re_convert = pd.to_datetime(time_col)
-    flight_log["Flight_Date"] = re_convert
-
-    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S.%f")
-    time_col = pd.to_datetime(time_col).dt.time
-    flight_log["time"] = time_col
-    flight_log["Microsec"] = flight_log.apply(lambda r: time_to_microsecond(r["time"]), axis=1)
+    flight_log["Flight_Date"] = time_convert.dt.floor("s")
+    flight_log["Microsec"] = datetime_to_microsecond(time_convert)
 
     # flight_log["Microsec"] = flight_log["Microsec"].astype(int)
     # flight_log["Flight_Date"] = flight_log["Flight_Date"].astype(str)
@@ -55,25 +160,12 @@ def clean_flight_log(source_file_name, flight_log):
     return flight_log
 
 
-def cleanInficon(source_file_name, flight_log):
-    flight_log = flight_log[flight_log["Long"] != 0.0]
-    flight_log = flight_log[flight_log["Lat"] != 0.0]
-    flight_log = flight_log[pd.to_numeric(flight_log['Long'], errors='coerce').notnull()]
-    flight_log = flight_log[pd.to_numeric(flight_log['Lat'], errors='coerce').notnull()]
-
-    # flight_log = flight_log.drop_duplicates(subset = ['Long', 'Lat', 'CH4'], keep = 'first')
-    ch4_maxes = flight_log.groupby(["Long", "Lat"]).CH4.transform(max)
-    flight_log = flight_log.loc[flight_log.CH4 == ch4_maxes]
-    flight_log = flight_log.drop_duplicates(subset = ['Long', 'Lat'], keep = 'first')
-
+def _finish_inficon(source_file_name, flight_log):
     flight_log["Source_Name"] = source_file_name
     flight_log["CH4"] = round(flight_log["CH4"]).astype(int)
     flight_log["Flight_Date"] = flight_log["Date"] + " " + flight_log["Time"]
     time_convert = pd.to_datetime(flight_log["Flight_Date"])
-    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S.%f")
-    time_col = pd.to_datetime(time_col).dt.time
-    flight_log["time"] = time_col
-    flight_log["Microsec"] = flight_log.apply(lambda r: time_to_microsecond(r["time"]), axis=1)
+    flight_log["Microsec"] = datetime_to_microsecond(time_convert)
     flight_log["Peak"] = 0
 
     flight_log.rename(columns={"Long": "SenseLong", "Lat": "SenseLat"}, inplace=True)
@@ -87,6 +179,47 @@ def cleanInficon(source_file_name, flight_log):
     return flight_log
 
 
+def clean_flight_log(source_file_name, flight_log):
+    # source_file_name = in_file.split('\\')[-1]
+    # flight_log = pd.read_csv(in_file)
+
+    # 1, drop rows with coordinates being 0 and null
+    flight_log = drop_invalid_coordinates(flight_log)
+
+    # 2, drop rows with the same senselong and senselat, but keep the one with the largest ch4. Then, drop rows with the same senselong, senselat, and ch4, but keeping the first.
+    flight_log = dedup_max_ch4(flight_log)
+
+    return _finish_flight_log(source_file_name, flight_log)
+
+
+def clean_flight_log_chunks(source_file_name, chunks):
+    """
+    Same as clean_flight_log, but consumes the csv chunk by chunk.
+    :param source_file_name: csv name stored as Source_Name
+    :param chunks: iterable of dataframes, e.g. pd.read_csv(path, chunksize=CHUNK_SIZE)
+    :return: cleaned dataframe
+    """
+    flight_log = dedup_max_ch4_chunks(chunks, SNIFFER_COLUMNS)
+    return _finish_flight_log(source_file_name, flight_log)
+
+
+def cleanInficon(source_file_name, flight_log):
+    flight_log = drop_invalid_coordinates(flight_log, "Long", "Lat")
+    flight_log = dedup_max_ch4(flight_log, "Long", "Lat")
+    return _finish_inficon(source_file_name, flight_log)
+
+
+def cleanInficonChunks(source_file_name, chunks):
+    """
+    Same as cleanInficon, but consumes the csv chunk by chunk.
+    :param source_file_name: csv name stored as Source_Name
+    :param chunks: iterable of dataframes, e.g. pd.read_csv(file, chunksize=CHUNK_SIZE)
+    :return: cleaned dataframe
+    """
+    flight_log = dedup_max_ch4_chunks(chunks, INFICON_COLUMNS, "Long", "Lat")
+    return _finish_inficon(source_file_name, flight_log)
+
+
 def find_ch4_peaks(df, height=200, distance=7):
     peaks = find_peaks(df["CH4"], height=height, distance=distance)
     df.loc[peaks[0], ["Peak"]] = 1
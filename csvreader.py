@@ -0,0 +1,105 @@
+import os
+from functools import partial
+import pandas as pd
+import csvprocessing as cp
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_ENGINE = True
+except ImportError:
+    PYARROW_ENGINE = False
+
+# columns read from each sensor format, with their dtypes. Other columns are never parsed.
+SNIFFER_SCHEMA = {"Timestamp(ms)": "int64",
+                  "SenseLong": "float64",
+                  "SenseLat": "float64",
+                  "CH4": "float64"}
+INFICON_SCHEMA = {"Date": str,
+                  "Time": str,
+                  "Long": "float64",
+                  "Lat": "float64",
+                  "CH4": "float64"}
+# files up to this size are parsed in one go with pyarrow (when installed), larger ones in chunks.
+PYARROW_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _remaining_bytes(source):
+    """
+    Number of bytes left to read in a path or seekable file, None if unknown.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    try:
+        position = source.tell()
+        end = source.seek(0, os.SEEK_END)
+        source.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def read_chunks(source, schema, strict=True, chunksize=cp.CHUNK_SIZE):
+    """
+    Read only the schema columns of a csv, as an iterable of dataframes.
+    Small files are read at once with the pyarrow engine if it is installed,
+    otherwise the c engine streams chunks of chunksize rows.
+    :param source: csv path or file object positioned at the csv header
+    :param schema: dict of column name to dtype, e.g. SNIFFER_SCHEMA
+    :param strict: parse with the schema dtypes. If False, only prune the
+        columns and let pandas infer types, for files with non-numeric values.
+    :param chunksize: rows per chunk for the c engine
+    :return: iterable of pandas dataframes
+    """
+    dtype = schema if strict else None
+    if PYARROW_ENGINE:
+        size = _remaining_bytes(source)
+        if size is not None and size <= PYARROW_MAX_BYTES:
+            return [pd.read_csv(source, usecols=list(schema), dtype=dtype, engine="pyarrow")]
+    return pd.read_csv(source, usecols=list(schema), dtype=dtype, chunksize=chunksize)
+
+
+def _read_and_clean(source, schema, clean):
+    # a value that does not fit the schema dtype (e.g. text in a coordinate column) makes the
+    # strict parse fail, then the csv is read again and left to the cleaner's numeric filters.
+    start = None if isinstance(source, (str, os.PathLike)) else source.tell()
+    try:
+        return clean(read_chunks(source, schema))
+    except ValueError:
+        if start is not None:
+            source.seek(start)
+        return clean(read_chunks(source, schema, strict=False))
+
+
+def read_sniffer(source, source_name):
+    """
+    Read and clean a SnifferDrone csv.
+    :param source: csv path or file object
+    :param source_name: name stored as Source_Name
+    :return: cleaned dataframe, see csvprocessing.clean_flight_log
+    """
+    return _read_and_clean(source, SNIFFER_SCHEMA, partial(cp.clean_flight_log_chunks, source_name))
+
+
+def skip_inficon_header(file):
+    """
+    Move an inficon csv file object past its instrument header, which ends with a blank line.
+    """
+    while file.readline().strip():
+        pass
+
+
+def read_inficon(source, source_name):
+    """
+    Read and clean an Inficon csv.
+    :param source: csv path, or file object already moved past the header (see skip_inficon_header)
+    :param source_name: name stored as Source_Name
+    :return: cleaned dataframe, see csvprocessing.cleanInficon. None if a path is not an inficon csv.
+    """
+    clean = partial(cp.cleanInficonChunks, source_name)
+    if not isinstance(source, (str, os.PathLike)):
+        return _read_and_clean(source, INFICON_SCHEMA, clean)
+    with open(source, "rb") as file:
+        if file.read(1) != b"I":
+            return None
+        skip_inficon_header(file)
+        return _read_and_clean(file, INFICON_SCHEMA, clean)
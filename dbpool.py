@@ -0,0 +1,103 @@
+"""
+Pooled sqlite connections, one per thread per database path.
+
+Connections are opened once with WAL journaling, so a long write (e.g. /buffer)
+no longer blocks readers, and reused by later requests on the same thread.
+Call end_request() when a request finishes, it rolls back whatever the request
+left uncommitted and closes the connections of threads that have exited.
+Everything left is closed at interpreter exit by close_all().
+"""
+import atexit
+import os
+import sqlite3
+import threading
+
+# seconds a statement waits on a lock held by another connection before "database is locked".
+BUSY_TIMEOUT = 30
+# page cache per connection in KiB (negative cache_size), the sqlite default is 2 MiB.
+CACHE_KIB = 32 * 1024
+# NORMAL only syncs at checkpoints in WAL mode, committed transactions survive an application crash.
+SYNCHRONOUS = "NORMAL"
+
+_lock = threading.Lock()
+# {(thread ident, path): connection}
+_connections = {}
+
+
+def _connect(path):
+    # check_same_thread is off so close_all and end_request can close connections of other
+    # threads, a connection is still only used by the thread that opened it.
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    connection.execute(f"PRAGMA cache_size = {-CACHE_KIB}")
+    return connection
+
+
+def get_connection(path):
+    """
+    Connection of the calling thread to a database, opened on first use.
+    Connecting creates the database file if it does not exist.
+    :param path: sqlite database path
+    :return: sqlite3 connection
+    """
+    key = (threading.get_ident(), path)
+    connection = _connections.get(key)
+    if connection is None:
+        connection = _connect(path)
+        with _lock:
+            _connections[key] = connection
+    return connection
+
+
+def _close(connections):
+    for connection in connections:
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+
+def end_request():
+    """
+    Roll back uncommitted changes of the calling thread, so a failed request does not keep
+    the write lock, and close the connections of threads that have exited.
+    """
+    ident = threading.get_ident()
+    alive = {i.ident for i in threading.enumerate()}
+    with _lock:
+        dead = [key for key in _connections if key[0] not in alive]
+        closing = [_connections.pop(key) for key in dead]
+        own = [connection for (owner, _), connection in _connections.items() if owner == ident]
+    for connection in own:
+        if connection.in_transaction:
+            connection.rollback()
+    _close(closing)
+
+
+def close_all():
+    """
+    Close every pooled connection.
+    """
+    with _lock:
+        closing = list(_connections.values())
+        _connections.clear()
+    _close(closing)
+
+
+# connections inherited from the parent process, never used or closed, see _forget.
+_inherited = []
+
+
+def _forget():
+    # a forked child (e.g. the /append upload processes) must not use or close the connections of its
+    # parent, sqlite does not support that. They are kept referenced and the child opens its own.
+    global _lock
+    _lock = threading.Lock()
+    _inherited.extend(_connections.values())
+    _connections.clear()
+
+
+atexit.register(close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget)
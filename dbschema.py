@@ -0,0 +1,309 @@
+"""
+Schema of the project sqlite databases and its migrations.
+
+Layer tables (buffers, paths, peaks) keep one row per layer with its geometry
+stored once, as WKB in UTM, and the EPSG code of that zone in Utm_zone.
+GeoJSON and Esri JSON are written from it when a layer is read. The WGS 1984
+bounding box and number of parts are kept beside it for the layer catalog.
+The text tables of databases created before version 3 are kept, renamed
+with LEGACY_SUFFIX.
+
+Points and layers are indexed by R*Tree virtual tables (SPATIAL_INDEXES) on
+their WGS 1984 bounding boxes, kept in sync by triggers. Tree entries refer
+to table rowids, do not VACUUM a project database (it may renumber them).
+
+Buffers and paths also get simplified copies for lower web map zoom levels
+in the LevelsTable, see insert_levels.
+
+Uploads to ArcGIS are recorded chunk by chunk in the AppendJournal, see
+appendjournal.py.
+
+The schema version of a database is kept in PRAGMA user_version. Databases
+created before versioning report 0 and are upgraded in place by migrate(),
+which runs every missing migration in order, each in its own transaction.
+"""
+import ast
+import json
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+import shapely.errors
+from shapely import wkb
+from shapely.geometry import shape
+import geometry_tools as gt
+
+POINTS_TABLE = "PointsTable"
+# tables of one geometry row per layer.
+LAYER_TABLES = ["BuffersTable", "LinesTable", "PeaksTable"]
+# columns filled from layer_bounds.
+LAYER_BOUNDS_COLUMNS = ["Min_long", "Min_lat", "Max_long", "Max_lat", "Parts"]
+# simplified copies of the layers of LOD_TABLES, one per zoom of LOD_ZOOMS, see geometry_tools.lod_levels
+LEVELS_TABLE = "LevelsTable"
+LOD_TABLES = ["BuffersTable", "LinesTable"]
+LOD_ZOOMS = [8, 10, 12, 14, 16]
+# addFeatures chunks and their state, see appendjournal.py
+JOURNAL_TABLE = "AppendJournal"
+# suffix of the layer tables as they were before version 3, with geojson and esri json text, kept when
+# their geometry is converted to WKB.
+LEGACY_SUFFIX = "_text"
+# R*Tree of the bounding boxes of each table, the id of an entry is the rowid of the row in the table.
+SPATIAL_INDEXES = {table: table.replace("Table", "Tree") for table in [POINTS_TABLE] + LAYER_TABLES}
+
+
+def _create_tables(cursor):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {POINTS_TABLE} (
+            "Microsec" INTEGER,
+            "Flight_date" TEXT,
+            "Senselong" REAL NOT NULL,
+            "Senselat" REAL NOT NULL,
+            "CH4" INTEGER,
+            "Peak" INTEGER,
+            "Source_name" TEXT NOT NULL,
+            "Utmlong" REAL NOT NULL,
+            "Utmlat" REAL NOT NULL
+        )''')
+    for table in LAYER_TABLES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                "Geometry" TEXT,
+                "Source_name" TEXT,
+                "EsriGeometry" TEXT
+            )''')
+
+
+def _create_source_name_indexes(cursor):
+    # (Source_name, Peak) also serves lookups and deletes on Source_name alone.
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{POINTS_TABLE}_source_peak ON {POINTS_TABLE} ("Source_name", "Peak")')
+    for table in LAYER_TABLES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_source ON {table} ("Source_name")')
+
+
+# repr of the numpy scalars in the geometry text of paths, str() of a dict of coordinate lists under numpy 2.
+_NUMPY_SCALAR = re.compile(r"np\.(?:float|int)\d*\(([^()]*)\)")
+
+
+def _parse_text_geometry(text):
+    # buffers and peaks were json.dumps output with the quotes swapped, paths str() of a python dict.
+    try:
+        return json.loads(text.replace("'", '"'))
+    except ValueError:
+        return ast.literal_eval(_NUMPY_SCALAR.sub(r"\1", text))
+
+
+def _text_geometry_to_wkb(cursor, table, text, name):
+    # geojson text with single quotes, as stored before version 3. A row that cannot be converted
+    # aborts the migration, the database is left at version 2 with its text intact.
+    if text is None:
+        return None, None
+    try:
+        geom = shape(_parse_text_geometry(text))
+    except (AttributeError, KeyError, TypeError, ValueError, SyntaxError, shapely.errors.ShapelyError) as error:
+        raise sqlite3.DatabaseError(f"cannot convert the geometry of {name} in {table}: {error}") from error
+    if geom.is_empty:
+        return None, None
+    # same zone as project_df, the zone of the first point of the layer's csv.
+    first = cursor.execute('SELECT "Senselat", "Senselong" FROM PointsTable WHERE "Source_name" == ? ORDER BY rowid LIMIT 1',
+                           [name.rsplit("-", 1)[0] + "-path"]).fetchone()
+    if first is None:
+        first = (geom.centroid.y, geom.centroid.x)
+    sr = gt.find_utm_zone(*first)
+    return wkb.dumps(gt.reproject(geom, sr)), sr
+
+
+def _store_geometry_as_wkb(cursor):
+    # layer tables kept geojson text with swapped quotes and a second esri json text copy.
+    # They are rebuilt with the geometry stored once, as UTM WKB with the EPSG code of its zone.
+    # Text tables with rows are kept as they were, renamed with LEGACY_SUFFIX.
+    for table in LAYER_TABLES:
+        rows = cursor.execute(f'SELECT "Geometry", "Source_name" FROM {table}').fetchall()
+        converted = [(name,) + _text_geometry_to_wkb(cursor, table, text, name) for text, name in rows]
+        if rows:
+            # the index of the text table would keep its name and stop the new table from getting one.
+            cursor.execute(f"DROP INDEX IF EXISTS idx_{table}_source")
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {table}{LEGACY_SUFFIX}")
+        else:
+            cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f'''
+            CREATE TABLE {table} (
+                "Source_name" TEXT,
+                "Geometry" BLOB,
+                "Utm_zone" INTEGER
+            )''')
+        cursor.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)", converted)
+    _create_source_name_indexes(cursor)
+
+
+def layer_bounds(geom, sr):
+    """
+    Catalog columns of a layer geometry.
+    :param geom: shapely geometry in UTM
+    :param sr: EPSG code of its UTM zone
+    :return: (min long, min lat, max long, max lat, number of parts), the bounds in WGS 1984
+    """
+    parts = len(geom.geoms) if hasattr(geom, "geoms") else 1
+    return tuple(gt.reproject(geom, 4326, sr).bounds) + (parts,)
+
+
+def _add_layer_bounds(cursor):
+    # bounding box and part count per layer, so the catalog never decodes geometry.
+    for table in LAYER_TABLES:
+        for column in LAYER_BOUNDS_COLUMNS:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {"INTEGER" if column == "Parts" else "REAL"}')
+        rows = cursor.execute(f'SELECT rowid, "Geometry", "Utm_zone" FROM {table} WHERE "Geometry" IS NOT NULL').fetchall()
+        cursor.executemany(f'UPDATE {table} SET {", ".join(f"{i} = ?" for i in LAYER_BOUNDS_COLUMNS)} WHERE rowid = ?',
+                           [layer_bounds(wkb.loads(blob), sr) + (rowid,) for rowid, blob, sr in rows])
+
+
+def epoch_seconds(flightDates):
+    """
+    Seconds since 1970 of the Flight_Date of points, for time range queries.
+    :param flightDates: pandas series of datetimes or date strings of one format
+    :return: float numpy array, NaN where the date cannot be parsed
+    """
+    if flightDates.dtype.kind != "M":
+        flightDates = pd.to_datetime(flightDates, errors="coerce")
+    values = flightDates.to_numpy(dtype="datetime64[ns]")
+    seconds = values.astype("int64") / 1e9
+    seconds[np.isnat(values)] = np.nan
+    return seconds
+
+
+def _add_spatial_indexes(cursor):
+    # Epoch keeps the Flight_date of a point as a number, the text formats of the sensors do not sort.
+    cursor.execute(f'ALTER TABLE {POINTS_TABLE} ADD COLUMN "Epoch" REAL')
+    points = pd.DataFrame(cursor.execute(f'SELECT rowid, "Flight_date", "Source_name" FROM {POINTS_TABLE}').fetchall(),
+                          columns=["rowid", "Flight_date", "Source_name"])
+    # every csv has one date format, parse them one csv at a time.
+    for _, group in points.groupby("Source_name"):
+        seconds = epoch_seconds(group["Flight_date"])
+        cursor.executemany(f'UPDATE {POINTS_TABLE} SET "Epoch" = ? WHERE rowid = ?',
+                           zip([None if np.isnan(i) else i for i in seconds.tolist()], group["rowid"].tolist()))
+    # the trees are kept in sync with their tables by triggers, so every insert and delete updates them.
+    tree = SPATIAL_INDEXES[POINTS_TABLE]
+    cursor.execute(f"CREATE VIRTUAL TABLE {tree} USING rtree(id, Min_long, Max_long, Min_lat, Max_lat)")
+    cursor.execute(f'INSERT INTO {tree} SELECT rowid, "Senselong", "Senselong", "Senselat", "Senselat" FROM {POINTS_TABLE}')
+    cursor.execute(f'''
+        CREATE TRIGGER {tree}_insert AFTER INSERT ON {POINTS_TABLE} BEGIN
+            INSERT INTO {tree} VALUES (new.rowid, new."Senselong", new."Senselong", new."Senselat", new."Senselat");
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {tree}_delete AFTER DELETE ON {POINTS_TABLE} BEGIN
+            DELETE FROM {tree} WHERE id = old.rowid;
+        END''')
+    for table in LAYER_TABLES:
+        tree = SPATIAL_INDEXES[table]
+        cursor.execute(f"CREATE VIRTUAL TABLE {tree} USING rtree(id, Min_long, Max_long, Min_lat, Max_lat)")
+        cursor.execute(f'INSERT INTO {tree} SELECT rowid, "Min_long", "Max_long", "Min_lat", "Max_lat" FROM {table} WHERE "Min_long" IS NOT NULL')
+        cursor.execute(f'''
+            CREATE TRIGGER {tree}_insert AFTER INSERT ON {table} WHEN new."Min_long" IS NOT NULL BEGIN
+                INSERT INTO {tree} VALUES (new.rowid, new."Min_long", new."Max_long", new."Min_lat", new."Max_lat");
+            END''')
+        cursor.execute(f'''
+            CREATE TRIGGER {tree}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {tree} WHERE id = old.rowid;
+            END''')
+
+
+def insert_levels(cursor, name, geom, lat):
+    """
+    Store the simplified copies of a layer geometry in the LevelsTable.
+    :param cursor: sqlite3 cursor
+    :param name: Source_name of the layer
+    :param geom: layer geometry in UTM
+    :param lat: latitude of the layer, e.g. the middle of its bounding box
+    """
+    cursor.executemany(f'INSERT INTO {LEVELS_TABLE} ("Source_name", "Zoom", "Geometry") VALUES (?, ?, ?)',
+                       [(name, zoom, wkb.dumps(simple)) for zoom, simple in gt.lod_levels(geom, lat, LOD_ZOOMS)])
+
+
+def _add_levels(cursor):
+    cursor.execute(f'''
+        CREATE TABLE {LEVELS_TABLE} (
+            "Source_name" TEXT NOT NULL,
+            "Zoom" INTEGER NOT NULL,
+            "Geometry" BLOB NOT NULL
+        )''')
+    cursor.execute(f'CREATE INDEX idx_{LEVELS_TABLE}_source_zoom ON {LEVELS_TABLE} ("Source_name", "Zoom")')
+    for table in LOD_TABLES:
+        # levels go away with their layer.
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_levels_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {LEVELS_TABLE} WHERE "Source_name" == old."Source_name";
+            END''')
+        rows = cursor.execute(f'SELECT "Source_name", "Geometry", "Min_lat", "Max_lat" FROM {table} WHERE "Geometry" IS NOT NULL').fetchall()
+        for name, blob, minLat, maxLat in rows:
+            insert_levels(cursor, name, wkb.loads(blob), (minLat + maxLat) / 2)
+
+
+def create_journal_table(cursor):
+    """
+    Create the append journal table and its index if they do not exist. Used by the migration of
+    project databases and, alone, for a standalone journal file (see appendjournal.AppendJournal).
+    :param cursor: sqlite3 cursor
+    """
+    # Names holds the Source_Name of every feature of the chunk as [name, count] runs.
+    # Features is the json of the chunk, dropped once the chunk is acknowledged.
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+            "Chunk" INTEGER PRIMARY KEY,
+            "Target_url" TEXT NOT NULL,
+            "State" TEXT NOT NULL,
+            "Names" TEXT NOT NULL,
+            "Features" TEXT,
+            "Results" TEXT,
+            "Attempts" INTEGER NOT NULL DEFAULT 0,
+            "Error" TEXT,
+            "Updated" REAL
+        )''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{JOURNAL_TABLE}_target_state ON {JOURNAL_TABLE} ("Target_url", "State")')
+
+
+def _add_append_journal(cursor):
+    create_journal_table(cursor)
+
+
+# migration i upgrades a database from version i to version i + 1.
+MIGRATIONS = [_create_tables,
+              _create_source_name_indexes,
+              _store_geometry_as_wkb,
+              _add_layer_bounds,
+              _add_spatial_indexes,
+              _add_levels,
+              _add_append_journal]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(connection):
+    """
+    :param connection: sqlite3 connection
+    :return: schema version of the database, 0 for databases created before versioning
+    """
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection):
+    """
+    Create or upgrade the tables and indexes of a project database to SCHEMA_VERSION.
+    :param connection: sqlite3 connection
+    :return: schema version before the upgrade
+    """
+    version = schema_version(connection)
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(f"database schema version {version} is newer than this app ({SCHEMA_VERSION})")
+    if version < SCHEMA_VERSION and connection.in_transaction:
+        # every migration runs in its own transaction, a pooled connection may still have one open.
+        connection.commit()
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("BEGIN")
+            MIGRATIONS[target - 1](cursor)
+            # pragma arguments cannot be bound parameters.
+            cursor.execute(f"PRAGMA user_version = {target}")
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+    return version
@@ -0,0 +1,194 @@
+"""
+On disk cache of cleaned and projected flight log dataframes.
+
+Entries are keyed by the sha256 of the csv content, the sensor format and
+the cleaner version, so reselecting a folder or re-uploading the same csv
+skips parsing, cleaning and reprojection. The cache is bounded in size and
+evicts the least recently used entries.
+
+Clear it from the command line with:
+    python dfcache.py clear
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import pandas as pd
+import csvprocessing as cp
+import csvreader
+import geometry_tools as gt
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET = True
+except ImportError:
+    PARQUET = False
+
+CACHE_DIR = os.environ.get("UPLOADER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".uploader_cache"))
+CACHE_MAX_BYTES = int(os.environ.get("UPLOADER_CACHE_MAX_MB", 1024)) * 1024 * 1024
+# bump when the layout of cached frames changes.
+CACHE_VERSION = 1
+EXTENSION = ".parquet" if PARQUET else ".pkl"
+
+
+def file_key(source, sensor):
+    """
+    Hash a csv from its current position to the end.
+    :param source: csv path or seekable file object, left at its original position
+    :param sensor: sensor format name, e.g. "SnifferDrone" or "Inficon"
+    :return: hex digest
+    """
+    digest = hashlib.sha256(f"{sensor}:{cp.CLEANER_VERSION}:{CACHE_VERSION}:".encode())
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    else:
+        start = source.tell()
+        # text streams end with "" instead of b"".
+        for block in iter(lambda: source.read(1 << 20) or None, None):
+            digest.update(block if isinstance(block, bytes) else block.encode())
+        source.seek(start)
+    return digest.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, key + EXTENSION)
+
+
+def get(key):
+    """
+    Load a cached dataframe and mark it as recently used.
+    :param key: see file_key
+    :return: pandas dataframe, or None on a miss
+    """
+    path = _entry_path(key)
+    try:
+        df = pd.read_parquet(path) if PARQUET else pd.read_pickle(path)
+        os.utime(path)
+    except Exception:
+        # a missing or unreadable entry is just a miss.
+        return None
+    return df
+
+
+def put(key, df):
+    """
+    Store a dataframe, then evict least recently used entries above CACHE_MAX_BYTES.
+    The cache is only an optimization, a failure to write it (read-only or full disk,
+    a locked file on Windows) is printed and the dataframe is not cached.
+    :param key: see file_key
+    :param df: pandas dataframe
+    :return: True if the dataframe was stored
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # write to a temporary file first so concurrent readers never see a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            if PARQUET:
+                df.to_parquet(tmp, index=False)
+            else:
+                df.to_pickle(tmp)
+            os.replace(tmp, _entry_path(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        evict()
+    except OSError as error:
+        print("flight log not cached:", error)
+        return False
+    return True
+
+
+def _entries():
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith((".parquet", ".pkl")):
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict(max_bytes=None):
+    """
+    Remove least recently used entries until the cache fits in max_bytes.
+    :param max_bytes: size limit, default CACHE_MAX_BYTES
+    :return: number of removed entries
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        entries = sorted(_entries())
+    except OSError as error:
+        print("flight log cache not evicted:", error)
+        return 0
+    total = sum(i[1] for i in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear():
+    """
+    Invalidate the whole cache.
+    :return: number of removed entries
+    """
+    return evict(0)
+
+
+def _load(source, source_name, sensor, read):
+    key = file_key(source, sensor)
+    df = get(key)
+    if df is None:
+        df = read(source, source_name)
+        if df is None:
+            return None
+        gt.project_df(df)
+        put(key, df)
+    else:
+        df["Source_Name"] = source_name
+    return df
+
+
+def load_sniffer(source, source_name):
+    """
+    Cleaned and projected SnifferDrone csv, see csvreader.read_sniffer and geometry_tools.project_df
+    """
+    return _load(source, source_name, "SnifferDrone", csvreader.read_sniffer)
+
+
+def load_inficon(source, source_name):
+    """
+    Cleaned and projected Inficon csv, see csvreader.read_inficon and geometry_tools.project_df
+    """
+    return _load(source, source_name, "Inficon", csvreader.read_inficon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the cleaned flight log cache in " + CACHE_DIR)
+    parser.add_argument("command", choices=["clear", "info"])
+    args = parser.parse_args()
+    if args.command == "clear":
+        print(f"{clear()} cache entries removed")
+    else:
+        entries = _entries()
+        print(f"{len(entries)} entries, {sum(i[1] for i in entries) / 1024 / 1024:.1f} MB in {CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
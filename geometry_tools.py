@@ -6,11 +6,66 @@ Created on Fri Apr 29 14:32:04 2022
 """
 import numpy as np
 import pyproj
-from math import ceil
+import shapely
+from math import ceil, cos, radians
+from functools import lru_cache
 from shapely.ops import transform
-from shapely.geometry import MultiPoint, mapping, Point
+from shapely.geometry import MultiPoint, mapping, Point, LineString, GeometryCollection
 import json
 
+# shapely 2 has vectorized geometry creation and coordinate transforms.
+SHAPELY_2 = hasattr(shapely, "points")
+# number of (destination, source) transformers kept by _transformer
+TRANSFORMER_CACHE_SIZE = 64
+# default error tolerance (in units of the coordinates, i.e. meters in UTM) of coverage_buffer
+BUFFER_TOLERANCE = 0.5
+# ground size in meters of a 256 pixel web map tile pixel at zoom 0 on the equator.
+ZOOM0_RESOLUTION = 156543.03392
+
+
+def rdp_indices(points, epsilon):
+    """
+    Ramer-Douglas-Peucker simplification with an explicit stack instead of
+    recursion, so long tracks cannot hit the recursion limit.
+
+    Parameters
+    ----------
+    points : numpy array
+        Ordered points comprising a line, shape (n, 2).
+    epsilon : float
+        Maximum distance of a dropped point to the simplified line.
+
+    Returns
+    -------
+    keep : numpy array
+        Sorted indices of the points kept in the simplified line. The first
+        and last index are always kept.
+
+    """
+    points = np.asarray(points, dtype="float64")
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        dx, dy = points[last] - start
+        norm = np.sqrt(dx * dx + dy * dy)
+        # same arithmetic as the cross product of (end - start) and (point - start)
+        # divided by the segment length, so the split points match the recursive version.
+        offset = points[first:last + 1] - start
+        dist_point_to_line = np.abs(dx * offset[:, 1] - dy * offset[:, 0]) / norm
+        # get the index of the points with the largest distance
+        max_idx = np.argmax(dist_point_to_line)
+        if dist_point_to_line[max_idx] > epsilon:
+            keep[first + max_idx] = True
+            stack.append((first + max_idx, last))
+            stack.append((first, first + max_idx))
+    keep = np.flatnonzero(keep)
+    return np.concatenate(([0], keep[(keep > 0) & (keep < n - 1)], [n - 1]))
+
 
 def rdp(points, epsilon):
     """
@@ -29,26 +84,8 @@ def rdp(points, epsilon):
         Ordered points comprision simplified line.
 
     """
-    # get the start and end points
-    start = np.tile(np.expand_dims(points[0], axis=0), (points.shape[0], 1))
-    end = np.tile(np.expand_dims(points[-1], axis=0), (points.shape[0], 1))
-
-    # find distance from other_points to line formed by start and end
-    dist_point_to_line = np.abs(np.cross(end - start, points - start, axis=-1)) / np.linalg.norm(end - start, axis=-1)
-    # get the index of the points with the largest distance
-    max_idx = np.argmax(dist_point_to_line)
-    max_value = dist_point_to_line[max_idx]
-
-    result = []
-    if max_value > epsilon:
-        partial_results_left = rdp(points[:max_idx + 1], epsilon)
-        result += [list(i) for i in partial_results_left if list(i) not in result]
-        partial_results_right = rdp(points[max_idx:], epsilon)
-        result += [list(i) for i in partial_results_right if list(i) not in result]
-    else:
-        result += [points[0], points[-1]]
-
-    return result
+    points = np.asarray(points, dtype="float64")
+    return points[rdp_indices(points, epsilon)].tolist()
 
 
 def find_utm_zone(lat, lon):
@@ -56,18 +93,38 @@ def find_utm_zone(lat, lon):
     Get the UTM zone for any WGS 1984 coordinate pair
     Only returns the zone number, we assume that zone is always north.
         Will need to change if we ever do work in southern hemisphere.
+    The EPSG code of WGS 84 / UTM is 32600 + zone in the north and
+    32700 + zone in the south, so no lookup in the PROJ database is needed.
     :param lat: Float
     :param lon: Float
     :return: UTM zone number
     """
     lon += 180
-    zone = int(ceil(lon / 6))
+    zone = min(max(int(ceil(lon / 6)), 1), 60)
     south = False if lat > 0 else True
 
-    crs = pyproj.CRS.from_dict({"proj": "utm",
-                                "zone": zone,
-                                "south": south})
-    return int(crs.to_authority()[1])
+    return (32700 if south else 32600) + zone
+
+
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def _transformer(dest_cs, source_cs=4326):
+    # memoized per (dest, source), pyproj transformers are thread safe since pyproj 3.1.
+    return pyproj.Transformer.from_proj(
+        pyproj.Proj(source_cs),
+        pyproj.Proj(dest_cs),
+        always_xy=True)
+
+
+def reproject_xy(x, y, dest_cs, source_cs=4326):
+    """
+    Project coordinate arrays from one CRS to another with a single vectorized call.
+    :param x: numpy array of x / longitude
+    :param y: numpy array of y / latitude
+    :param dest_cs: New CRS to project to
+    :param source_cs: CRS of input coordinates. Default WGS 1984.
+    :return: tuple of reprojected x and y numpy arrays
+    """
+    return _transformer(dest_cs, source_cs).transform(np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64"))
 
 
 def reproject(geom, dest_cs, source_cs=4326):
@@ -78,15 +135,41 @@ def reproject(geom, dest_cs, source_cs=4326):
     :param source_cs: CRS of input geom. Default WGS 1984.
     :return: reprojected geometry object
     """
-    project = pyproj.Transformer.from_proj(
-        pyproj.Proj(source_cs),
-        pyproj.Proj(dest_cs),
-        always_xy=True)
+    project = _transformer(dest_cs, source_cs)
+    if SHAPELY_2:
+        # all coordinates of geom go through the transformer as one (n, 2) array.
+        return shapely.transform(geom, lambda c: np.column_stack(project.transform(c[:, 0], c[:, 1])))
     g2 = transform(project.transform, geom)
 
     return g2
 
 
+def points_from_xy(x, y):
+    """
+    Build one shapely.geometry.Point per coordinate pair
+    :param x: numpy array of x / longitude
+    :param y: numpy array of y / latitude
+    :return: numpy object array of Points
+    """
+    if SHAPELY_2:
+        return shapely.points(np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64"))
+    points = np.empty(len(x), dtype=object)
+    points[:] = [Point(i, j) for i, j in zip(x, y)]
+    return points
+
+
+def multipoint_from_xy(x, y):
+    """
+    Build a shapely.geometry.MultiPoint from coordinate arrays
+    :param x: numpy array of x / longitude
+    :param y: numpy array of y / latitude
+    :return: MultiPoint object
+    """
+    if SHAPELY_2:
+        return shapely.multipoints(points_from_xy(x, y))
+    return MultiPoint(np.column_stack([x, y]))
+
+
 def add_points_to_df(df, colname="points"):
     """
     Convert coordinates to shapely.geometry.Point and add to pandas dataframe
@@ -94,7 +177,33 @@ def add_points_to_df(df, colname="points"):
     :param colname: name of new column with Points
     :return:
     """
-    df[colname] = df.apply(lambda r: Point(r["SenseLong"], r["SenseLat"]), axis=1)
+    df[colname] = points_from_xy(df["SenseLong"].to_numpy(), df["SenseLat"].to_numpy())
+
+
+def project_df(df):
+    """
+    Add the UTM coordinates of every point as Utmlong and Utmlat columns.
+    The UTM zone (EPSG code) of the first point is used for the whole
+    dataframe and is recorded in df.attrs["utm_zone"]. No geometry is built,
+    see utm_multipoint.
+    :param df: cleaned pandas dataframe with SenseLong and SenseLat
+    :return: UTM zone EPSG code
+    """
+    longs = df["SenseLong"].to_numpy(dtype="float64")
+    lats = df["SenseLat"].to_numpy(dtype="float64")
+    sr = find_utm_zone(lats[0], longs[0])
+    df["Utmlong"], df["Utmlat"] = reproject_xy(longs, lats, sr)
+    df.attrs["utm_zone"] = sr
+    return sr
+
+
+def utm_multipoint(df):
+    """
+    Build the UTM shapely.geometry.MultiPoint of a dataframe passed through project_df
+    :param df: pandas dataframe with Utmlong and Utmlat
+    :return: MultiPoint object
+    """
+    return multipoint_from_xy(df["Utmlong"].to_numpy(), df["Utmlat"].to_numpy())
 
 
 def series_to_multipoint(s):
@@ -106,6 +215,143 @@ def series_to_multipoint(s):
     return MultiPoint(list(s))
 
 
+def _buffer(geom, dist, quad_segs):
+    # shapely 2 renamed the resolution keyword to quad_segs and deprecates the old name.
+    if SHAPELY_2:
+        return geom.buffer(dist, quad_segs=quad_segs)
+    return geom.buffer(dist, resolution=quad_segs)
+
+
+def coverage_buffer(xy, dist, quad_segs=6, tolerance=BUFFER_TOLERANCE):
+    """
+    Approximate MultiPoint(xy).buffer(dist, quad_segs) of an ordered track
+    without buffering and unioning one circle per sample.
+    The track is split where two consecutive samples are too far apart for
+    the buffer of the segment between them to stay within tolerance / 2 of
+    their two circles (a gap of 2 * sqrt(dist^2 - (dist - tolerance / 2)^2)),
+    every part is simplified with rdp at tolerance / 2 and buffered as a
+    LineString, a part with a single sample as a Point. Samples more than
+    tolerance / 2 from their simplified segment (the track turned back) are
+    buffered as Points too.
+    The boundary of the result stays within tolerance of the exact buffer,
+    plus the chord error of the circles (0.13 m for 15 m at 6 segments).
+    See benchmarks/bench_coverage_buffer.py for its speed against the exact buffer.
+    :param xy: (n, 2) numpy array of ordered, projected coordinates
+    :param dist: buffer distance
+    :param quad_segs: segments per quarter circle
+    :param tolerance: allowed deviation from the exact buffer, 0 for the exact buffer
+    :return: shapely Polygon or MultiPolygon
+    """
+    xy = np.asarray(xy, dtype="float64")
+    if tolerance <= 0:
+        return _buffer(MultiPoint(xy), dist, quad_segs)
+    tol = min(tolerance / 2, dist)
+    max_step = 2 * np.sqrt(dist * dist - (dist - tol) ** 2)
+    step = np.hypot(*np.diff(xy, axis=0).T)
+    parts = []
+    for part in np.split(xy, np.flatnonzero(step > max_step) + 1):
+        if len(part) == 1:
+            parts.append(Point(part[0]))
+            continue
+        keep = rdp_indices(part, tol)
+        parts.append(LineString(part[keep]))
+        # rdp measures the distance to the line through a segment, a sample where the track
+        # turns back beyond the end of a segment can be dropped far from it. Buffer those as points.
+        far = _segment_distances(part, keep) > tol
+        parts.extend(Point(i) for i in part[far])
+    return _buffer(GeometryCollection(parts), dist, quad_segs)
+
+
+def _segment_distances(points, keep):
+    # distance of every point to the segment between the kept points around it.
+    segment = np.clip(np.searchsorted(keep, np.arange(len(points)), side="right") - 1, 0, len(keep) - 2)
+    start = points[keep[segment]]
+    direction = points[keep[segment + 1]] - start
+    offset = points - start
+    length2 = np.einsum("ij,ij->i", direction, direction)
+    t = np.clip(np.einsum("ij,ij->i", offset, direction) / np.where(length2 > 0, length2, 1), 0, 1)
+    return np.hypot(*(offset - t[:, None] * direction).T)
+
+
+def zoom_resolution(zoom, lat):
+    """
+    Ground size of one web map pixel (256 pixel tiles, web mercator)
+    :param zoom: web map zoom level
+    :param lat: latitude of the area in degrees
+    :return: pixel size in meters
+    """
+    return ZOOM0_RESOLUTION * cos(radians(lat)) / 2 ** zoom
+
+
+def num_coordinates(geom):
+    """
+    Number of vertices of a shapely geometry
+    """
+    if SHAPELY_2:
+        return int(shapely.get_num_coordinates(geom))
+    if hasattr(geom, "geoms"):
+        return sum(num_coordinates(i) for i in geom.geoms)
+    if geom.geom_type == "Polygon":
+        return len(geom.exterior.coords) + sum(len(i.coords) for i in geom.interiors)
+    return len(geom.coords)
+
+
+def lod_levels(geom, lat, zooms):
+    """
+    Simplified copies of a projected geometry for web map zoom levels. Each
+    copy stays within one pixel of geom at its zoom (two around the start of
+    a polygon ring, which GEOS may drop too), so it looks the same on the
+    map with fewer vertices. Topology is preserved, polygons stay valid.
+    Simplification stops at the first zoom that removes no vertex, the
+    full geometry is used from that zoom on. A zoom is left out when the
+    next one keeps as many vertices.
+    :param geom: shapely geometry in meters, e.g. UTM
+    :param lat: latitude of the geometry in degrees, see zoom_resolution
+    :param zooms: list of web map zoom levels
+    :return: list of (zoom, simplified geometry), from the lowest zoom
+    """
+    full = num_coordinates(geom)
+    levels, counts = [], []
+    for zoom in sorted(zooms):
+        simple = geom.simplify(zoom_resolution(zoom, lat), preserve_topology=True)
+        count = num_coordinates(simple)
+        if simple.is_empty or count >= full:
+            break
+        # a lower zoom that keeps as many vertices is served by this level.
+        if counts and counts[-1] == count:
+            levels.pop()
+            counts.pop()
+        levels.append((zoom, simple))
+        counts.append(count)
+    return levels
+
+
+@lru_cache(maxsize=None)
+def circle_template(radius, quad_segs=6):
+    """
+    Exterior ring of Point(0, 0).buffer(radius, quad_segs), computed once per radius and quad_segs
+    :param radius: circle radius
+    :param quad_segs: segments per quarter circle
+    :return: read only (4 * quad_segs + 1, 2) numpy array, closed ring
+    """
+    ring = np.array(_buffer(Point(0, 0), radius, quad_segs).exterior.coords)
+    ring.flags.writeable = False
+    return ring
+
+
+def peak_rings(xy, radius, quad_segs=6):
+    """
+    Rings of Point(x, y).buffer(radius, quad_segs) for every peak center at once,
+    by translating the circle template of that radius.
+    :param xy: (n, 2) numpy array of projected peak centers
+    :param radius: circle radius
+    :param quad_segs: segments per quarter circle
+    :return: (n, 4 * quad_segs + 1, 2) numpy array, one closed ring per center
+    """
+    xy = np.asarray(xy, dtype="float64").reshape(-1, 1, 2)
+    return xy + circle_template(radius, quad_segs)
+
+
 def shapely_to_geojson(geom):
     """
     Convert shapely geom to geojson string
@@ -0,0 +1,165 @@
+"""
+Text serialization of geometries for the database, the front end and the ArcGIS rest api.
+
+Coordinates are written straight from numpy arrays into a text buffer with one
+format operation per ring, instead of building nested lists of mapping() and
+round tripping them through json.dumps / json.loads. Coordinates keep full
+precision, the same digits json.dumps writes, unless a caller passes precision.
+Non finite coordinates raise ValueError instead of writing nan, which is not json.
+
+Three forms are produced from the same writers:
+    - database and front end: GeoJSON and Esri JSON with single quotes, quote="'"
+    - ArcGIS rest api: Esri JSON with double quotes, and feature_json for addFeatures
+"""
+import io
+import json
+import numpy as np
+
+
+def _pair_format(precision):
+    # %r writes the shortest repr that round trips, like json.dumps.
+    if precision is None:
+        return "[%r,%r]"
+    return "[%.{0}f,%.{0}f]".format(int(precision))
+
+
+def _finite(coords):
+    # %r and %f write nan and inf, which are not json.
+    if not np.isfinite(coords).all():
+        raise ValueError("coordinates must be finite to be written as json")
+    return coords
+
+
+def write_coords(buf, coords, precision=None):
+    """
+    Write coordinates as a json array of [x,y] pairs.
+    :param buf: text buffer, e.g. io.StringIO
+    :param coords: (n, 2) array like, or a shapely coordinate sequence. Extra dimensions are dropped.
+    :param precision: number of decimals to round to, None (default) for full precision
+    """
+    coords = np.asarray(coords, dtype="float64")
+    if coords.ndim != 2:
+        # empty sequences come back one dimensional.
+        coords = coords.reshape(-1, 2)
+    coords = _finite(coords[:, :2])
+    buf.write("[")
+    if len(coords):
+        buf.write(",".join([_pair_format(precision)] * len(coords)) % tuple(coords.ravel().tolist()))
+    buf.write("]")
+
+
+def write_rings(buf, rings, precision=None):
+    """
+    Write a json array of rings.
+    :param buf: text buffer
+    :param rings: iterable of (n, 2) coordinate arrays, or a (rings, n, 2) numpy array
+    :param precision: number of decimals to round to, None (default) for full precision
+    """
+    buf.write("[")
+    for k, ring in enumerate(rings):
+        if k:
+            buf.write(",")
+        write_coords(buf, ring, precision)
+    buf.write("]")
+
+
+def polygon_rings(polygon):
+    """
+    Exterior ring followed by the interior rings of a shapely Polygon, as coordinate sequences
+    """
+    if polygon.is_empty:
+        return []
+    return [polygon.exterior.coords] + [i.coords for i in polygon.interiors]
+
+
+def _polygons(geom):
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type == "MultiPolygon":
+        return list(geom.geoms)
+    raise ValueError("expected a Polygon or MultiPolygon, got " + geom.geom_type)
+
+
+def esri_polygon(geom, precision=None, quote='"'):
+    """
+    Esri JSON polygon of a shapely Polygon or MultiPolygon. All rings of all the
+    polygons go into one "rings" list, holes keep the orientation shapely gives them.
+    :param geom: shapely Polygon or MultiPolygon
+    :param precision: number of decimals to round to, None (default) for full precision
+    :param quote: quote character of the keys, "'" for the form stored in the database
+    :return: string like {"rings":[[[x,y],...],...]}
+    """
+    rings = [ring for polygon in _polygons(geom) for ring in polygon_rings(polygon)]
+    return esri_rings(rings, precision, quote)
+
+
+def esri_rings(rings, precision=None, quote='"'):
+    """
+    Esri JSON polygon from coordinate arrays, e.g. one ring of geometry_tools.peak_rings
+    :param rings: iterable of (n, 2) closed rings, or a (rings, n, 2) numpy array
+    :param precision: number of decimals to round to, None (default) for full precision
+    :param quote: quote character of the keys
+    :return: string like {"rings":[[[x,y],...]]}
+    """
+    buf = io.StringIO()
+    buf.write("{%srings%s:" % (quote, quote))
+    write_rings(buf, rings, precision)
+    buf.write("}")
+    return buf.getvalue()
+
+
+def geojson(geom, precision=None, quote='"'):
+    """
+    GeoJSON geometry of a shapely Point, LineString, Polygon or MultiPolygon.
+    :param geom: shapely geometry
+    :param precision: number of decimals to round to, None (default) for full precision
+    :param quote: quote character of the keys and type names, "'" for the form stored in the database
+    :return: geojson string
+    """
+    geomType = geom.geom_type
+    buf = io.StringIO()
+    buf.write("{{{0}type{0}:{0}{1}{0},{0}coordinates{0}:".format(quote, geomType))
+    if geomType == "Point":
+        coords = _finite(np.asarray(geom.coords, dtype="float64").reshape(-1, 2))
+        buf.write(_pair_format(precision) % tuple(coords[0, :2].tolist()) if len(coords) else "[]")
+    elif geomType == "LineString":
+        write_coords(buf, geom.coords, precision)
+    elif geomType == "Polygon":
+        write_rings(buf, polygon_rings(geom), precision)
+    elif geomType == "MultiPolygon":
+        buf.write("[")
+        for k, polygon in enumerate(geom.geoms):
+            if k:
+                buf.write(",")
+            write_rings(buf, polygon_rings(polygon), precision)
+        buf.write("]")
+    else:
+        raise ValueError("unsupported geometry type " + geomType)
+    buf.write("}")
+    return buf.getvalue()
+
+
+def _json_default(value):
+    # numpy scalars in feature attributes.
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def feature_json(feature):
+    """
+    One feature of the ArcGIS addFeatures rest api.
+    :param feature: {"attributes": dict, "geometry": dict or Esri JSON string}.
+        Geometry strings (see esri_polygon and esri_rings) are written as they are.
+    :return: json string
+    """
+    buf = io.StringIO()
+    buf.write('{"attributes":')
+    buf.write(json.dumps(feature["attributes"], default=_json_default))
+    geometry = feature.get("geometry")
+    if geometry is not None:
+        buf.write(',"geometry":')
+        buf.write(geometry if isinstance(geometry, str) else json.dumps(geometry, default=_json_default))
+    buf.write("}")
+    return buf.getvalue()
+
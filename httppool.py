@@ -0,0 +1,178 @@
+"""
+Pooled keep-alive HTTP connections for the ArcGIS rest api.
+
+urllib.request.urlopen opens a new TCP (and TLS) connection for every call.
+Here finished connections are kept idle per (scheme, host, port) and reused
+by the next request to the same host, from any thread. A connection is only
+used by one request at a time. Responses are requested gzip compressed and
+decoded here.
+
+Errors are raised like urlopen raises them, urllib.error.HTTPError for error
+status codes and urllib.error.URLError for connection failures, so callers
+catch the same exceptions as before. A failure after the whole request was
+sent is raised as ResponseLost, a URLError, since the server may have
+processed the request. When a proxy is configured for the scheme (e.g.
+https_proxy) requests go through urlopen, which handles it.
+"""
+import atexit
+import gzip
+import http.client
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+# seconds to wait for a connection or a response, per request unless given.
+TIMEOUT = 60
+# idle connections kept per host, more are closed when released.
+MAX_IDLE = 8
+# ssl.SSLContext of https connections, None for the default (certificates verified).
+SSL_CONTEXT = None
+
+_lock = threading.Lock()
+# {(scheme, host, port): [idle connections]}
+_idle = {}
+# errors of a kept connection the server closed in the meantime, the request is sent again on a new connection.
+_STALE = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+class ResponseLost(urllib.error.URLError):
+    """
+    The request was sent but no complete response came back (timeout, connection reset). The server may
+    have processed it, a request that is not idempotent should not be sent again blindly.
+    """
+
+
+def _key(parts):
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+
+def _open(key, timeout):
+    scheme, host, port = key
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=timeout, context=SSL_CONTEXT)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+def _acquire(key, timeout):
+    # an idle connection of the host, or a new one. The second value tells whether it was reused.
+    with _lock:
+        idle = _idle.get(key)
+        connection = idle.pop() if idle else None
+    if connection is None:
+        return _open(key, timeout), False
+    connection.timeout = timeout
+    if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+    return connection, True
+
+
+def _release(key, connection):
+    with _lock:
+        idle = _idle.setdefault(key, [])
+        if len(idle) < MAX_IDLE:
+            idle.append(connection)
+            return
+    connection.close()
+
+
+def _decode(body, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        return zlib.decompress(body)
+    return body
+
+
+def _urlopen(method, url, data, headers, timeout):
+    request = urllib.request.Request(url, data, headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return _decode(response.read(), response.headers.get("Content-Encoding"))
+    except urllib.error.URLError:
+        raise
+    except (OSError, http.client.HTTPException) as error:
+        # urlopen wraps the errors of sending in URLError, errors reading the response come as they are.
+        raise ResponseLost(error)
+
+
+def request(method, url, data=None, headers=None, timeout=None):
+    """
+    Send a request on a pooled connection.
+    :param method: "GET" or "POST"
+    :param url: http or https url, with its query string
+    :param data: request body bytes
+    :param headers: extra request headers
+    :param timeout: seconds, None for TIMEOUT
+    :return: decoded response body bytes
+    """
+    timeout = TIMEOUT if timeout is None else timeout
+    headers = dict({"Accept-Encoding": "gzip"}, **(headers or {}))
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise urllib.error.URLError("unsupported url scheme " + parts.scheme)
+    if parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname):
+        return _urlopen(method, url, data, headers, timeout)
+    key = _key(parts)
+    path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+    while True:
+        connection, reused = _acquire(key, timeout)
+        sent = False
+        try:
+            connection.request(method, path, data, headers)
+            sent = True
+            response = connection.getresponse()
+            body = response.read()
+        except _STALE as error:
+            connection.close()
+            if reused:
+                continue
+            raise (ResponseLost if sent else urllib.error.URLError)(error)
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            raise (ResponseLost if sent else urllib.error.URLError)(error)
+        break
+    if response.will_close:
+        connection.close()
+    else:
+        _release(key, connection)
+    if response.status >= 400:
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+    return _decode(body, response.getheader("Content-Encoding"))
+
+
+def post_form(url, params, timeout=None):
+    """
+    POST urlencoded parameters.
+    :param url: endpoint url
+    :param params: dict of parameters
+    :param timeout: seconds, None for TIMEOUT
+    :return: decoded response body bytes
+    """
+    data = urllib.parse.urlencode(params).encode("utf-8")
+    return request("POST", url, data, {"Content-Type": "application/x-www-form-urlencoded"}, timeout)
+
+
+def close_all():
+    """
+    Close every idle connection.
+    """
+    with _lock:
+        closing = [connection for idle in _idle.values() for connection in idle]
+        _idle.clear()
+    for connection in closing:
+        connection.close()
+
+
+def _forget():
+    # a forked child (the /append upload processes) must not share the sockets of its parent.
+    global _lock
+    _lock = threading.Lock()
+    _idle.clear()
+
+
+atexit.register(close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget)
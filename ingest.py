@@ -0,0 +1,38 @@
+"""
+Parallel ingestion of a folder of flight log csvs.
+
+Every csv is read, cleaned and projected to UTM (see dfcache) in a worker
+process. Workers send back the cleaned dataframe, which only holds numeric
+and string columns, and the parent gets them in the order of the input
+names whatever order the workers finish in.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import dfcache
+
+# default number of worker processes, None means one per cpu.
+WORKERS = int(os.environ["UPLOADER_WORKERS"]) if os.environ.get("UPLOADER_WORKERS") else None
+
+
+def _ingest_one(args):
+    path, name, taskType = args
+    if taskType == "Inficon":
+        return dfcache.load_inficon(path, name)
+    return dfcache.load_sniffer(path, name)
+
+
+def ingest_csvs(folder, names, taskType, workers=WORKERS):
+    """
+    Clean and project csvs over a process pool.
+    :param folder: folder of the csvs
+    :param names: list of csv file names, used as Source_Name
+    :param taskType: "Inficon", anything else is treated as SnifferDrone
+    :param workers: number of worker processes, None for one per cpu. 1 runs in this process.
+    :return: list of cleaned dataframes in the order of names, None for a csv of the wrong type
+    """
+    jobs = [(os.path.join(folder, name), name, taskType) for name in names]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [_ingest_one(i) for i in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_ingest_one, jobs))
@@ -0,0 +1,206 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from shapely import wkb
+from shapely.geometry import LineString
+import app
+import dbpool
+import dbschema
+import geometry_tools as gt
+
+
+def _points(unit):
+    dates = pd.to_datetime(["2022-07-18 16:17:55", "2022-07-18 16:17:56", None, "2022-07-18 16:18:01"]).as_unit(unit)
+    return pd.DataFrame({"Microsec": [1091000000.0, np.nan, 1093000000.0, 1094000000.0], "Flight_Date": dates,
+                         "SenseLong": [-83.5561205, -83.5561205, -83.5561211, -83.5561266],
+                         "SenseLat": [42.4065151, 42.4065148, 42.4065138, 42.4065128], "CH4": [0, 12, 3, 250],
+                         "Peak": [0, 0, 0, 1], "Source_Name": "92003059_20220718_1617_IRW0080.csv",
+                         "Utmlong": [289654.45, 289654.45, 289654.39, 289653.94],
+                         "Utmlat": [4698078.09, 4698078.05, 4698077.94, 4698077.84]})
+
+
+def _rows(insert, df):
+    connection = sqlite3.connect(":memory:")
+    dbschema.migrate(connection)
+    insert(connection, df)
+    columns = ", ".join(f'"{i}"' for i in app.pointsColumns)
+    return connection.execute(f'SELECT {columns} FROM "PointsTable"').fetchall()
+
+
+@pytest.mark.parametrize("unit", ["s", "us", "ns"])
+def test_insert_points_matches_to_sql(unit):
+    df = _points(unit)
+    expected = _rows(lambda c, d: d[app.pointsColumns].to_sql(name="PointsTable", con=c, if_exists="append", index=False), df)
+    assert _rows(lambda c, d: app.insertPointsIntoDB(c.cursor(), d), df) == expected
+    assert expected[0][1] == "2022-07-18 16:17:55"
+
+
+def test_sql_values_keeps_fractions():
+    dates = pd.Series(pd.to_datetime(["2022-07-18 16:17:55.25", None]))
+    assert app.sqlValues(dates) == ["2022-07-18 16:17:55.250000", None]
+
+
+def test_uploaded_layers_carries_on_after_a_failed_url(monkeypatch):
+    def existing(token, url, names):
+        if url == "points":
+            raise RuntimeError("query on points failed")
+        return {"a.csv"}
+
+    monkeypatch.setattr(app.arcgis, "existing_source_names", existing)
+    layers = {"a.csv-buffer": "buffers", "b.csv-buffer": "buffers", "a.csv-path": "points", "b.csv-path": "points"}
+    assert app.uploadedLayers("t", layers) == ({"a.csv-buffer"}, {"a.csv-path", "b.csv-path"})
+
+    returnJson = {"bufferFail": [], "peaksFail": [], "pointsFail": ["c.csv-path"]}
+    app.reportUnchecked(returnJson, {"b.csv-path", "a.csv-path", "a.csv-peaks"})
+    assert returnJson == {"bufferFail": [], "peaksFail": ["a.csv-peaks"], "pointsFail": ["c.csv-path", "a.csv-path", "b.csv-path"]}
+
+
+def _track(n=3000, seed=4):
+    # a wavy flight line of about 3 km with a little noise.
+    t = np.linspace(0, 3000, n)
+    noise = np.random.default_rng(seed).normal(0, 0.2, (n, 2))
+    return np.column_stack([t, 200 * np.sin(t / 150)]) + noise + [289654.0, 4698078.0]
+
+
+def test_insert_geometry_stores_the_levels():
+    connection = sqlite3.connect(":memory:")
+    dbschema.migrate(connection)
+    cursor = connection.cursor()
+    sr = 32617
+    buff = LineString(_track()).buffer(15, quad_segs=6)
+    path = LineString(_track(seed=5))
+    app.insertGeometryIntoDB(cursor, "BuffersTable", "a.csv-buffer", buff, sr)
+    app.insertGeometryIntoDB(cursor, "LinesTable", "a.csv-path", path, sr)
+    app.insertGeometryIntoDB(cursor, "PeaksTable", "a.csv-peaks", buff, sr)
+    for table, name, geom in [("BuffersTable", "a.csv-buffer", buff), ("LinesTable", "a.csv-path", path)]:
+        full, minLat, maxLat = cursor.execute(f'SELECT Geometry, Min_lat, Max_lat FROM {table} WHERE Source_name == ?',
+                                              [name]).fetchone()
+        expected = gt.lod_levels(geom, (minLat + maxLat) / 2, dbschema.LOD_ZOOMS)
+        stored = cursor.execute("SELECT Zoom, Geometry FROM LevelsTable WHERE Source_name == ? ORDER BY Zoom", [name]).fetchall()
+        assert len(stored) > 1
+        assert [zoom for zoom, _ in stored] == [zoom for zoom, _ in expected]
+        for (zoom, blob), (_, simple) in zip(stored, expected):
+            assert wkb.loads(blob).equals_exact(simple, 0)
+        # a zoom between two levels gets the finer one, a zoom above every level the full geometry.
+        assert app.loadLayerGeometry(cursor, name, full, stored[0][0] + 0.5).equals_exact(wkb.loads(stored[1][1]), 0)
+        assert app.loadLayerGeometry(cursor, name, full, 0).equals_exact(wkb.loads(stored[0][1]), 0)
+        assert app.loadLayerGeometry(cursor, name, full, stored[-1][0] + 1).equals_exact(geom, 0)
+        assert app.loadLayerGeometry(cursor, name, full, None).equals_exact(geom, 0)
+    # peaks have no simplified copies.
+    assert cursor.execute("SELECT COUNT(*) FROM LevelsTable WHERE Source_name == 'a.csv-peaks'").fetchone() == (0,)
+
+
+def _flight(name, long, lat, ch4, date):
+    n = len(ch4)
+    df = pd.DataFrame({"Microsec": np.arange(n) * 1e6, "Flight_Date": pd.date_range(date, periods=n, freq="s"),
+                       "SenseLong": long + np.arange(n) * 1e-4, "SenseLat": lat + np.arange(n) * 5e-5,
+                       "CH4": ch4, "Peak": [int(i >= 100) for i in ch4], "Source_Name": name + "-path"})
+    sr = gt.project_df(df)
+    return df, sr
+
+
+@pytest.fixture
+def flights(tmp_path):
+    path = str(tmp_path / "query.db")
+    connection = dbpool.get_connection(path)
+    dbschema.migrate(connection)
+    cursor = connection.cursor()
+    # a.csv has a plume, b.csv is a low reading flight a few km away two weeks later.
+    for name, long, lat, ch4, date in [("a.csv", -83.556, 42.4065, [2, 5, 150, 250, 7], "2022-07-18 16:17:55"),
+                                       ("b.csv", -83.500, 42.4500, [3, 4, 6, 20], "2022-08-01 09:00:00")]:
+        df, sr = _flight(name, long, lat, ch4, date)
+        app.insertPointsIntoDB(cursor, df)
+        track = LineString(df[["Utmlong", "Utmlat"]].to_numpy())
+        app.insertGeometryIntoDB(cursor, "BuffersTable", name + "-buffer", track.buffer(15, quad_segs=6), sr)
+        app.insertGeometryIntoDB(cursor, "LinesTable", name + "-path", track, sr)
+    connection.commit()
+    yield path
+    dbpool.close_all()
+
+
+def test_catalog_has_no_geometry(flights):
+    catalog = app.connectAndUpload(flights, app.sqliteTableList)
+    assert sorted(catalog) == ["BuffersTable", "LinesTable"]
+    assert list(catalog["LinesTable"]) == ["a.csv-path", "b.csv-path"]
+    path = catalog["LinesTable"]["a.csv-path"]
+    assert (path["parts"], path["points"]) == (1, 5)
+    # the bounding box is in wgs84, around the points of the flight.
+    assert path["bbox"] == pytest.approx([-83.556, 42.4065, -83.556 + 4e-4, 42.4065 + 2e-4], abs=1e-7)
+    buffer = catalog["BuffersTable"]["a.csv-buffer"]
+    assert buffer["parts"] == 1 and "points" not in buffer
+    assert buffer["bbox"][0] < path["bbox"][0] and buffer["bbox"][3] > path["bbox"][3]
+    stored = dbpool.get_connection(flights).execute("SELECT length(Geometry) FROM BuffersTable WHERE Source_name == 'a.csv-buffer'").fetchone()
+    assert buffer["size"] == stored[0]
+
+
+def test_layers_route_pages(flights, monkeypatch):
+    monkeypatch.setattr(app, "localPath", flights, raising=False)
+    client = app.app.test_client()
+    first = client.post("/layers", json={"pageSize": 3}).get_json()
+    second = client.post("/layers", json={"page": 1, "pageSize": 3}).get_json()
+    assert (first["page"], first["nextPage"], first["total"]) == (0, 1, 4)
+    assert (second["page"], second["nextPage"], second["total"]) == (1, None, 4)
+    # every layer comes once, buffers first as in the catalog.
+    assert sorted(first["BuffersTable"]) == ["a.csv-buffer", "b.csv-buffer"] and list(first["LinesTable"]) == ["a.csv-path"]
+    assert list(second["LinesTable"]) == ["b.csv-path"] and second["BuffersTable"] == {}
+    assert first["LinesTable"]["a.csv-path"].startswith("{'type':'LineString'")
+
+    selected = client.post("/layers", json={"layers": ["b.csv-path", "b.csv-unknown"]}).get_json()
+    assert (selected["LinesTable"].keys(), selected["BuffersTable"], selected["total"]) == ({"b.csv-path"}, {}, 1)
+
+
+def _layers(result):
+    return {table: sorted(result[table]) for table in app.layerTables.values()}
+
+
+A_BOX = [-83.557, 42.406, -83.555, 42.407]
+BOTH_BOX = [-83.6, 42.3, -83.4, 42.5]
+
+
+def test_query_bbox_goes_through_the_spatial_index(flights):
+    result = app.queryDB(flights, A_BOX)
+    points = result["PointsTable"]
+    assert set(points["Source_name"]) == {"a.csv-path"}
+    assert all(A_BOX[0] <= x <= A_BOX[2] and A_BOX[1] <= y <= A_BOX[3] for x, y in zip(points["Senselong"], points["Senselat"]))
+    assert not result["truncated"]
+    assert _layers(result) == {"BuffersTable": ["a.csv-buffer"], "LinesTable": ["a.csv-path"], "PeaksTable": []}
+    assert app.queryDB(flights, [0, 0, 1, 1])["PointsTable"]["CH4"] == []
+    # the query plan starts from the R*Tree rather than a table scan.
+    plan = dbpool.get_connection(flights).execute("EXPLAIN QUERY PLAN SELECT p.CH4 FROM PointsTree t JOIN PointsTable p ON p.rowid = t.id "
+                                                  "WHERE t.Min_long <= 0 AND t.Max_long >= 0 AND t.Min_lat <= 0 AND t.Max_lat >= 0").fetchall()
+    assert "VIRTUAL TABLE INDEX" in plan[0][-1]
+
+
+def test_query_filters_points_and_layers(flights):
+    result = app.queryDB(flights, BOTH_BOX, minCH4=100)
+    assert sorted(result["PointsTable"]["CH4"]) == [150, 250]
+    # layers are kept when their csv has a point passing the filters, see the EXISTS subquery.
+    assert _layers(result) == {"BuffersTable": ["a.csv-buffer"], "LinesTable": ["a.csv-path"], "PeaksTable": []}
+
+    start, end = app.toEpoch("2022-08-01 00:00:00"), app.toEpoch("2022-08-01 09:00:02")
+    result = app.queryDB(flights, BOTH_BOX, start=start, end=end)
+    assert sorted(result["PointsTable"]["CH4"]) == [3, 4, 6]
+    assert _layers(result) == {"BuffersTable": ["b.csv-buffer"], "LinesTable": ["b.csv-path"], "PeaksTable": []}
+
+    result = app.queryDB(flights, BOTH_BOX, minCH4=100, start=start)
+    assert result["PointsTable"]["CH4"] == []
+    assert _layers(result) == {"BuffersTable": [], "LinesTable": [], "PeaksTable": []}
+
+    result = app.queryDB(flights, BOTH_BOX)
+    assert len(result["PointsTable"]["CH4"]) == 9
+    assert _layers(result) == {"BuffersTable": ["a.csv-buffer", "b.csv-buffer"], "LinesTable": ["a.csv-path", "b.csv-path"],
+                               "PeaksTable": []}
+
+
+def test_query_route(flights, monkeypatch):
+    monkeypatch.setattr(app, "localPath", flights, raising=False)
+    client = app.app.test_client()
+    response = client.post("/query", json={"bbox": BOTH_BOX, "minCH4": 5, "start": "2022-07-18 16:17:56", "limit": 2})
+    assert response.status_code == 200
+    body = response.get_json()
+    # 5, 150 and 250 of a.csv, 6 and 20 of b.csv pass, the limit keeps two.
+    assert len(body["PointsTable"]["CH4"]) == 2 and set(body["PointsTable"]["CH4"]) <= {5, 150, 250, 6, 20}
+    assert body["truncated"]
+    assert sorted(body["LinesTable"]) == ["a.csv-path", "b.csv-path"]
+    assert body["LinesTable"]["a.csv-path"].startswith("{'type':'LineString'")
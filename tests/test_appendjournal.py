@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+import appendjournal
+import dbpool
+import dbschema
+
+URL = "https://example.com/arcgis/rest/services/Buffers/FeatureServer/0"
+
+
+@pytest.fixture
+def folder(tmp_path):
+    yield tmp_path
+    dbpool.close_all()
+
+
+def _tables(path):
+    connection = sqlite3.connect(path)
+    try:
+        names = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+        return names, dbschema.schema_version(connection)
+    finally:
+        connection.close()
+
+
+def test_standalone_journal_has_only_the_journal_table(folder):
+    path = str(folder / "meta_journal.db")
+    appendjournal.AppendJournal(path, project=False)
+    # opening it again is a no-op.
+    appendjournal.AppendJournal(path, project=False)
+    names, version = _tables(path)
+    assert names == {dbschema.JOURNAL_TABLE, f"idx_{dbschema.JOURNAL_TABLE}_target_state"}
+    assert version == 0
+
+
+def test_project_journal_migrates_the_database(folder):
+    path = str(folder / "project.db")
+    appendjournal.AppendJournal(path)
+    names, version = _tables(path)
+    assert {dbschema.POINTS_TABLE, dbschema.JOURNAL_TABLE} <= names
+    assert version == dbschema.SCHEMA_VERSION
+
+
+@pytest.mark.parametrize("project", [True, False])
+def test_chunks_round_trip(folder, project):
+    journal = appendjournal.AppendJournal(str(folder / "journal.db"), project=project)
+    first, second = journal.add(URL, [(["a.csv", "a.csv", "b.csv"], "[1,2,3]"), (["c.csv"], "[4]")])
+    journal.sent(first)
+    journal.acknowledge(first, [True, True, False])
+    journal.record_error(second, "timed out")
+    assert journal.unfinished(URL) == [(second, ["c.csv"], "[4]")]
+    assert journal.unfinished_names(URL) == {"c.csv"}
+    assert journal.unfinished(URL + "/other") == []
+
+
+def test_interrupted_chunks_become_uncertain(folder):
+    journal = appendjournal.AppendJournal(str(folder / "journal.db"), project=False)
+    first, second, third = journal.add(URL, [(["a.csv"], "[1]"), (["b.csv", "b.csv"], "[2,3]"), (["c.csv"], "[4]")])
+    journal.sent(first)
+    journal.sent(second)
+    journal.uncertain(first, "timed out")
+    assert journal.interrupted(URL) == [(second, ["b.csv", "b.csv"])]
+    assert journal.interrupted(URL) == []
+    assert journal.unfinished(URL) == [(third, ["c.csv"], "[4]")]
@@ -0,0 +1,168 @@
+import json
+import re
+import urllib.error
+import pytest
+import appendjournal
+import arcgis
+import dbpool
+import httppool
+
+URL = "https://services.arcgis.com/x/arcgis/rest/services/Buffers/FeatureServer/0"
+
+
+class FakeService:
+    # stands in for httppool.post_form, answers existence queries from a set of uploaded names.
+    def __init__(self, uploaded=(), fail=()):
+        self.uploaded = set(uploaded)
+        self.fail = set(fail)
+        self.queries = []
+
+    def __call__(self, url, params, timeout=None):
+        assert params["f"] == "json"
+        if url.rsplit("/", 1)[0] in self.fail:
+            return json.dumps({"error": {"code": 400, "message": "Unable to complete operation."}}).encode()
+        where = params["where"]
+        self.queries.append(where)
+        names = [i.replace("''", "'") for i in re.findall(r"'((?:[^']|'')*)'", where)]
+        # distinct values only, under the field name in the case the service uses.
+        features = [{"attributes": {"SOURCE_NAME": i}} for i in names if i in self.uploaded]
+        return json.dumps({"fields": [{"name": "SOURCE_NAME"}], "features": features}).encode()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fake = FakeService(uploaded={"flight007.csv", "flight150.csv", "it's.csv"})
+    monkeypatch.setattr(httppool, "post_form", fake)
+    return fake
+
+
+def test_existence_queries_are_batched(service):
+    names = ["flight%03d.csv" % k for k in range(250)]
+    assert arcgis.existing_source_names("t", URL, names + names[:10]) == {"flight007.csv", "flight150.csv"}
+    assert len(service.queries) == 3
+    for where in service.queries:
+        assert where.startswith("Source_Name IN (")
+        assert where.count(",") < arcgis.MAX_NAMES_PER_QUERY
+        assert len(where) < arcgis.MAX_WHERE_LENGTH + 30
+
+
+def test_long_names_split_on_where_length(service):
+    names = ["%s_%03d.csv" % ("x" * 200, k) for k in range(30)]
+    arcgis.existing_source_names("t", URL, names)
+    assert len(service.queries) > 1
+    # every IN list stays under MAX_WHERE_LENGTH and every name is queried once.
+    lists = [where[len("Source_Name IN ("):-1] for where in service.queries]
+    assert all(len(i) <= arcgis.MAX_WHERE_LENGTH for i in lists)
+    assert sum(i.count(".csv") for i in lists) == len(names)
+
+
+def test_quotes_and_case_of_results(service):
+    assert arcgis.existing_source_names("t", URL, ["it's.csv", "other.csv"]) == {"it's.csv"}
+    assert "'it''s.csv'" in service.queries[0]
+
+
+def test_only_requested_names_are_returned(monkeypatch):
+    # services matching case-insensitively may return names that differ from the requested ones.
+    monkeypatch.setattr(httppool, "post_form", lambda url, params, timeout=None: json.dumps(
+        {"features": [{"attributes": {"Source_Name": "FLIGHT1.CSV"}}, {"attributes": {"Source_Name": "flight2.csv"}}]}).encode())
+    assert arcgis.existing_source_names("t", URL, ["flight1.csv", "flight2.csv"]) == {"flight2.csv"}
+
+
+def test_error_response_raises(monkeypatch):
+    monkeypatch.setattr(httppool, "post_form", FakeService(fail={URL}))
+    with pytest.raises(RuntimeError, match="query on"):
+        arcgis.existing_source_names("t", URL, ["flight1.csv"])
+
+
+def _feature(name, size=10):
+    return {"attributes": {"Source_Name": name, "CH4": 1.5}, "geometry": {"x": 1.0, "y": 2.0, "pad": "x" * size}}
+
+
+def test_feature_chunks_respect_both_limits():
+    features = [_feature("a.csv")] * 5 + [_feature("b.csv", 300)] * 3 + [_feature("c.csv", 5000)]
+    chunks = list(arcgis._feature_chunks(features, 4, 1000, "Source_Name"))
+    assert [names for names, _ in chunks] == [["a.csv"] * 4, ["a.csv", "b.csv", "b.csv"], ["b.csv"], ["c.csv"]]
+    # a feature over the character limit goes alone, every other chunk stays under it.
+    assert all(len(text) <= 1000 for _, text in chunks[:-1])
+    assert [i for _, text in chunks for i in json.loads(text)] == json.loads(json.dumps(features))
+
+
+def test_source_summary():
+    names = ["a.csv", "a.csv", "b.csv", "c.csv", "b.csv"]
+    assert arcgis.source_summary(names, [True, True, True, False, False]) == (["a.csv"], ["b.csv", "c.csv"])
+    assert arcgis.source_summary([], []) == ([], [])
+
+
+class FakeAddFeatures:
+    # stands in for post_with_token, answers each addFeatures request with the next planned outcome.
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    def __call__(self, url, params, token):
+        if not url.endswith("/addFeatures"):
+            return {"maxRecordCount": 2}
+        features = json.loads(params["features"])
+        self.sent.append([i["attributes"]["Source_Name"] for i in features])
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome == "ok":
+            return {"addResults": [{"success": True} for _ in features]}
+        return {"error": outcome}
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(arcgis, "RETRY_BACKOFF", 0)
+    yield appendjournal.AppendJournal(str(tmp_path / "journal.db"), project=False)
+    dbpool.close_all()
+
+
+def _upload(monkeypatch, journal, fake, features):
+    monkeypatch.setattr(arcgis, "post_with_token", fake)
+    return arcgis.add_features("t", URL, features, workers=1, journal=journal)
+
+
+def test_unprocessed_errors_are_retried(monkeypatch, journal):
+    fake = FakeAddFeatures(urllib.error.HTTPError(URL, 503, "busy", {}, None), urllib.error.URLError("refused"),
+                           {"code": 504, "message": "timeout"})
+    names, results, errors = _upload(monkeypatch, journal, fake, [_feature("a.csv"), _feature("b.csv")])
+    assert (names, results, errors) == (["a.csv", "b.csv"], [True, True], [])
+    assert len(fake.sent) == 4
+    assert journal.unfinished(URL) == []
+
+
+def test_possibly_applied_chunks_are_not_resent(monkeypatch, journal):
+    for failure in (httppool.ResponseLost(TimeoutError("timed out")), urllib.error.HTTPError(URL, 502, "bad gateway", {}, None)):
+        fake = FakeAddFeatures(failure)
+        names, results, errors = _upload(monkeypatch, journal, fake, [_feature("a.csv"), _feature("a.csv"), _feature("b.csv")])
+        # the first chunk is sent once, the second still goes through.
+        assert fake.sent == [["a.csv", "a.csv"], ["b.csv"]]
+        assert (names, results, len(errors)) == (["a.csv", "a.csv", "b.csv"], [False, False, True], 1)
+        assert journal.unfinished(URL) == []
+        # the next upload does not send it either.
+        assert _upload(monkeypatch, journal, FakeAddFeatures(), []) == ([], [], [])
+
+
+def test_rejected_chunk_is_not_retried(monkeypatch, journal):
+    fake = FakeAddFeatures({"code": 400, "message": "Unable to complete operation."})
+    names, results, errors = _upload(monkeypatch, journal, fake, [_feature("a.csv")])
+    assert (fake.sent, results, errors) == ([["a.csv"]], [False], [{"code": 400, "message": "Unable to complete operation."}])
+
+
+def test_resume_sends_pending_but_not_interrupted_chunks(monkeypatch, journal):
+    sentId, pendingId = journal.add(URL, [(["a.csv"], json.dumps([_feature("a.csv")])), (["b.csv"], json.dumps([_feature("b.csv")]))])
+    journal.sent(sentId)
+    fake = FakeAddFeatures()
+    names, results, errors = _upload(monkeypatch, journal, fake, [_feature("c.csv")])
+    assert fake.sent == [["b.csv"], ["c.csv"]]
+    assert (names, results, errors) == (["a.csv", "b.csv", "c.csv"], [False, True, True], [arcgis.INTERRUPTED_ERROR])
+    assert journal.unfinished(URL) == []
+
+
+def test_transient_failures_left_unfinished_after_retries(monkeypatch, journal):
+    fake = FakeAddFeatures(*[urllib.error.URLError("refused")] * (arcgis.RETRIES + 1))
+    names, results, errors = _upload(monkeypatch, journal, fake, [_feature("a.csv")])
+    assert len(fake.sent) == arcgis.RETRIES + 1 and results == [False]
+    assert [names for _, names, _ in journal.unfinished(URL)] == [["a.csv"]]
@@ -0,0 +1,132 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import csvprocessing as cp
+
+
+# clean_flight_log and cleanInficon as they were before the vectorized cleaners, the reference output.
+# Only transform(max) is written transform("max"), newer pandas warns on the builtin.
+def legacy_clean_flight_log(source_file_name, flight_log):
+    flight_log = flight_log[flight_log["SenseLong"] != 0.0]
+    flight_log = flight_log[flight_log["SenseLat"] != 0.0]
+    flight_log = flight_log[pd.to_numeric(flight_log['SenseLong'], errors='coerce').notnull()]
+    flight_log = flight_log[pd.to_numeric(flight_log['SenseLat'], errors='coerce').notnull()]
+    ch4_maxes = flight_log.groupby(["SenseLong", "SenseLat"]).CH4.transform("max")
+    flight_log = flight_log.loc[flight_log.CH4 == ch4_maxes]
+    flight_log = flight_log.drop_duplicates(subset = ['SenseLong', 'SenseLat'], keep = 'first')
+
+    flight_log["Source_Name"] = source_file_name
+    flight_log["CH4"] = round(flight_log["CH4"]).astype(int)
+
+    time_ns = flight_log["Timestamp(ms)"] * 1000000
+    time_convert = pd.to_datetime(time_ns, yearfirst=True, unit="ns")
+    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S")
+    re_convert = pd.to_datetime(time_col)
+    flight_log["Flight_Date"] = re_convert
+
+    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S.%f")
+    time_col = pd.to_datetime(time_col).dt.time
+    flight_log["time"] = time_col
+    flight_log["Microsec"] = flight_log.apply(lambda r: cp.time_to_microsecond(r["time"]), axis=1)
+
+    flight_log["SenseLong"] = flight_log["SenseLong"].astype("float")
+    flight_log["SenseLat"] = flight_log["SenseLat"].astype("float")
+
+    flight_log = flight_log.reset_index()[["Microsec", "Flight_Date", "SenseLong", "SenseLat", "CH4", "Source_Name"]]
+    return flight_log
+
+
+def legacy_cleanInficon(source_file_name, flight_log):
+    flight_log = flight_log[flight_log["Long"] != 0.0]
+    flight_log = flight_log[flight_log["Lat"] != 0.0]
+    flight_log = flight_log[pd.to_numeric(flight_log['Long'], errors='coerce').notnull()]
+    flight_log = flight_log[pd.to_numeric(flight_log['Lat'], errors='coerce').notnull()]
+
+    ch4_maxes = flight_log.groupby(["Long", "Lat"]).CH4.transform("max")
+    flight_log = flight_log.loc[flight_log.CH4 == ch4_maxes]
+    flight_log = flight_log.drop_duplicates(subset = ['Long', 'Lat'], keep = 'first')
+
+    flight_log["Source_Name"] = source_file_name
+    flight_log["CH4"] = round(flight_log["CH4"]).astype(int)
+    flight_log["Flight_Date"] = flight_log["Date"] + " " + flight_log["Time"]
+    time_convert = pd.to_datetime(flight_log["Flight_Date"])
+    time_col = time_convert.dt.strftime("%Y-%m-%d, %H:%M:%S.%f")
+    time_col = pd.to_datetime(time_col).dt.time
+    flight_log["time"] = time_col
+    flight_log["Microsec"] = flight_log.apply(lambda r: cp.time_to_microsecond(r["time"]), axis=1)
+    flight_log["Peak"] = 0
+
+    flight_log.rename(columns={"Long": "SenseLong", "Lat": "SenseLat"}, inplace=True)
+    flight_log["SenseLong"] = flight_log["SenseLong"].astype("float")
+    flight_log["SenseLat"] = flight_log["SenseLat"].astype("float")
+
+    flight_log = flight_log.reset_index()[["Microsec", "Flight_Date", "SenseLong", "SenseLat", "CH4", "Peak", "Source_Name"]]
+    return flight_log
+
+
+def _sniffer(n=400, seed=0):
+    r = np.random.default_rng(seed)
+    lon = np.round(-83.5561 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    lat = np.round(42.4065 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    # duplicated coordinate pairs, with higher, lower and equal ch4.
+    dups = r.integers(0, n, n // 4)
+    lon[dups[:-1]] = lon[dups[1:]]
+    lat[dups[:-1]] = lat[dups[1:]]
+    ch4 = np.abs(r.normal(50, 80, n)).round(1)
+    ch4[dups[:10]] = ch4[dups[1:11]]
+    # zero and missing coordinates.
+    lon[r.integers(0, n, 8)] = 0.0
+    lat[r.integers(0, n, 8)] = 0.0
+    lon[r.integers(0, n, 5)] = np.nan
+    lat[r.integers(0, n, 5)] = np.nan
+    timestamps = 1658161075000 + np.cumsum(r.integers(0, 400, n))
+    return pd.DataFrame({"Timestamp(ms)": timestamps, "SenseLong": lon, "SenseLat": lat, "CH4": ch4, "Alt": 15.0})
+
+
+def _inficon(n=400, seed=1):
+    sniffer = _sniffer(n, seed)
+    times = pd.to_datetime(sniffer["Timestamp(ms)"], unit="ms")
+    return pd.DataFrame({"Date": times.dt.strftime("%m/%d/%Y"), "Time": times.dt.strftime("%H:%M:%S.%f").str[:-3],
+                         "Long": sniffer["SenseLong"], "Lat": sniffer["SenseLat"], "CH4": sniffer["CH4"], "Other": 1})
+
+
+def _chunks(df, chunksize):
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)), chunksize=chunksize)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_clean_flight_log_matches_legacy(seed):
+    df = _sniffer(seed=seed)
+    expected = legacy_clean_flight_log("x.csv", df.copy())
+    pd.testing.assert_frame_equal(cp.clean_flight_log("x.csv", df.copy()), expected, check_dtype=False)
+    for chunksize in (37, 100, 1000):
+        pd.testing.assert_frame_equal(cp.clean_flight_log_chunks("x.csv", _chunks(df, chunksize)), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_cleanInficon_matches_legacy(seed):
+    df = _inficon(seed=seed)
+    expected = legacy_cleanInficon("y.csv", df.copy())
+    pd.testing.assert_frame_equal(cp.cleanInficon("y.csv", df.copy()), expected, check_dtype=False)
+    for chunksize in (37, 100, 1000):
+        pd.testing.assert_frame_equal(cp.cleanInficonChunks("y.csv", _chunks(df, chunksize)), expected, check_dtype=False)
+
+
+def test_fixture_covers_invalid_rows():
+    df = _sniffer()
+    cleaned = cp.clean_flight_log("x.csv", df.copy())
+    assert df["SenseLong"].isna().any() and (df["SenseLat"] == 0).any()
+    assert df.duplicated(["SenseLong", "SenseLat"]).any()
+    assert len(cleaned) < len(df)
+    assert not cleaned.duplicated(["SenseLong", "SenseLat"]).any()
+    assert cleaned[["SenseLong", "SenseLat"]].notna().all().all()
+
+
+def test_microsec_and_flight_date():
+    df = pd.DataFrame({"Timestamp(ms)": [1658161075123, 1658161076999], "SenseLong": [-83.5, -83.6],
+                       "SenseLat": [42.4, 42.5], "CH4": [1.4, 2.6]})
+    cleaned = cp.clean_flight_log("x.csv", df)
+    assert cleaned["Microsec"].tolist() == [16 * 1e+6 + 17 * 6e+7 + 55 * 1e+6 + 123000, 16 * 1e+6 + 17 * 6e+7 + 56 * 1e+6 + 999000]
+    assert cleaned["Flight_Date"].tolist() == [pd.Timestamp("2022-07-18 16:17:55"), pd.Timestamp("2022-07-18 16:17:56")]
+    assert cleaned["CH4"].tolist() == [1, 3]
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import csvprocessing as cp
+import csvreader
+
+
+def _dirty_sniffer(path, n=3000, seed=0):
+    # coordinates with text values in one stretch of rows, zeros and duplicated pairs across the file,
+    # so a chunked read without a schema gives text columns in some chunks and float columns in others.
+    r = np.random.default_rng(seed)
+    lon = np.round(-83.5561 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    lat = np.round(42.4065 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7)
+    dups = r.integers(0, n, n // 5)
+    lon[dups[:-1]] = lon[dups[1:]]
+    lat[dups[:-1]] = lat[dups[1:]]
+    df = pd.DataFrame({"Timestamp(ms)": 1658161075000 + np.arange(n) * 250,
+                       "SenseLong": lon.astype(object), "SenseLat": lat.astype(object),
+                       "CH4": np.abs(r.normal(50, 80, n)).round(1), "Alt": 15.0})
+    df.loc[r.integers(0, n, 20), "SenseLong"] = 0.0
+    df.loc[r.integers(1200, 1800, 10), "SenseLong"] = "gps lost"
+    df.loc[r.integers(1200, 1800, 10), "SenseLat"] = "0"
+    df.loc[[1500, 2500], "SenseLong"] = 0
+    df.to_csv(path, index=False)
+
+
+@pytest.fixture
+def dirty_sniffer(tmp_path):
+    path = tmp_path / "dirty.csv"
+    _dirty_sniffer(path)
+    return path
+
+
+def test_chunk_size_does_not_change_cleaned_output(dirty_sniffer, monkeypatch):
+    # stream with the c engine, like files above PYARROW_MAX_BYTES.
+    monkeypatch.setattr(csvreader, "PYARROW_ENGINE", False)
+    with pytest.raises(ValueError):
+        # text in the coordinate columns makes the strict read fail, csvreader then reads without a schema.
+        cp.clean_flight_log_chunks("x", csvreader.read_chunks(dirty_sniffer, csvreader.SNIFFER_SCHEMA))
+    outputs = [cp.clean_flight_log_chunks("x", csvreader.read_chunks(dirty_sniffer, csvreader.SNIFFER_SCHEMA,
+                                                                     strict=False, chunksize=chunksize))
+               for chunksize in (997, 1500, 2000, 50000)]
+    for output in outputs[1:]:
+        pd.testing.assert_frame_equal(outputs[0], output)
+    cleaned = outputs[0]
+    assert not (cleaned[["SenseLong", "SenseLat"]] == 0).any().any()
+    assert not cleaned.duplicated(["SenseLong", "SenseLat"]).any()
+
+
+def test_read_sniffer_matches_chunked_read(dirty_sniffer, monkeypatch):
+    oneShot = csvreader.read_sniffer(dirty_sniffer, "x")
+    monkeypatch.setattr(csvreader, "PYARROW_ENGINE", False)
+    monkeypatch.setattr(cp, "CHUNK_SIZE", 997)
+    chunked = cp.clean_flight_log_chunks("x", csvreader.read_chunks(dirty_sniffer, csvreader.SNIFFER_SCHEMA,
+                                                                    strict=False, chunksize=997))
+    pd.testing.assert_frame_equal(oneShot, chunked)
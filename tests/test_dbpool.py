@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+import pytest
+import dbpool
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "pool.db")
+    dbpool.close_all()
+
+
+def _in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_connection_reused_within_thread(path):
+    connection = dbpool.get_connection(path)
+    assert dbpool.get_connection(path) is connection
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = _in_thread(lambda: dbpool.get_connection(path))
+    assert other is not connection
+    # a second database gets its own connection on the same thread.
+    assert dbpool.get_connection(path + "2") is not connection
+
+
+def test_end_request_rolls_back_and_drops_dead_threads(path):
+    connection = dbpool.get_connection(path)
+    with connection:
+        connection.execute("CREATE TABLE t (v INTEGER)")
+    other = _in_thread(lambda: dbpool.get_connection(path))
+    connection.execute("INSERT INTO t VALUES (1)")
+    assert connection.in_transaction
+
+    dbpool.end_request()
+    assert not connection.in_transaction
+    assert connection.execute("SELECT count(*) FROM t").fetchone()[0] == 0
+    # the thread of the other connection has exited, it is closed and dropped from the pool.
+    with pytest.raises(sqlite3.ProgrammingError):
+        other.execute("SELECT 1")
+    assert other not in dbpool._connections.values()
+    # the connection of the calling thread stays pooled.
+    assert dbpool.get_connection(path) is connection
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_opens_its_own_connection(path):
+    parent = dbpool.get_connection(path)
+    with parent:
+        parent.execute("CREATE TABLE t (v INTEGER)")
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            child = dbpool.get_connection(path)
+            with child:
+                child.execute("INSERT INTO t VALUES (1)")
+            if child is not parent and parent in dbpool._inherited and parent not in dbpool._connections.values():
+                code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # the parent connection is untouched and sees the child's commit.
+    assert dbpool.get_connection(path) is parent
+    assert parent.execute("SELECT count(*) FROM t").fetchone()[0] == 1
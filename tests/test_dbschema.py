@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import numpy as np
+import pytest
+from shapely import wkb
+from shapely.geometry import LineString, MultiPoint, mapping, shape
+import dbschema
+import geometry_tools as gt
+
+# tables as app.py created them before the schema was versioned.
+BASELINE_POINTS = '''
+    CREATE TABLE IF NOT EXISTS PointsTable (
+    "Microsec" INTEGER,
+    "Flight_date" TEXT,
+    "Senselong" REAL NOT NULL,
+    "Senselat" REAL NOT NULL,
+    "CH4" INTEGER,
+    "Peak" INTEGER,
+    "Source_name" TEXT NOT NULL,
+    "Utmlong" REAL NOT NULL,
+    "Utmlat" REAL NOT NULL
+    )'''
+BASELINE_LAYER = '''
+    CREATE TABLE IF NOT EXISTS {tableName} (
+        "Geometry" TEXT,
+        "Source_name" TEXT,
+        "EsriGeometry" TEXT
+    )'''
+CSV = "92003059_20220718_1617_IRW0080.csv"
+
+
+def _track():
+    r = np.random.default_rng(4)
+    lon = -83.5561 + np.cumsum(r.normal(0, 2e-5, 60))
+    lat = 42.4065 + np.cumsum(r.normal(0, 2e-5, 60))
+    return lon, lat
+
+
+def _baseline_layers(lon, lat):
+    sr = gt.find_utm_zone(lat[0], lon[0])
+    x, y = gt.reproject_xy(lon, lat, sr)
+    buff = MultiPoint(np.column_stack([x, y])).buffer(15, quad_segs=6)
+    esri = json.dumps({"rings": [list(buff.exterior.coords)]}).replace('"', "'")
+    buffText = json.dumps(mapping(gt.reproject(buff, 4326, sr))).replace('"', "'")
+    # createPath saved str() of a dict of the rdp coordinate lists, numpy 2 writes np.float64(...) reprs.
+    path = {"type": "LineString", "coordinates": [[np.float64(i), np.float64(j)] for i, j in zip(lon[::6], lat[::6])]}
+    peaks = MultiPoint(np.column_stack([x, y])[:2]).buffer(5, quad_segs=6)
+    peaksText = json.dumps(mapping(gt.reproject(peaks, 4326, sr))).replace('"', "'")
+    return {"BuffersTable": (buffText, esri), "LinesTable": (str(path), ""), "PeaksTable": (peaksText, "")}
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    connection = sqlite3.connect(path)
+    connection.execute(BASELINE_POINTS)
+    lon, lat = _track()
+    sr = gt.find_utm_zone(lat[0], lon[0])
+    x, y = gt.reproject_xy(lon, lat, sr)
+    connection.executemany("INSERT INTO PointsTable VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(1091000000 + k * 1000000, "2022-07-18 16:17:%02d" % k, lon[k], lat[k], 10 * k, int(k == 3),
+                             CSV + "-path", x[k], y[k]) for k in range(len(lon))])
+    suffixes = {"BuffersTable": "-buffer", "LinesTable": "-path", "PeaksTable": "-peaks"}
+    for table, (text, esri) in _baseline_layers(lon, lat).items():
+        connection.execute(BASELINE_LAYER.format(tableName=table))
+        connection.execute(f"INSERT INTO {table} VALUES (?, ?, ?)", [text, CSV + suffixes[table], esri])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def _layer(connection, table):
+    blob, sr = connection.execute(f'SELECT "Geometry", "Utm_zone" FROM {table}').fetchone()
+    return gt.reproject(wkb.loads(blob), 4326, sr)
+
+
+def test_baseline_database_migrates_without_losing_geometry(baseline):
+    texts = {table: baseline.execute(f'SELECT "Geometry", "EsriGeometry" FROM {table}').fetchone()
+             for table in dbschema.LAYER_TABLES}
+    assert "np.float64(" in texts["LinesTable"][0]
+
+    assert dbschema.migrate(baseline) == 0
+    assert dbschema.schema_version(baseline) == dbschema.SCHEMA_VERSION
+    path = _layer(baseline, "LinesTable")
+    assert isinstance(path, LineString) and len(path.coords) == 10
+    lon, lat = _track()
+    assert np.allclose(path.coords, np.column_stack([lon[::6], lat[::6]]), rtol=0, atol=1e-9)
+    buffer = shape(json.loads(texts["BuffersTable"][0].replace("'", '"')))
+    assert _layer(baseline, "BuffersTable").symmetric_difference(buffer).area < 1e-12
+    # the text tables are kept as they were.
+    for table in dbschema.LAYER_TABLES:
+        assert baseline.execute(f'SELECT "Geometry", "EsriGeometry" FROM {table}{dbschema.LEGACY_SUFFIX}').fetchone() == texts[table]
+    names = {name for (name,) in baseline.execute("SELECT name FROM sqlite_master WHERE type == 'index'")}
+    assert {f"idx_{table}_source" for table in dbschema.LAYER_TABLES} <= names
+    # every layer is in its tree and has its levels.
+    for table in dbschema.LAYER_TABLES:
+        assert baseline.execute(f"SELECT count(*) FROM {dbschema.SPATIAL_INDEXES[table]}").fetchone()[0] == 1
+    assert {name for (name,) in baseline.execute(f'SELECT "Source_name" FROM {dbschema.LEVELS_TABLE}')} == {CSV + "-buffer", CSV + "-path"}
+
+
+def test_unconvertible_geometry_aborts_the_migration(baseline):
+    baseline.execute("""INSERT INTO LinesTable VALUES ("{'type': 'LineString', 'coordinates': [[nan, nan]]}", 'bad.csv-path', '')""")
+    baseline.commit()
+    with pytest.raises(sqlite3.DatabaseError, match="bad.csv-path"):
+        dbschema.migrate(baseline)
+    # the versions before the failing migration are kept, the layer tables are untouched.
+    assert dbschema.schema_version(baseline) == 2
+    assert baseline.execute('SELECT count(*) FROM LinesTable WHERE "Geometry" IS NOT NULL').fetchone()[0] == 2
+    assert not baseline.execute(f"SELECT name FROM sqlite_master WHERE name == 'LinesTable{dbschema.LEGACY_SUFFIX}'").fetchall()
+
+
+def _schema(connection):
+    return sorted(connection.execute("SELECT type, name, tbl_name FROM sqlite_master").fetchall())
+
+
+def test_partly_migrated_database_is_finished(baseline, tmp_path, monkeypatch):
+    monkeypatch.setattr(dbschema, "SCHEMA_VERSION", 4)
+    assert dbschema.migrate(baseline) == 0
+    assert dbschema.schema_version(baseline) == 4
+    monkeypatch.undo()
+    assert dbschema.migrate(baseline) == 4
+    assert dbschema.schema_version(baseline) == dbschema.SCHEMA_VERSION
+
+    fresh = sqlite3.connect(str(tmp_path / "fresh.db"))
+    assert dbschema.migrate(fresh) == 0
+    # a new database and an upgraded one end with the same tables, indexes and triggers.
+    legacy = {f"{table}{dbschema.LEGACY_SUFFIX}" for table in dbschema.LAYER_TABLES}
+    assert [row for row in _schema(baseline) if row[2] not in legacy] == _schema(fresh)
+    # migrating again is a no-op.
+    assert dbschema.migrate(baseline) == dbschema.SCHEMA_VERSION
+
+
+def test_newer_database_is_refused(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "newer.db"))
+    connection.execute(f"PRAGMA user_version = {dbschema.SCHEMA_VERSION + 1}")
+    with pytest.raises(sqlite3.DatabaseError, match="newer than this app"):
+        dbschema.migrate(connection)
+    assert connection.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0
+
+
+def test_migrate_with_a_transaction_left_open(baseline):
+    baseline.execute("UPDATE PointsTable SET CH4 = 1 WHERE rowid == 1")
+    assert baseline.in_transaction
+    dbschema.migrate(baseline)
+    assert dbschema.schema_version(baseline) == dbschema.SCHEMA_VERSION
+    assert baseline.execute("SELECT CH4 FROM PointsTable WHERE rowid == 1").fetchone()[0] == 1
@@ -0,0 +1,104 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import csvprocessing as cp
+import dfcache
+
+SNIFFER = "Timestamp(ms),SenseLong,SenseLat,CH4,Alt\n" + "".join(
+    "%d,%.7f,%.7f,%.1f,15.0\n" % (1658161075000 + 250 * k, -83.5561 + 1e-6 * k, 42.4065 + 2e-6 * k, 10 + k % 7)
+    for k in range(300))
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(dfcache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(dfcache, "CACHE_MAX_BYTES", 1 << 30)
+    return tmp_path / "cache"
+
+
+def _frame(n=100):
+    return pd.DataFrame({"Microsec": np.arange(n, dtype="float64"), "CH4": np.linspace(0, 10, n), "Source_Name": "a.csv-path"})
+
+
+def test_file_key_follows_content_and_cleaner_version(tmp_path, monkeypatch):
+    path = tmp_path / "flight.csv"
+    path.write_text(SNIFFER)
+    key = dfcache.file_key(str(path), "SnifferDrone")
+    assert dfcache.file_key(str(path), "SnifferDrone") == key
+    assert dfcache.file_key(str(path), "Inficon") != key
+    # a file object from its current position, left where it was.
+    source = io.StringIO(SNIFFER)
+    assert dfcache.file_key(source, "SnifferDrone") == key
+    assert source.tell() == 0
+    path.write_text(SNIFFER.replace("15.0\n", "15.5\n", 1))
+    assert dfcache.file_key(str(path), "SnifferDrone") != key
+    path.write_text(SNIFFER)
+    monkeypatch.setattr(cp, "CLEANER_VERSION", cp.CLEANER_VERSION + 1)
+    assert dfcache.file_key(str(path), "SnifferDrone") != key
+
+
+def test_put_get_round_trip(cache):
+    assert dfcache.get("missing") is None
+    assert dfcache.put("k", _frame())
+    pd.testing.assert_frame_equal(dfcache.get("k"), _frame())
+    assert [i for i in os.listdir(cache) if i.endswith(".tmp")] == []
+
+
+def _age(key, seconds):
+    path = dfcache._entry_path(key)
+    os.utime(path, (seconds, seconds))
+
+
+def test_evict_removes_least_recently_used(cache):
+    for k, key in enumerate(["a", "b", "c"]):
+        dfcache.put(key, _frame(2000))
+        _age(key, 1000000 + k)
+    # reading an entry marks it as recently used.
+    assert dfcache.get("a") is not None
+    size = os.path.getsize(dfcache._entry_path("a"))
+    assert dfcache.evict(2 * size + size // 2) == 1
+    assert dfcache.get("b") is None
+    assert dfcache.get("a") is not None and dfcache.get("c") is not None
+    assert dfcache.clear() == 2
+    assert dfcache._entries() == []
+
+
+def test_put_over_the_limit_evicts(cache, monkeypatch):
+    dfcache.put("old", _frame(2000))
+    _age("old", 1000000)
+    monkeypatch.setattr(dfcache, "CACHE_MAX_BYTES", os.path.getsize(dfcache._entry_path("old")) + 1)
+    dfcache.put("new", _frame(2000))
+    assert dfcache.get("old") is None and dfcache.get("new") is not None
+
+
+def test_write_failures_do_not_stop_loading(cache, tmp_path, monkeypatch):
+    path = tmp_path / "flight.csv"
+    path.write_text(SNIFFER)
+    # the cache directory cannot be created, e.g. a read-only home.
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(dfcache, "CACHE_DIR", str(blocker / "cache"))
+    assert not dfcache.put("k", _frame())
+    df = dfcache.load_sniffer(str(path), "flight.csv-path")
+    assert len(df) > 0 and "Utmlong" in df
+    # replacing the entry fails, e.g. a file locked on Windows.
+    monkeypatch.setattr(dfcache, "CACHE_DIR", str(cache))
+
+    def locked(src, dst):
+        raise PermissionError(13, "Permission denied", dst)
+
+    monkeypatch.setattr(dfcache.os, "replace", locked)
+    pd.testing.assert_frame_equal(dfcache.load_sniffer(str(path), "flight.csv-path"), df)
+    assert os.listdir(cache) == []
+
+
+def test_cached_frame_is_renamed(cache, tmp_path):
+    path = tmp_path / "flight.csv"
+    path.write_text(SNIFFER)
+    first = dfcache.load_sniffer(str(path), "flight.csv-path")
+    again = dfcache.load_sniffer(str(path), "copy.csv-path")
+    assert len(dfcache._entries()) == 1
+    assert (again["Source_Name"] == "copy.csv-path").all()
+    pd.testing.assert_frame_equal(again.drop(columns="Source_Name"), first.drop(columns="Source_Name"), check_dtype=False)
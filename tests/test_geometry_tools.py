@@ -0,0 +1,159 @@
+import warnings
+import numpy as np
+import pytest
+from shapely.geometry import LineString, MultiPoint, Point, Polygon
+import geometry_tools as gt
+
+
+def legacy_rdp(points, epsilon):
+    # the recursive rdp before rdp_indices, the reference output.
+    start = np.tile(np.expand_dims(points[0], axis=0), (points.shape[0], 1))
+    end = np.tile(np.expand_dims(points[-1], axis=0), (points.shape[0], 1))
+    with warnings.catch_warnings():
+        # numpy 2 deprecates np.cross on 2d vectors.
+        warnings.simplefilter("ignore", DeprecationWarning)
+        dist_point_to_line = np.abs(np.cross(end - start, points - start, axis=-1)) / np.linalg.norm(end - start, axis=-1)
+    max_idx = np.argmax(dist_point_to_line)
+    max_value = dist_point_to_line[max_idx]
+
+    result = []
+    if max_value > epsilon:
+        partial_results_left = legacy_rdp(points[:max_idx + 1], epsilon)
+        result += [list(i) for i in partial_results_left if list(i) not in result]
+        partial_results_right = legacy_rdp(points[max_idx:], epsilon)
+        result += [list(i) for i in partial_results_right if list(i) not in result]
+    else:
+        result += [points[0], points[-1]]
+    return result
+
+
+def legacy_indices(points, epsilon):
+    # the tracks have unique points, so every kept coordinate maps back to one index.
+    index = {tuple(p): k for k, p in enumerate(points.tolist())}
+    return [index[tuple(float(v) for v in p)] for p in legacy_rdp(points, epsilon)]
+
+
+def _straight(n=200):
+    t = np.linspace(0, 1, n)
+    return np.column_stack([-83.5 + 0.01 * t, 42.4 + 0.005 * t])
+
+
+def _zigzag(n=201):
+    x = np.arange(n) * 1e-5 - 83.5
+    y = 42.4 + np.where(np.arange(n) % 2, 3e-5, 0.0) + np.arange(n) * 1e-7
+    return np.column_stack([x, y])
+
+
+def _dense(n=2000, seed=3):
+    r = np.random.default_rng(seed)
+    xy = np.round(np.cumsum(r.normal(0, 1e-5, (n, 2)), axis=0) + [-83.5, 42.4], 7)
+    return xy[np.sort(np.unique(xy, axis=0, return_index=True)[1])]
+
+
+@pytest.mark.parametrize("track, epsilon", [(_straight(), 0.0001), (_straight(), 0.0),
+                                            (_zigzag(), 0.0001), (_zigzag(), 1e-5), (_zigzag(), 0.0),
+                                            (_dense(), 0.0001), (_dense(), 1e-5), (_dense(), 0.0)])
+def test_rdp_indices_match_recursive_rdp(track, epsilon):
+    keep = gt.rdp_indices(track, epsilon)
+    assert keep.tolist() == legacy_indices(track, epsilon)
+    assert gt.rdp(track, epsilon) == [[float(v) for v in p] for p in legacy_rdp(track, epsilon)]
+
+
+def test_rdp_indices_shapes():
+    straight = _straight()
+    assert gt.rdp_indices(straight, 0.0).tolist() == [0, len(straight) - 1]
+    # every zig-zag corner is further than epsilon from its neighbours' chord.
+    assert gt.rdp_indices(_zigzag(), 1e-5).tolist() == list(range(len(_zigzag())))
+    # like the recursive rdp, a single point is returned as first and last point.
+    assert gt.rdp_indices(straight[:1], 0.0).tolist() == [0, 0]
+    assert gt.rdp_indices(straight[:2], 0.0).tolist() == [0, 1]
+
+
+def test_rdp_long_track_has_no_recursion_limit():
+    track = _zigzag(50001)
+    assert len(gt.rdp_indices(track, 0.0)) == len(track)
+
+
+def _utm_walk(n=800, seed=2):
+    # one meter steps with a jump every 97 samples, the track crosses and turns back on itself.
+    r = np.random.default_rng(seed)
+    step = r.normal(0, 1, (n, 2))
+    step[::97] *= 25
+    return np.cumsum(step, axis=0) + [300000, 4700000]
+
+
+def _turn_back():
+    # out along a straight line and back past the start, rdp keeps only the two ends.
+    x = np.concatenate([np.arange(0, 40.0), np.arange(39.0, -20, -1)])
+    return np.column_stack([x, np.zeros(len(x))]) + [300000, 4700000]
+
+
+# the chord error of 15 m circles with 6 segments per quarter circle is 0.13 m.
+CHORD_ERROR = 0.13
+
+
+@pytest.mark.parametrize("track, tolerance", [(_utm_walk(), 0.25), (_utm_walk(seed=33), 0.5), (_utm_walk(seed=5), 1.0),
+                                              (_turn_back(), 0.5)])
+def test_coverage_buffer_within_tolerance(track, tolerance):
+    exact = MultiPoint(track).buffer(15, quad_segs=6)
+    approx = gt.coverage_buffer(track, 15, tolerance=tolerance)
+    slack = tolerance + CHORD_ERROR
+    assert exact.difference(approx.buffer(slack)).area < 1e-6
+    assert approx.difference(exact.buffer(slack)).area < 1e-6
+    assert abs(approx.area - exact.area) / exact.area < 0.005
+
+
+def test_coverage_buffer_zero_tolerance_is_exact():
+    track = _utm_walk(200)
+    assert gt.coverage_buffer(track, 15, tolerance=0).equals(MultiPoint(track).buffer(15, quad_segs=6))
+
+
+@pytest.mark.parametrize("radius", [13.57884, 5.876544, 1.0])
+@pytest.mark.parametrize("quad_segs", [1, 6, 16])
+def test_peak_rings_match_shapely_buffer(radius, quad_segs):
+    centers = np.array([[0.0, 0.0], [300000.25, 4700000.5], [712345.678, 5123456.789], [-12.5, 3.0]])
+    rings = gt.peak_rings(centers, radius, quad_segs)
+    assert rings.shape == (len(centers), 4 * quad_segs + 1, 2)
+    for center, ring in zip(centers, rings):
+        exact = np.array(Point(center).buffer(radius, quad_segs=quad_segs).exterior.coords)
+        # same vertices in the same order, up to the rounding of the translation.
+        np.testing.assert_allclose(ring, exact, rtol=0, atol=1e-8)
+        assert Polygon(ring).equals(Point(center).buffer(radius, quad_segs=quad_segs))
+
+
+def test_circle_template_is_cached_and_read_only():
+    template = gt.circle_template(13.57884, 6)
+    assert gt.circle_template(13.57884, 6) is template
+    assert not template.flags.writeable
+    np.testing.assert_array_equal(template[0], template[-1])
+
+
+def _wavy(n=3000, seed=7):
+    # a wavy flight line of about 3 km with a little noise.
+    t = np.linspace(0, 3000, n)
+    noise = np.random.default_rng(seed).normal(0, 0.2, (n, 2))
+    return np.column_stack([t, 200 * np.sin(t / 150)]) + noise + [300000, 4700000]
+
+
+@pytest.mark.parametrize("geom", [LineString(_wavy()).buffer(15, quad_segs=6), LineString(_wavy(seed=8))],
+                         ids=["buffer", "path"])
+def test_lod_levels_stay_within_a_pixel(geom):
+    lat = 42.4
+    levels = gt.lod_levels(geom, lat, [16, 8, 12, 10, 14])
+    assert len(levels) > 1
+    zooms = [zoom for zoom, _ in levels]
+    assert zooms == sorted(zooms)
+    counts = [gt.num_coordinates(simple) for _, simple in levels]
+    # every level keeps more vertices than the one below it and fewer than the full geometry.
+    assert all(a < b for a, b in zip(counts, counts[1:]))
+    assert counts[-1] < gt.num_coordinates(geom)
+    # GEOS may also drop the start point of a ring, which can move the ring by up to two tolerances there.
+    pixels = 2 if geom.geom_type == "Polygon" else 1
+    for zoom, simple in levels:
+        assert simple.is_valid and simple.geom_type == geom.geom_type
+        assert simple.hausdorff_distance(geom) <= pixels * gt.zoom_resolution(zoom, lat) + 1e-6
+
+
+def test_lod_levels_of_a_geometry_that_cannot_be_simplified():
+    square = Polygon([(0, 0), (1000, 0), (1000, 1000), (0, 1000)])
+    assert gt.lod_levels(square, 42.4, [8, 12, 16]) == []
@@ -0,0 +1,73 @@
+import json
+import numpy as np
+import pytest
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon, mapping
+import geoserial
+
+SQUARE = Polygon([(500000.123456789, 4690000.1), (500010.5, 4690000.1), (500010.5, 4690010.987654321),
+                  (500000.123456789, 4690000.1)],
+                 [[(500002.25, 4690001.0), (500004.0, 4690001.0), (500004.0, 4690003.0), (500002.25, 4690001.0)]])
+GEOMETRIES = [
+    Point(-83.55612345678912, 42.40651234567891),
+    LineString([(-83.5561, 42.4065), (-83.55611111111111, 42.40652222222222), (1e-7, -3.3333333333333335)]),
+    SQUARE,
+    MultiPolygon([SQUARE, Polygon([(0.1, 0.2), (1.3, 0.2), (1.3, 1.7), (0.1, 0.2)])]),
+]
+
+
+def _as_lists(value):
+    # mapping() gives tuples, json gives lists.
+    if isinstance(value, (list, tuple)):
+        return [_as_lists(i) for i in value]
+    if isinstance(value, dict):
+        return {k: _as_lists(v) for k, v in value.items()}
+    return value
+
+
+@pytest.mark.parametrize("geom", GEOMETRIES, ids=lambda geom: geom.geom_type)
+def test_geojson_matches_json_dumps(geom):
+    text = geoserial.geojson(geom)
+    assert json.loads(text) == json.loads(json.dumps(_as_lists(mapping(geom))))
+    # the single quoted form stored in the database.
+    assert json.loads(geoserial.geojson(geom, quote="'").replace("'", '"')) == json.loads(text)
+
+
+@pytest.mark.parametrize("geom", GEOMETRIES[2:], ids=lambda geom: geom.geom_type)
+def test_esri_polygon_keeps_full_precision(geom):
+    rings = json.loads(geoserial.esri_polygon(geom))["rings"]
+    polygons = mapping(geom)["coordinates"]
+    if geom.geom_type == "Polygon":
+        polygons = [polygons]
+    assert rings == json.loads(json.dumps(_as_lists([ring for polygon in polygons for ring in polygon])))
+
+
+def test_precision_is_opt_in():
+    point = Point(500000.123456789, 4690000.987654321)
+    assert json.loads(geoserial.geojson(point))["coordinates"] == [500000.123456789, 4690000.987654321]
+    assert geoserial.geojson(point, precision=3) == '{"type":"Point","coordinates":[500000.123,4690000.988]}'
+
+
+def test_esri_rings_from_array():
+    rings = np.array([[[0.0, 0.0], [1.5, 0.0], [1.5, 2.25], [0.0, 0.0]]])
+    assert json.loads(geoserial.esri_rings(rings)) == {"rings": rings.tolist()}
+    assert geoserial.esri_rings(rings, quote="'").startswith("{'rings':")
+
+
+@pytest.mark.parametrize("value", [np.nan, np.inf, -np.inf])
+def test_non_finite_coordinates_raise(value):
+    with pytest.raises(ValueError):
+        geoserial.geojson(Point(value, 1.0))
+    with pytest.raises(ValueError):
+        geoserial.esri_rings(np.array([[[0.0, 0.0], [value, 1.0], [0.0, 0.0]]]))
+
+
+def test_empty_geometries():
+    assert json.loads(geoserial.geojson(LineString())) == {"type": "LineString", "coordinates": []}
+    assert json.loads(geoserial.esri_polygon(Polygon())) == {"rings": []}
+
+
+def test_feature_json_numpy_attributes():
+    feature = {"attributes": {"CH4": np.float64(2.5), "ORIG_FID": np.int64(3)},
+               "geometry": geoserial.esri_rings([[(0.0, 0.0), (1.0, 0.0), (0.0, 0.0)]])}
+    assert json.loads(geoserial.feature_json(feature)) == {
+        "attributes": {"CH4": 2.5, "ORIG_FID": 3}, "geometry": {"rings": [[[0.0, 0.0], [1.0, 0.0], [0.0, 0.0]]]}}
@@ -0,0 +1,116 @@
+import gzip
+import json
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import httppool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, every request on a connection is answered on it until the client or the timeout closes it.
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    gzipped = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/drop"):
+            # the request is read, the connection closed without an answer.
+            self.close_connection = True
+            return
+        if self.path.startswith("/missing"):
+            status, text = 404, b'{"error": "missing"}'
+        else:
+            status, text = 200, json.dumps({"method": self.command, "path": self.path, "body": body.decode(),
+                                            "padding": "x" * 2000}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            text = gzip.compress(text)
+            self.send_header("Content-Encoding", "gzip")
+            type(self).gzipped += 1
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    do_GET = _answer
+    do_POST = _answer
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name in ("http_proxy", "HTTP_PROXY", "https_proxy", "HTTPS_PROXY", "all_proxy", "ALL_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+    handler = type("Handler", (_Handler,), {})
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    httppool.close_all()
+    yield handler, "http://127.0.0.1:%d" % srv.server_address[1]
+    httppool.close_all()
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_connection_is_reused(server):
+    handler, url = server
+    for k in range(5):
+        answer = json.loads(httppool.request("GET", url + "/query?n=%d" % k))
+        assert answer["path"] == "/query?n=%d" % k
+    answer = json.loads(httppool.post_form(url + "/query", {"f": "json", "where": "1=1"}))
+    assert (answer["method"], answer["body"]) == ("POST", "f=json&where=1%3D1")
+    assert handler.connections == 1
+
+
+def test_gzip_response_is_decoded(server):
+    handler, url = server
+    answer = json.loads(httppool.request("GET", url + "/query"))
+    assert handler.gzipped == 1
+    assert answer["padding"] == "x" * 2000
+
+
+def test_stale_connection_is_retried(server):
+    handler, url = server
+    httppool.request("GET", url + "/first")
+    # the server drops the idle pooled connection, the next request is sent again on a new one.
+    handler.timeout = 0.2
+    httppool.close_all()
+    httppool.request("GET", url + "/second")
+    time.sleep(0.6)
+    assert json.loads(httppool.request("GET", url + "/third"))["path"] == "/third"
+    assert handler.connections == 3
+
+
+def test_errors_are_raised_like_urlopen(server):
+    handler, url = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        httppool.request("GET", url + "/missing")
+    assert error.value.code == 404
+    # the connection stays usable after an error status.
+    httppool.request("GET", url + "/query")
+    assert handler.connections == 1
+    with pytest.raises(urllib.error.URLError):
+        httppool.request("GET", "ftp://127.0.0.1/")
+    httppool.close_all()
+    with pytest.raises(urllib.error.URLError):
+        httppool.request("GET", "http://127.0.0.1:1/", timeout=2)
+
+
+def test_lost_response_is_told_apart(server):
+    handler, url = server
+    with pytest.raises(httppool.ResponseLost):
+        httppool.post_form(url + "/drop", {"f": "json"})
+    # a request that could not be sent is a plain URLError.
+    httppool.close_all()
+    with pytest.raises(urllib.error.URLError) as error:
+        httppool.request("GET", "http://127.0.0.1:1/", timeout=2)
+    assert not isinstance(error.value, httppool.ResponseLost)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import dfcache
+import ingest
+
+
+def _write_sniffer(path, n, seed):
+    r = np.random.default_rng(seed)
+    pd.DataFrame({"Timestamp(ms)": 1658161075000 + np.arange(n) * 250,
+                  "SenseLong": np.round(-83.5561 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7),
+                  "SenseLat": np.round(42.4065 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7),
+                  "CH4": np.abs(r.normal(50, 80, n)).round(1), "Alt": 15.0}).to_csv(path, index=False)
+
+
+def _write_inficon(path, n, seed):
+    r = np.random.default_rng(seed)
+    times = pd.to_datetime(1658161075000 + np.arange(n) * 1000, unit="ms")
+    with open(path, "w", newline="") as f:
+        f.write("Inficon header\r\nline2,x\r\n\r\n")
+        pd.DataFrame({"Date": times.strftime("%m/%d/%Y"), "Time": times.strftime("%H:%M:%S"),
+                      "Long": np.round(-97.5 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7),
+                      "Lat": np.round(35.4 + r.normal(0, 1e-4, n).cumsum() * 0.01, 7),
+                      "CH4": np.abs(r.normal(2, 1, n)).round(2)}).to_csv(f, index=False)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "csvs"
+    folder.mkdir()
+    for k in range(5):
+        _write_sniffer(folder / f"sniffer{k}.csv", 2000 + 500 * k, k)
+    for k in range(2):
+        _write_inficon(folder / f"inficon{k}.csv", 1500, k)
+    return folder
+
+
+def _ingest(folder, names, taskType, workers, cacheDir, monkeypatch):
+    # a cache of its own for every run, so no run reads frames written by another.
+    monkeypatch.setattr(dfcache, "CACHE_DIR", str(cacheDir))
+    return ingest.ingest_csvs(str(folder), names, taskType, workers)
+
+
+@pytest.mark.parametrize("taskType, names", [("SnifferDrone", [f"sniffer{k}.csv" for k in (3, 0, 4, 1, 2)]),
+                                             ("Inficon", ["inficon1.csv", "inficon0.csv"])])
+def test_process_pool_matches_serial(folder, tmp_path, monkeypatch, taskType, names):
+    serial = _ingest(folder, names, taskType, 1, tmp_path / "serial", monkeypatch)
+    pooled = _ingest(folder, names, taskType, 3, tmp_path / "pooled", monkeypatch)
+    assert len(serial) == len(pooled) == len(names)
+    for name, a, b in zip(names, serial, pooled):
+        assert a["Source_Name"].iloc[0] == name
+        pd.testing.assert_frame_equal(a, b)
+
+
+def test_wrong_type_is_none_in_order(folder, tmp_path, monkeypatch):
+    names = ["inficon0.csv", "sniffer0.csv", "inficon1.csv"]
+    result = _ingest(folder, names, "Inficon", 2, tmp_path / "cache", monkeypatch)
+    assert result[1] is None
+    assert [i["Source_Name"].iloc[0] for i in (result[0], result[2])] == ["inficon0.csv", "inficon1.csv"]
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pyproj
+from shapely.geometry import MultiPoint, Polygon
+import geometry_tools as gt
+
+
+def legacy_transformer(dest_cs, source_cs=4326):
+    # the per call transformer of reproject before the array helpers, the reference output.
+    return pyproj.Transformer.from_proj(pyproj.Proj(source_cs), pyproj.Proj(dest_cs), always_xy=True)
+
+
+def _lonlat(n=500, seed=0):
+    r = np.random.default_rng(seed)
+    return np.column_stack([-83.5561 + r.normal(0, 1e-4, n).cumsum(), 42.4065 + r.normal(0, 1e-4, n).cumsum()])
+
+
+def test_reproject_xy_matches_per_point_projection():
+    lonlat = _lonlat()
+    project = legacy_transformer(32617)
+    expected = np.array([project.transform(x, y) for x, y in lonlat])
+    x, y = gt.reproject_xy(lonlat[:, 0], lonlat[:, 1], 32617)
+    np.testing.assert_array_equal(np.column_stack([x, y]), expected)
+
+
+def test_reproject_matches_per_point_projection():
+    polygon = MultiPoint(_lonlat(50)).convex_hull.buffer(1e-4)
+    assert isinstance(polygon, Polygon)
+    project = legacy_transformer(32617)
+    expected = Polygon([project.transform(x, y) for x, y in polygon.exterior.coords])
+    assert gt.reproject(polygon, 32617).equals_exact(expected, 0)
+
+
+def test_points_and_multipoint_from_xy():
+    lonlat = _lonlat(20)
+    points = gt.points_from_xy(lonlat[:, 0], lonlat[:, 1])
+    assert [(i.x, i.y) for i in points] == [tuple(i) for i in lonlat.tolist()]
+    assert gt.multipoint_from_xy(lonlat[:, 0], lonlat[:, 1]).equals_exact(MultiPoint(lonlat), 0)
+
+
+def test_project_df_adds_utm_columns():
+    lonlat = _lonlat()
+    df = pd.DataFrame({"SenseLong": lonlat[:, 0], "SenseLat": lonlat[:, 1]})
+    assert gt.project_df(df) == df.attrs["utm_zone"] == 32617
+    project = legacy_transformer(32617)
+    np.testing.assert_array_equal(df[["Utmlong", "Utmlat"]].to_numpy(),
+                                  np.array([project.transform(x, y) for x, y in lonlat]))
+    np.testing.assert_array_equal(np.asarray(gt.utm_multipoint(df).geoms[3].coords)[0], df[["Utmlong", "Utmlat"]].to_numpy()[3])
+
+
+def legacy_find_utm_zone(lat, lon):
+    # the CRS lookup of find_utm_zone before the arithmetic EPSG codes, the reference output.
+    zone = int(np.ceil((lon + 180) / 6))
+    return int(pyproj.CRS.from_dict({"proj": "utm", "zone": zone, "south": not lat > 0}).to_authority()[1])
+
+
+def test_find_utm_zone_matches_crs_lookup():
+    for lat in (-80.0, -33.9, -0.1, 0.0, 0.1, 42.4, 84.0):
+        for lon in np.arange(-179.0, 180.0, 7.25).tolist() + [-6.0, 0.0, 6.0, 179.9]:
+            assert gt.find_utm_zone(lat, lon) == legacy_find_utm_zone(lat, lon), (lat, lon)
+    # the antimeridian stays in zone 1 instead of zone 0.
+    assert gt.find_utm_zone(42.4, -180.0) == 32601
+    assert gt.find_utm_zone(-42.4, 180.0) == 32760
+
+
+def test_transformers_are_reused():
+    gt._transformer.cache_clear()
+    gt.reproject_xy([-83.5], [42.4], 32617)
+    gt.reproject(MultiPoint(_lonlat(5)), 32617)
+    info = gt._transformer.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
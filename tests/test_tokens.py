@@ -0,0 +1,109 @@
+import json
+import pickle
+import threading
+import pytest
+import arcgis
+import httppool
+
+PORTAL = "https://portal.example.com"
+LAYER = "https://services.example.com/arcgis/rest/services/Buffers/FeatureServer/0"
+
+
+class FakePortal:
+    # stands in for httppool.post_form: a portal that hands out numbered tokens and a layer that checks them.
+    def __init__(self, lifetime=900):
+        self.lifetime = lifetime
+        self.now = 1000000.0
+        self.generated = 0
+        self.valid = set()
+        self.requests = []
+        # tokens are rejected by the layer even right after they are generated.
+        self.rejectAll = False
+
+    def __call__(self, url, params, timeout=None):
+        if url == PORTAL + "/sharing/rest/generateToken":
+            if params["password"] == "bad":
+                return json.dumps({"error": {"code": 400, "message": "Invalid username or password."}}).encode()
+            self.generated += 1
+            token = "token%d" % self.generated
+            self.valid.add(token)
+            return json.dumps({"token": token, "expires": int((self.now + self.lifetime) * 1000)}).encode()
+        self.requests.append(params["token"])
+        if self.rejectAll or params["token"] not in self.valid:
+            return json.dumps({"error": {"code": 498, "message": "Invalid token."}}).encode()
+        return json.dumps({"features": []}).encode()
+
+
+@pytest.fixture
+def portal(monkeypatch):
+    fake = FakePortal()
+    monkeypatch.setattr(httppool, "post_form", fake)
+    monkeypatch.setattr(arcgis.time, "time", lambda: fake.now)
+    return fake
+
+
+def test_token_is_reused_until_close_to_expiry(portal):
+    manager = arcgis.TokenManager("user", "secret", PORTAL)
+    assert manager.token() == "token1"
+    portal.now += portal.lifetime - arcgis.TOKEN_REFRESH_MARGIN - 1
+    assert manager.token() == "token1"
+    portal.now += 2
+    assert manager.token() == "token2"
+    assert portal.generated == 2
+
+
+def test_rejected_token_is_generated_again_once(portal):
+    manager = arcgis.TokenManager("user", "secret", PORTAL)
+    manager.token()
+    # the service revokes the token before its expiry.
+    portal.valid.clear()
+    assert arcgis.post_with_token(LAYER + "/query", {"where": "1=1"}, manager) == {"features": []}
+    assert portal.requests == ["token1", "token2"]
+    # a token that keeps being rejected is retried only once.
+    portal.rejectAll, portal.requests = True, []
+    output = arcgis.post_with_token(LAYER + "/query", {"where": "1=1"}, manager)
+    assert output["error"]["code"] == 498
+    assert len(portal.requests) == 2
+
+
+def test_invalidate_ignores_a_replaced_token(portal):
+    manager = arcgis.TokenManager("user", "secret", PORTAL)
+    manager.token()
+    manager.invalidate("token1")
+    assert manager.token() == "token2"
+    # a late invalidate of the old token, from another thread, keeps the new one.
+    manager.invalidate("token1")
+    assert manager.token() == "token2"
+
+
+def test_plain_token_string_is_sent_as_it_is(portal):
+    output = arcgis.post_with_token(LAYER + "/query", {"where": "1=1"}, "expired")
+    assert output["error"]["code"] == 498
+    assert portal.requests == ["expired"]
+
+
+def test_failed_login_raises(portal):
+    with pytest.raises(RuntimeError, match="generateToken failed"):
+        arcgis.TokenManager("user", "bad", PORTAL).token()
+
+
+def test_pickle_round_trip(portal):
+    manager = arcgis.TokenManager("user", "secret", PORTAL)
+    manager.token()
+    copy = pickle.loads(pickle.dumps(manager))
+    assert (copy.userName, copy.passWord, copy.portal, copy._token, copy._expires) == \
+        (manager.userName, manager.passWord, manager.portal, manager._token, manager._expires)
+    assert copy._lock is not manager._lock and isinstance(copy._lock, type(threading.Lock()))
+    # the copy keeps using the token and refreshes on its own.
+    assert copy.token() == "token1"
+    portal.now += portal.lifetime
+    assert copy.token() == "token2"
+    assert manager._token == "token1"
+
+
+def test_token_manager_is_shared_per_user_and_portal(portal, monkeypatch):
+    monkeypatch.setattr(arcgis, "_managers", {})
+    manager = arcgis.token_manager("user", "secret", PORTAL)
+    assert arcgis.token_manager("user", "secret", PORTAL) is manager
+    assert arcgis.token_manager("user", "changed", PORTAL) is not manager
+    assert arcgis.token_manager("other", "secret", PORTAL) is not arcgis.token_manager("user", "changed", PORTAL)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import csvprocessing as cp
+import geometry_tools as gt
+import uploader
+
+
+def _cleaned(n=200, seed=0):
+    r = np.random.default_rng(seed)
+    ch4 = np.abs(r.normal(50, 20, n)).round(1)
+    ch4[[40, 120]] = [900.0, 650.0]
+    df = pd.DataFrame({"Timestamp(ms)": 1658161075000 + np.arange(n) * 250,
+                       "SenseLong": np.round(-83.5561 + np.arange(n) * 1e-5, 7),
+                       "SenseLat": np.round(42.4065 + r.normal(0, 1e-6, n).cumsum(), 7),
+                       "CH4": ch4, "Alt": 15.0})
+    df = cp.clean_flight_log("a.csv", df)
+    gt.project_df(df)
+    return df
+
+
+def _uploader(taskType):
+    # preprocess only reads the inspection type, no window is needed.
+    u = uploader.uploader.__new__(uploader.uploader)
+    u.taskType = taskType
+    return u
+
+
+def test_preprocess_shares_read_only_utm_coordinates():
+    df = _cleaned()
+    csv = _uploader("SnifferDrone").preprocess(df)
+    assert csv.sourceName == "a.csv" and csv.sr == df.attrs["utm_zone"] == 32617
+    np.testing.assert_array_equal(csv.utm, df[["Utmlong", "Utmlat"]].to_numpy())
+    with pytest.raises(ValueError):
+        csv.utm[0, 0] = 0.0
+    # the peaks are found once here, not by the upload threads.
+    assert csv.df is df
+    assert df.index[df["Peak"] == 1].tolist() == [40, 120]
+
+
+def test_preprocess_leaves_inficon_without_peaks():
+    df = _cleaned()
+    csv = _uploader("Inficon").preprocess(df)
+    assert "Peak" not in csv.df.columns
+    assert len(csv.utm) == len(df)
@@ -4,17 +4,23 @@ import json
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
+import appendjournal
+import arcgis
 import csvprocessing as cp
+import dbpool
+import ingest
 import geometry_tools as gt
-import urllib
-import urllib.request
+import geoserial
 import collections
-from shapely.geometry import mapping, Point
 import warnings
 from shapely.errors import ShapelyDeprecationWarning
 from threading import Thread
 warnings.filterwarnings("ignore", category=ShapelyDeprecationWarning) 
 
+# per csv result of uploader.preprocess shared by the upload threads:
+# source name, utm zone, (n, 2) read only array of utm coordinates and the cleaned dataframe.
+PreprocessedCsv = collections.namedtuple("PreprocessedCsv", ["sourceName", "sr", "utm", "df"])
+
 class uploader:
     def __init__(self):
         # basic metaData info
@@ -28,9 +34,13 @@ class uploader:
         self.manualPointsUrl = None
         self.manualBufferUrl = None
         self.validMetaData = False
+        # append journal beside the metaData json, see appendjournal.py
+        self.journal = None
         # basic input csv info
         self.inputCsvs = []
         self.csvDict = {}
+        # number of processes cleaning csvs, None for one per cpu
+        self.ingestWorkers = ingest.WORKERS
         ''' appended check
         Every time app starts/restarts: self.appRestarted is true
 
@@ -56,7 +66,7 @@ class uploader:
         clear self.ipnutCsv after this batch append.
         '''
         self.appRestarted = True
-        self.summary = {"points":[], "polySuc":[], "polyFail":[], "peakSuc":[], "peakFail":[], "invalid":[]}
+        self.summary = {"points":[], "pointFail":[], "polySuc":[], "polyFail":[], "peakSuc":[], "peakFail":[], "invalid":[]}
         # basic gui set up
         self.window = tk.Tk()
         self.canvas = tk.Canvas(self.window, width = 500, height = 320,  relief = 'raised')
@@ -124,62 +134,45 @@ class uploader:
                 self.droneBufferUrl = data["List of Layers and types"]["dronebuffer"]
                 self.dronePointUrl = data["List of Layers and types"]["dronepoints"]
                 self.dronePeakUrl = data["List of Layers and types"]["peaks"]
+            # chunks of every append are recorded, so an interrupted batch is resumed by the next append.
+            self.journal = appendjournal.AppendJournal(os.path.splitext(metaData)[0] + "_journal.db", project=False)
             self.validMetaData = True
         except: 
             messagebox.showerror("Error", "Invalid metadata!")
             self.validMetaData = False
             return
 
-    def readInficonDf(self, csvPath):
-        with open(csvPath, "r") as file:
-            if file.read(1) == "I":
-                while file.readline() != '\n':
-                    pass
-                df = pd.read_csv(file)
-            else:
-                df = None
-        return df 
-
     def searchCsv(self):
         path = filedialog.askdirectory()
         self.csvEntry.delete(0, tk.END)
         self.csvEntry.insert(tk.END, path)
 
     def preprocess(self, cleanedDf):
-        gt.add_points_to_df(cleanedDf)
-        points = gt.series_to_multipoint(cleanedDf["points"])
-        sr = gt.find_utm_zone(points[0].y, points[0].x)
-        points = gt.reproject(points, sr)
-        return points, cleanedDf
-
-    def toEsriGeometry(self, geoJson):
-        esriGeometry = {'rings': []}
-        if geoJson["type"] == 'Polygon':
-            for i in geoJson["coordinates"]:
-                    esriGeometry['rings'].append(i)
-        else:
-            for i in geoJson["coordinates"]:
-                for j in i:
-                    esriGeometry['rings'].append(j)
-        return json.dumps(esriGeometry)
- 
-    def createBuff(self, points):
-        buff = points.buffer(15, resolution=6)
-        rawJson = mapping(buff)
-        esriJson = self.toEsriGeometry(rawJson)
-        return json.loads(esriJson)
+        # done once per csv before the upload threads start, the threads only read the result.
+        # cleanedDf is already projected by dfcache, see geometry_tools.project_df
+        if self.taskType != "Inficon":
+            cp.find_ch4_peaks(cleanedDf)
+        utm = cleanedDf[["Utmlong", "Utmlat"]].to_numpy()
+        utm.flags.writeable = False
+        return PreprocessedCsv(sourceName=cleanedDf["Source_Name"][0],
+                               sr=cleanedDf.attrs["utm_zone"],
+                               utm=utm,
+                               df=cleanedDf)
+
+    def createBuff(self, utm):
+        buff = gt.coverage_buffer(utm, 15, quad_segs=6)
+        # esri json string, written as it is into the addFeatures chunks by geoserial.feature_json, see arcgis._feature_chunks
+        return geoserial.esri_polygon(buff)
 
     def get_token(self, userName, passWord):
-        referer = "http://www.arcgis.com/"
-        query_dict = {'username': userName, 'password': passWord, 'referer': referer, 'expiration': 900}
-        query_string = urllib.parse.urlencode(query_dict).encode('utf-8')
-        url = "https://www.arcgis.com/sharing/rest/generateToken"
-        token = json.loads(urllib.request.urlopen(url + "?f=json", query_string).read())
-        if "token" not in token:
-            # print(token['error'])
+        # cached token of the user, generated again shortly before it expires so long batches keep working.
+        token = arcgis.token_manager(userName, passWord)
+        try:
+            token.token()
+        except (RuntimeError, OSError) as error:
+            print(error)
             return None
-        else:
-            return token["token"]
+        return token
 
     def login(self):
         userName = self.userNameEntry.get()
@@ -198,88 +191,64 @@ class uploader:
             messagebox.showinfo("Success", "Login success!")
             self.loginSuccess = True
 
-    def query_feature(self, token, sql, targetUrl):
-        # sql = "Source_Name = 'N1_15_2.8_20220620_153056.csv'"
-        query_dict = {"f": "json", "token": token, "where": sql}
-        jsonResponse = urllib.request.urlopen(targetUrl + r"/query", urllib.parse.urlencode(query_dict).encode('utf-8'))
-        jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-        if len(jsonOutput["features"]) > 0:
-            return True
-        else:
-            return False
+    def uploadedNames(self, targetUrl):
+        # source names of the input csvs not to collect: those in chunks left unfinished in the journal, which
+        # add_features sends first, and after a restart those already in the target layer, checked with one
+        # batched query instead of one per csv.
+        unfinished = self.journal.unfinished_names(targetUrl) if self.journal else set()
+        if not self.appRestarted:
+            return unfinished
+        names = [i.sourceName for i in self.inputCsvs if i.sourceName not in unfinished]
+        try:
+            return arcgis.existing_source_names(self.token, targetUrl, names) | unfinished
+        except (RuntimeError, ValueError, OSError) as error:
+            # appending without the check could duplicate features, the csvs are left for the next append.
+            print("Could not check the layers already in", targetUrl, error)
+            return set(names) | unfinished
+
+    def resuming(self, targetUrl):
+        return bool(self.journal and self.journal.unfinished(targetUrl))
+
+    def appendFeatures(self, features, targetUrl, suffix, successKey, failKey, featureType):
+        # chunked and concurrent addFeatures, a layer succeeds only if all of its features are appended.
+        names, results, errors = arcgis.add_features(self.token, targetUrl, features, journal=self.journal)
+        succeeded, failed = arcgis.source_summary(names, results)
+        if errors:
+            print(featureType, "append errors:", errors)
+            self.summary["invalid"].append(featureType)
+        self.summary[successKey] += [i + suffix for i in succeeded]
+        self.summary[failKey] += [i + suffix for i in failed]
 
     def add_point_features(self, features, targetUrl):
-        appending_dict = {"f": "json",
-                    "token": self.token,
-                    "features": features}
-        urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
-
-    def add_peak_features(self, features, targetUrl, peaksDict):
-        appending_dict = {"f": "json",
-                    "token": self.token,
-                    "features": features}
-        jsonResponse = urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
-        jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-        if "error" in jsonOutput.keys():
-            self.summary["invalid"].append("peaks")
-        else:
-            appendIndex = 0
-            skippedIndexNumber = 0
-            while appendIndex < len(jsonOutput['addResults']):
-                result = jsonOutput['addResults'][appendIndex]
-                # recombine the layer name
-                layerName = features[appendIndex]["attributes"]["Source_Name"] + "-peaks"
-                # get the total number of peaks of current appended layers and compare it with the current appendIndex
-                totalPeaksNumber = peaksDict[features[appendIndex]["attributes"]["Source_Name"]]
-                if result["success"]:
-                    # if append success and if the current index - previously skipped index + 1 = total peaks number, then add peaks layer name to the returnJson
-                    if appendIndex - skippedIndexNumber + 1 == totalPeaksNumber:
-                        self.summary["peakSuc"].append(layerName)
-                        skippedIndexNumber += totalPeaksNumber
-                    appendIndex += 1
-                else:
-                    # if append fail, skip to the index of next layer, make skipping step = old skipped index number + current total peaks number.
-                    self.summary["peakFail"].append(layerName)
-                    appendIndex = skippedIndexNumber + totalPeaksNumber
-                    skippedIndexNumber += totalPeaksNumber
+        self.appendFeatures(features, targetUrl, "-points", "points", "pointFail", "points")
+
+    def add_peak_features(self, features, targetUrl):
+        self.appendFeatures(features, targetUrl, "-peaks", "peakSuc", "peakFail", "peaks")
 
     def add_buffer_features(self, features, targetUrl):
-        appending_dict = {"f": "json",
-                    "token": self.token,
-                    "features": features}
-        jsonResponse = urllib.request.urlopen(targetUrl + r"/addFeatures", urllib.parse.urlencode(appending_dict).encode('utf-8'))
-        jsonOutput = json.loads(jsonResponse.read(), object_pairs_hook=collections.OrderedDict)
-        if "error" in jsonOutput.keys():
-            self.summary["invalid"].append("buffer")
-        else:
-            for i,j in enumerate(jsonOutput['addResults']):
-                layerName = features[i]["attributes"]["Source_Name"] + "-buffer"
-                if j['success']:
-                    self.summary["polySuc"].append(layerName)
-                else:
-                    self.summary["polyFail"].append(layerName)
+        self.appendFeatures(features, targetUrl, "-buffer", "polySuc", "polyFail", "buffer")
 
     def bufferThread(self, bufferFeatures, bufferUrl):
+        uploaded = self.uploadedNames(bufferUrl)
         for i in self.inputCsvs:
-            points, cleanedDf = self.preprocess(i)
-            sql = "Source_Name = '" + cleanedDf["Source_Name"][0] + "'"
-            if (not self.appRestarted) or (self.appRestarted and (not self.query_feature(self.token, sql, bufferUrl))):
+            utm, cleanedDf = i.utm, i.df
+            if i.sourceName not in uploaded:
                 print("Appending buffer for ", cleanedDf["Source_Name"][0])
-                geoJson = self.createBuff(points)
+                geoJson = self.createBuff(utm)
                 uploadStruct = {
                     "attributes" : {"Source_Name": cleanedDf["Source_Name"][0]},
                     "geometry" : geoJson}
                 bufferFeatures.append(uploadStruct)
-        if len(bufferFeatures) > 0:
+        if len(bufferFeatures) > 0 or self.resuming(bufferUrl):
             self.add_buffer_features(bufferFeatures, bufferUrl)
         else:
             print("No new buffer appended since last appending")
 
     def inficonPointThread(self, pointFeatures):
+        uploaded = self.uploadedNames(self.manualPointsUrl)
         for i in self.inputCsvs:
-            points, cleanedDf = self.preprocess(i)
-            sql = "Source_Name = '" + cleanedDf["Source_Name"][0] + "'"
-            if (not self.appRestarted) or (self.appRestarted and (not self.query_feature(self.token, sql, self.manualPointsUrl))):
+            utm, cleanedDf = i.utm, i.df
+            if i.sourceName not in uploaded:
                 print("Appending points for ", cleanedDf["Source_Name"][0])
                 for index,row in cleanedDf.iterrows():
                     esriPoint = {"attributes" : {
@@ -291,19 +260,18 @@ class uploader:
                                     "Source_Name" : row["Source_Name"]
                                     },
                                     "geometry" :
-                                    {"x" : points[index].x, "y" : points[index].y}}
+                                    {"x" : float(utm[index, 0]), "y" : float(utm[index, 1])}}
                     pointFeatures.append(esriPoint) 
-                self.summary["points"].append(cleanedDf["Source_Name"][0] + "-points")
-        if len(pointFeatures) > 0:
+        if len(pointFeatures) > 0 or self.resuming(self.manualPointsUrl):
             self.add_point_features(pointFeatures, self.manualPointsUrl)
         else:
             print("No new points appended since last appending")
         
     def snifferPointThread(self, pointFeatures):
+        uploaded = self.uploadedNames(self.dronePointUrl)
         for j in self.inputCsvs:
-            points, cleanedDf = self.preprocess(j)
-            sql = "Source_Name = '" + cleanedDf["Source_Name"][0] + "'"
-            if (not self.appRestarted) or (self.appRestarted and (not self.query_feature(self.token, sql, self.dronePointUrl))):
+            utm, cleanedDf = j.utm, j.df
+            if j.sourceName not in uploaded:
                 print("Appending points for ", cleanedDf["Source_Name"][0])
                 for index,row in cleanedDf.iterrows():
                     esriPoint = {"attributes" : {
@@ -314,27 +282,26 @@ class uploader:
                             "Source_Name" : row["Source_Name"]
                             },
                             "geometry" :
-                            {"x" : points[index].x, "y" : points[index].y}}
+                            {"x" : float(utm[index, 0]), "y" : float(utm[index, 1])}}
                     pointFeatures.append(esriPoint)
-                self.summary["points"].append(cleanedDf["Source_Name"][0] + "-points")
-        if len(pointFeatures) > 0:
+        if len(pointFeatures) > 0 or self.resuming(self.dronePointUrl):
             self.add_point_features(pointFeatures, self.dronePointUrl)
         else:
             print("No new points appended since last appending")
 
-    def peakThread(self, peaksFeatures, peaksDict):
+    def peakThread(self, peaksFeatures):
+        uploaded = self.uploadedNames(self.dronePeakUrl)
         for j in self.inputCsvs:
-            points, cleanedDf = self.preprocess(j)
-            sql = "Source_Name = '" + cleanedDf["Source_Name"][0] + "'"
-            if (not self.appRestarted) or (self.appRestarted and (not self.query_feature(self.token, sql, self.dronePeakUrl))): 
+            utm, cleanedDf = j.utm, j.df
+            if j.sourceName not in uploaded:
                 print("Appending peaks for ", cleanedDf["Source_Name"][0])
                 orig_id = 1
-                cp.find_ch4_peaks(cleanedDf)
                 peaks = cleanedDf[cleanedDf['Peak'] == 1]
                 if (len(peaks) > 0):
-                    peaksDict[cleanedDf["Source_Name"][0]] = len(peaks)*2
-                    for index, row in peaks.iterrows():
-                        peakCenter = Point(points[index].x, points[index].y)
+                    # outer and inner circles of every peak of this csv at once, see geometry_tools.peak_rings
+                    outerRings = gt.peak_rings(utm[peaks.index], 13.57884, quad_segs=6)
+                    innerRings = gt.peak_rings(utm[peaks.index], 5.876544, quad_segs=6)
+                    for k, (index, row) in enumerate(peaks.iterrows()):
                         outerCircle = {"attributes" : {
                         "Flight_Date": row["Flight_Date"].strftime("%m/%d/%Y, %H:%M %p"),
                         "SenseLat": row["SenseLat"],
@@ -343,9 +310,7 @@ class uploader:
                         "Source_Name" : row["Source_Name"],
                         "BUFF_DIST": 13.57884,
                         "ORIG_FID": orig_id}}
-                        outerBuffer = mapping(peakCenter.buffer(13.57884, resolution=6))
-                        esriOuterBuffer = json.loads(self.toEsriGeometry(outerBuffer))
-                        outerCircle["geometry"] = esriOuterBuffer
+                        outerCircle["geometry"] = geoserial.esri_rings(outerRings[k:k + 1])
                         peaksFeatures.append(outerCircle)
                         innerCircle = {"attributes" : {
                         "Flight_Date": row["Flight_Date"].strftime("%m/%d/%Y, %H:%M %p"),
@@ -355,15 +320,13 @@ class uploader:
                         "Source_Name" : row["Source_Name"],
                         "BUFF_DIST": 5.876544,
                         "ORIG_FID": orig_id}}
-                        innerBuffer = mapping(peakCenter.buffer(5.876544, resolution=6))
-                        esriInnerBuffer = json.loads(self.toEsriGeometry(innerBuffer))
-                        innerCircle["geometry"] = esriInnerBuffer  
+                        innerCircle["geometry"] = geoserial.esri_rings(innerRings[k:k + 1])
                         peaksFeatures.append(innerCircle)
                         orig_id += 1
                 else:
                     print("no peaks for ", cleanedDf["Source_Name"][0])
-        if len(peaksFeatures) > 0:
-            self.add_peak_features(peaksFeatures, self.dronePeakUrl, peaksDict)
+        if len(peaksFeatures) > 0 or self.resuming(self.dronePeakUrl):
+            self.add_peak_features(peaksFeatures, self.dronePeakUrl)
         else:
             print("No new peaks appended since last appending")
 
@@ -399,30 +362,20 @@ class uploader:
         all_csvs = os.listdir(path)    
         names = list(filter(lambda f: f.endswith('.csv'), all_csvs))
         tempDict = {}
-        for i in names:
-            try:
-                if self.csvDict[i]:
-                    continue
-            except:
-                if self.taskType == "Inficon":
-                    newInput = self.readInficonDf(path + "\\" + i)
-                    if not isinstance(newInput, pd.DataFrame):
-                        messagebox.showerror("Error", "Wrong csv type.")
-                        self.inputCsvs.clear()
-                        popup.destroy()
-                        return
-                    cleanedDf = cp.cleanInficon(i, newInput)
-                else:
-                    try:
-                        newInput = pd.read_csv(path + "\\" + i)
-                    except:
-                        messagebox.showerror("Error", "Wrong csv type.")
-                        popup.destroy()
-                        self.inputCsvs.clear()
-                        return
-                    cleanedDf = cp.clean_flight_log(i, newInput)
-                self.inputCsvs.append(cleanedDf)
-                tempDict[i] = 1
+        newNames = [i for i in names if not self.csvDict.get(i)]
+        # read, clean and project every new csv over the worker processes, results keep the order of newNames.
+        try:
+            cleanedDfs = ingest.ingest_csvs(path, newNames, self.taskType, self.ingestWorkers)
+        except:
+            cleanedDfs = [None]
+        for i, cleanedDf in zip(newNames, cleanedDfs):
+            if not isinstance(cleanedDf, pd.DataFrame):
+                messagebox.showerror("Error", "Wrong csv type.")
+                self.inputCsvs.clear()
+                popup.destroy()
+                return
+            self.inputCsvs.append(self.preprocess(cleanedDf))
+            tempDict[i] = 1
         self.csvDict.update(tempDict)
 
         # start appending.
@@ -441,9 +394,8 @@ class uploader:
 
             else:
                 peaksFeatures = []
-                peaksDict = {}
                 snifBufferTask = Thread(target=self.bufferThread, args=[bufferFeatures, self.droneBufferUrl])
-                snifPeakTask = Thread(target=self.peakThread, args=[peaksFeatures, peaksDict])
+                snifPeakTask = Thread(target=self.peakThread, args=[peaksFeatures])
                 SnifPointTask = Thread(target=self.snifferPointThread, args=[pointFeatures])
                 snifBufferTask.start()
                 snifPeakTask.start() 
@@ -481,7 +433,7 @@ class uploader:
                 #                 "Source_Name" : row["Source_Name"],
                 #                 "BUFF_DIST": 13.57884,
                 #                 "ORIG_FID": orig_id}}
-                #                 outerBuffer = mapping(peakCenter.buffer(13.57884, resolution=6))
+                #                 outerBuffer = mapping(peakCenter.buffer(13.57884, quad_segs=6))
                 #                 esriOuterBuffer = json.loads(self.toEsriGeometry(outerBuffer))
                 #                 outerCircle["geometry"] = esriOuterBuffer
                 #                 peaksFeatures.append(outerCircle)
@@ -529,12 +481,14 @@ class uploader:
                 # else:
                 #     print("No new points appended since last appending")
 
+            # close the journal connections of the finished append threads.
+            dbpool.end_request()
             self.appRestarted = False  
             popup.destroy()
             self.inputCsvs.clear()
             
             summary = tk.Toplevel(self.window)
-            summary.geometry("800x450")
+            summary.geometry("1060x450")
             title = tk.Label(summary, text = self.taskType + " Task Summary:")
             title.config(font=('helvetica', 15))
             title.place(x=10, y=10)
@@ -546,6 +500,13 @@ class uploader:
                 pointList.insert(tk.END, i)
             pointList.place(x=20, y=90)
 
+            pointFailL = tk.Label(summary, text = 'Points appending fail:')
+            pointFailL.place(x=800, y=60)
+            pointFailList = tk.Listbox(summary, height=8, width=34)
+            for i in self.summary["pointFail"]:
+                pointFailList.insert(tk.END, i)
+            pointFailList.place(x=800, y=90)
+
             polySucL = tk.Label(summary, text = 'Polygons appended:')
             polySucL.place(x=280, y=60)
             polySucList = tk.Listbox(summary, height=8, width=34)